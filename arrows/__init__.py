@@ -1,12 +1,43 @@
-from . import auth, google_sheets, redshift, template_renderer, gmail
-from .redshift import arrow_to_redshift, fetch_arrow, fetch_dataframe
-from .s3 import create_dataset, get_dataset, arrow_to_s3, S3Dataset
+import importlib
+
+# Submodules and their heavy dependencies (boto3, awswrangler, duckdb, polars, google api clients...)
+# are only imported on first attribute access.
+_submodules = ['auth', 'google_sheets', 'redshift', 'template_renderer', 'gmail', 's3', 'pool', 'utils', 'duckdb_session', 'sqlite', 'mysql', 'redis', 'spark']
+_attributes = {
+    'arrow_to_redshift': 'redshift',
+    'fetch_arrow': 'redshift',
+    'fetch_batches': 'redshift',
+    'fetch_dataframe': 'redshift',
+    'create_dataset': 's3',
+    'get_dataset': 's3',
+    'arrow_to_s3': 's3',
+    'S3Dataset': 's3',
+}
+
+__all__ = _submodules + list(_attributes) + ['load_credentials']
+
+
+def __getattr__(name):
+    if name in _submodules:
+        value = importlib.import_module(f'.{name}', __name__)
+    elif name in _attributes:
+        value = getattr(importlib.import_module(f'.{_attributes[name]}', __name__), name)
+    else:
+        raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
+
 
 def load_credentials():
+    from . import auth
     auth.load_aws_credentials()
     auth.load_redshift_credentials()
     auth.load_google_credentials()
-    
+
 
 # load_credentials()
 
@@ -1,12 +1,19 @@
 import os
 from pathlib import Path
 import json
-import duckdb
-from google.auth.transport.requests import Request
-from google.oauth2.credentials import Credentials
+import datetime
+import threading
+
+TOKEN_REFRESH_MARGIN = datetime.timedelta(minutes=5)
+
+_lock = threading.Lock()
+_thread_cache = threading.local()
+_google_credentials = None
+_gsheet_secret_created = False
 
 
 def load_aws_credentials():
+    from . import duckdb_session
     with open(Path.home()/'.credentials/aws_credentials.txt') as file:
         content = file.read()
 
@@ -20,7 +27,7 @@ def load_aws_credentials():
 
     os.environ.update(aws_credentials)
     
-    duckdb.execute('''
+    duckdb_session.run_setup('s3_secret', '''
                     CREATE OR REPLACE SECRET secret (
                         TYPE s3,
                         PROVIDER credential_chain
@@ -34,7 +41,16 @@ def load_redshift_credentials():
     os.environ.update(redshift_credentials)
 
 
+def load_mysql_credentials():
+    with open(Path.home()/'.credentials/mysql_credentials.json') as file:
+        mysql_credentials = json.load(file)
+    os.environ.update(mysql_credentials)
+
+
 def load_google_credentials():
+    from . import duckdb_session
+    from google.auth.transport.requests import Request
+    from google.oauth2.credentials import Credentials
     with open(Path.home()/'.credentials/google_token.json') as file:
         GOOGLE_TOKEN_JSON = json.load(file)
         
@@ -45,24 +61,80 @@ def load_google_credentials():
     }
     os.environ.update(google_credentials)
     
-    duckdb.execute(f'''
+    duckdb_session.run_setup('gsheets', '''
                     INSTALL gsheets FROM community;
                     LOAD gsheets;
+                    ''')
+    _create_gsheet_secret(creds.token)
+
 
+def _create_gsheet_secret(token):
+    from . import duckdb_session
+    global _gsheet_secret_created
+    duckdb_session.run_setup('gsheet_secret', f'''
                     CREATE OR REPLACE SECRET (TYPE gsheet, 
                                    provider access_token, 
-                                   token '{creds.token}');
+                                   token '{token}');
                     ''')
+    _gsheet_secret_created = True
 
 
 def _get_google_credentials():
-    creds = Credentials.from_authorized_user_info(json.loads(os.getenv('GOOGLE_TOKEN_JSON')))
+    # Credentials are parsed once per GOOGLE_TOKEN_JSON value and refreshed shortly before they expire.
+    # A refreshed token is written back to GOOGLE_TOKEN_JSON and to the duckdb gsheet secret.
+    from google.auth.transport.requests import Request
+    from google.oauth2.credentials import Credentials
+    global _google_credentials
+    with _lock:
+        token_json = os.getenv('GOOGLE_TOKEN_JSON')
+        if _google_credentials is None or _google_credentials[0] != token_json:
+            _google_credentials = (token_json, Credentials.from_authorized_user_info(json.loads(token_json)))
+        creds = _google_credentials[1]
+        
+        expiring = creds.expiry is not None and creds.expiry - TOKEN_REFRESH_MARGIN <= datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+        if (not creds.token or expiring) and creds.refresh_token:
+            creds.refresh(Request())
+            token_json = creds.to_json()
+            os.environ['GOOGLE_TOKEN_JSON'] = token_json
+            _google_credentials = (token_json, creds)
+            if _gsheet_secret_created:
+                _create_gsheet_secret(creds.token)
     return creds
-    
-    
-    
 
 
+def get_google_service(name, version):
+    # Discovery clients are memoized per thread (httplib2 is not thread-safe) and rebuilt
+    # only when the credentials object changes.
+    from googleapiclient.discovery import build
+    creds = _get_google_credentials()
+    services = _thread_cache.__dict__.setdefault('google_services', {})
+    cached = services.get((name, version))
+    if cached is None or cached[0] is not creds:
+        cached = (creds, build(name, version, credentials=creds, cache_discovery=False))
+        services[(name, version)] = cached
+    return cached[1]
 
 
-    
+def get_boto3_session():
+    # One boto3 Session per thread and AWS credentials, boto3 sessions are not thread-safe
+    import boto3
+    credentials = (os.getenv('AWS_ACCESS_KEY_ID'), os.getenv('AWS_SECRET_ACCESS_KEY'), os.getenv('AWS_SESSION_TOKEN'))
+    sessions = _thread_cache.__dict__.setdefault('boto3_sessions', {})
+    if credentials not in sessions:
+        sessions.clear()
+        sessions[credentials] = boto3.Session(aws_access_key_id=credentials[0],
+                                              aws_secret_access_key=credentials[1],
+                                              aws_session_token=credentials[2])
+    return sessions[credentials]
+
+
+def get_boto3_client(service_name, **kwargs):
+    session = get_boto3_session()
+    cached = getattr(_thread_cache, 'boto3_clients', None)
+    if cached is None or cached[0] is not session:
+        cached = (session, {})
+        _thread_cache.boto3_clients = cached
+    key = (service_name, tuple(sorted(kwargs.items())))
+    if key not in cached[1]:
+        cached[1][key] = session.client(service_name, **kwargs)
+    return cached[1][key]
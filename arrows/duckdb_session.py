@@ -0,0 +1,92 @@
+import threading
+
+DEFAULT_SETTINGS = {
+    # keep parquet footers and S3 object metadata across queries instead of re-fetching them per scan
+    'parquet_metadata_cache': True,
+    'enable_http_metadata_cache': True,
+}
+
+_settings = dict(DEFAULT_SETTINGS)
+# key -> statement (extensions, secrets), run once per connection
+_setup = {}
+_connection = None
+_generation = 0
+_lock = threading.RLock()
+_local = threading.local()
+
+
+def configure(**settings):
+    # Set duckdb options for every query of the library, e.g.
+    # configure(threads=16, memory_limit='8GB', temp_directory='/tmp/duckdb')
+    with _lock:
+        if _connection is not None:
+            _apply_settings(_connection, settings)
+        _settings.update(settings)
+
+
+def get_settings():
+    with _lock:
+        return dict(_settings)
+
+
+def get_connection():
+    # The shared connection, created on first use with the configured settings and setup statements
+    global _connection
+    with _lock:
+        if _connection is None:
+            import duckdb
+            connection = duckdb.connect()
+            _apply_settings(connection, _settings)
+            for statement in _setup.values():
+                connection.execute(statement)
+            _connection = connection
+        return _connection
+
+
+def connect(**settings):
+    # A separate database with its own settings on top of the configured ones, set up like the shared
+    # connection. For work whose limits (memory_limit, temp_directory) must not apply to other queries.
+    import duckdb
+    with _lock:
+        connection = duckdb.connect()
+        _apply_settings(connection, {**_settings, **settings})
+        for statement in _setup.values():
+            connection.execute(statement)
+    return connection
+
+
+def _apply_settings(connection, settings):
+    # SET after connecting rather than connect(config=...), extension settings such as
+    # parquet_metadata_cache are only known once the extension is loaded
+    from .utils import _sql_literal
+    for name, value in settings.items():
+        connection.execute(f'SET GLOBAL {name} = {_sql_literal(value)}')
+
+
+def cursor():
+    # One cursor per thread: cursors run queries concurrently and share the database,
+    # so settings, extensions and secrets only need to be set up once
+    with _lock:
+        connection = get_connection()
+        cached = getattr(_local, 'cursor', None)
+        if cached is None or cached[0] != _generation:
+            cached = (_generation, connection.cursor())
+            _local.cursor = cached
+    return cached[1]
+
+
+def run_setup(key, statement):
+    # Run statement now and again on any new connection, a later statement with the same key replaces it
+    with _lock:
+        get_connection().execute(statement)
+        _setup[key] = statement
+
+
+def close():
+    # Close the shared connection, the next query opens a new one and replays the setup statements
+    global _connection, _generation
+    with _lock:
+        if _connection is not None:
+            _connection.close()
+            _connection = None
+            _generation += 1
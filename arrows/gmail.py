@@ -1,10 +1,9 @@
-from googleapiclient.discovery import build
 from email.mime.text import MIMEText
 import base64
 import json
 import os
 
-from .auth import _get_google_credentials, load_google_credentials
+from .auth import get_google_service, load_google_credentials
 from .template_renderer import render_template
 
 
@@ -52,7 +51,7 @@ class Email():
         return self
         
     def send(self):
-        gmail_service = build("gmail", "v1", credentials=_get_google_credentials())
+        gmail_service = get_google_service("gmail", "v1")
         profile = gmail_service.users().getProfile(userId="me").execute()
         email_address = profile.get("emailAddress")
         
@@ -1,19 +1,44 @@
-import duckdb
-from googleapiclient.discovery import build
-from jinja2 import Template
 
 import os
+import re
 import json
-from google.auth.transport.requests import Request
-from google.oauth2.credentials import Credentials
-from googleapiclient.errors import HttpError
+import random
+import datetime
+import decimal
+import math
+import hashlib
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
 
-from .auth import _get_google_credentials
-from .utils import _parse_self_sql
+from .auth import get_google_service
+from . import duckdb_session
+from .template_renderer import render_string
+from .utils import _bind_tables, _evict_lru
 
+SHEET_PROPERTIES_FIELDS = 'sheets.properties(sheetId,title,index,gridProperties(rowCount,columnCount))'
 
-def get_sheet(spreadsheet_id, sheet_name):
-    sheet = Sheet(spreadsheet_id, sheet_name)
+# retries of 429/5xx responses, googleapiclient backs off exponentially between them
+NUM_RETRIES = 7
+# keep each request body under the recommended payload size
+MAX_PAYLOAD_BYTES = 2 * 1024 * 1024
+MAX_REQUESTS_PER_BATCH = 500
+# Sheets API default write quota per user
+WRITE_REQUESTS_PER_MINUTE = 60
+READ_REQUESTS_PER_MINUTE = 60
+UPLOAD_PROGRESS_DIR = Path.home()/'.cache/arrows/gsheet_uploads'
+DEFAULT_CACHE_SIZE = 1024 ** 3
+
+_read_cache = None
+
+# spreadsheet_id -> (fetched_at, [sheet properties]), shared by every SpreadSheet/Sheet object
+_snapshots = {}
+_snapshots_lock = threading.Lock()
+
+
+def get_sheet(spreadsheet_id, sheet_name, cache=None):
+    sheet = Sheet(spreadsheet_id, sheet_name, cache=cache)
     return sheet
 
 
@@ -23,8 +48,7 @@ def get_spreadsheet(spreadsheet_id):
 
 
 def create_spreadsheet(spreadsheet_name=None, parent_folder_id=None):
-    creds = _get_google_credentials()
-    drive_service = build('drive', 'v3', credentials=creds)
+    drive_service = get_google_service('drive', 'v3')
 
     spreadsheet_name = spreadsheet_name if spreadsheet_name is not None else 'Untitled'
     file_metadata = {
@@ -40,11 +64,75 @@ def create_spreadsheet(spreadsheet_name=None, parent_folder_id=None):
     return spreadsheet
 
 
-def fetch_arrow(spreadsheet_id, sheet_name, sheet_range=None, all_varchar=False, sql=None):
-    sheet = Sheet(spreadsheet_id=spreadsheet_id, sheet_name=sheet_name)
+def enable_local_cache(cache_dir=None, max_bytes=DEFAULT_CACHE_SIZE):
+    # Serve Sheet.to_arrow/to_polars/to_pandas from local Arrow files while the spreadsheet is unchanged
+    global _read_cache
+    _read_cache = ReadCache(cache_dir=cache_dir, max_bytes=max_bytes)
+    return _read_cache
+
+
+def disable_local_cache():
+    global _read_cache
+    _read_cache = None
+
+
+def fetch_arrow(spreadsheet_id, sheet_name, sheet_range=None, all_varchar=False, sql=None, cache=None, cache_ttl=None):
+    if cache_ttl:
+        # shared redis result cache, see arrows/redis.py
+        from . import redis as result_cache
+        return result_cache.cached(('google_sheets', spreadsheet_id, sheet_name, sheet_range, all_varchar, sql),
+                                   lambda: fetch_arrow(spreadsheet_id, sheet_name, sheet_range=sheet_range,
+                                                       all_varchar=all_varchar, sql=sql, cache=cache),
+                                   ttl=cache_ttl)
+    sheet = Sheet(spreadsheet_id=spreadsheet_id, sheet_name=sheet_name, cache=cache)
     arrow = sheet.to_arrow(sheet_range=sheet_range, all_varchar=all_varchar, sql=sql)
     return arrow
 
+def fetch_many(targets, all_varchar=False, max_workers=8, concat=False, source_column='source', cache=None):
+    # Read many sheets concurrently. targets are Sheet objects or
+    # (spreadsheet_id, sheet_name) / (spreadsheet_id, sheet_name, sheet_range) tuples.
+    # Returns {target: arrow}, or one table with a source column when concat=True.
+    # Each worker thread queries through its own duckdb_session cursor.
+    import pyarrow as pa
+    
+    targets = [_read_target(target) for target in targets]
+    
+    def fetch(target):
+        spreadsheet_id, sheet_name, sheet_range = target
+        _read_bucket.acquire()
+        start = time.perf_counter()
+        sheet = Sheet(spreadsheet_id=spreadsheet_id, sheet_name=sheet_name, cache=cache)
+        arrow = sheet.to_arrow(sheet_range=sheet_range, all_varchar=all_varchar)
+        return arrow, time.perf_counter() - start
+    
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(targets)))) as executor:
+        results = list(executor.map(fetch, targets))
+    elapsed = time.perf_counter() - start
+    total_rows = sum(arrow.num_rows for arrow, _ in results)
+    print(f'Success: {len(targets)} sheets ({total_rows:,} rows) read from Google Sheets in {elapsed:.1f}s, '
+          f'{sum(seconds for _, seconds in results) / max(elapsed, 1e-9):.1f}x concurrency.')
+    
+    if not concat:
+        return {target: arrow for target, (arrow, _) in zip(targets, results)}
+    
+    tables = []
+    for (spreadsheet_id, sheet_name, sheet_range), (arrow, _) in zip(targets, results):
+        source = f'{spreadsheet_id}/{sheet_name}' + (f'!{sheet_range}' if sheet_range else '')
+        tables.append(arrow.append_column(source_column, pa.array([source] * arrow.num_rows, pa.string())))
+    # sheets rarely share an exact schema, missing columns are null-filled and types unified
+    arrow = pa.concat_tables(tables, promote_options='permissive')
+    return arrow
+
+
+def _read_target(target):
+    if isinstance(target, Sheet):
+        return (target.spreadsheet_id, target.sheet_name, None)
+    if isinstance(target, str) or len(target) not in (2, 3):
+        raise ValueError(f'Expected a Sheet or a (spreadsheet_id, sheet_name[, sheet_range]) tuple, got {target!r}')
+    return (*target, None) if len(target) == 2 else tuple(target)
+
+
 def arrow_to_googlesheet(arrow, spreadsheet_id=None, sheet_name=None, spreadsheet_name=None, parent_folder_id=None, sheet=None, sheet_range=None, overwrite_sheet=True, overwrite_range=False):
     if not arrow:
         raise ValueError
@@ -64,7 +152,36 @@ def arrow_to_googlesheet(arrow, spreadsheet_id=None, sheet_name=None, spreadshee
     return sheet
 
 
+class _TokenBucket():
+    # Paces requests to rate_per_minute, allowing bursts of up to capacity requests
+    def __init__(self, rate_per_minute, capacity=None):
+        self.rate = rate_per_minute / 60
+        self.capacity = capacity if capacity is not None else rate_per_minute
+        self._tokens = self.capacity
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+        
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+                self._updated_at = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+_write_bucket = _TokenBucket(WRITE_REQUESTS_PER_MINUTE)
+_read_bucket = _TokenBucket(READ_REQUESTS_PER_MINUTE)
+
+
 class SpreadSheet():
+    # seconds a sheet metadata snapshot is trusted before it is fetched again
+    snapshot_ttl = 60
+    
     def __init__(self, spreadsheet_id):
         if isinstance(spreadsheet_id, SpreadSheet):
             self.spreadsheet_id = spreadsheet_id.spreadsheet_id
@@ -78,8 +195,7 @@ class SpreadSheet():
         return if_contains
     
     def share(self, email, role='reader', type='user', send_notification=True):
-        creds = _get_google_credentials()
-        drive_service = build('drive', 'v3', credentials=creds)
+        drive_service = get_google_service('drive', 'v3')
         email = email if isinstance(email, list) else [email]
         for each_email in email:
             permission = {
@@ -104,18 +220,36 @@ class SpreadSheet():
     @property
     def sheets(self):
         #Return a list of Sheet Objects
-        creds = _get_google_credentials()
-        _sheets_service = build('sheets', 'v4', credentials=creds)
-        google_spreadsheet_object = _sheets_service.spreadsheets().get(spreadsheetId=self.spreadsheet_id).execute()
-        sheets = google_spreadsheet_object.get('sheets', [])
-        sheets = [Sheet(spreadsheet_id=self, sheet_name=each['properties']['title'], sheet_id=each['properties']['sheetId']) for each in sheets]
+        sheets = [Sheet(spreadsheet_id=self, sheet_name=each['title'], sheet_id=each['sheetId']) for each in self._sheet_properties()]
         return sheets
     
+    def refresh(self):
+        # Fetch the sheet properties snapshot, only the fields in SHEET_PROPERTIES_FIELDS are requested
+        _sheets_service = get_google_service('sheets', 'v4')
+        google_spreadsheet_object = _sheets_service.spreadsheets().get(spreadsheetId=self.spreadsheet_id, fields=SHEET_PROPERTIES_FIELDS).execute()
+        properties = [each['properties'] for each in google_spreadsheet_object.get('sheets', [])]
+        with _snapshots_lock:
+            _snapshots[self.spreadsheet_id] = (time.monotonic(), properties)
+        return list(properties)
+    
+    def _sheet_properties(self):
+        with _snapshots_lock:
+            snapshot = _snapshots.get(self.spreadsheet_id)
+            if snapshot is not None and time.monotonic() - snapshot[0] <= self.snapshot_ttl:
+                return list(snapshot[1])
+        return self.refresh()
+    
+    def _update_snapshot(self, update):
+        # apply a change made by this library to the cached snapshot instead of fetching it again
+        with _snapshots_lock:
+            snapshot = _snapshots.get(self.spreadsheet_id)
+            if snapshot is not None:
+                update(snapshot[1])
+    
     def exists(self):
-        creds = _get_google_credentials()
-        _sheets_service = build('sheets', 'v4', credentials=creds)
+        from googleapiclient.errors import HttpError
         try:
-            _sheets_service.spreadsheets().get(spreadsheetId=self.spreadsheet_id).execute()
+            self.refresh()
             return True
         except HttpError as e:
             if e.resp.status == 404:
@@ -124,17 +258,17 @@ class SpreadSheet():
                 raise ValueError("Spreadsheet Exists. BUT Access denied.")
         
     def rename(self,spreadsheet_name):
-        creds = _get_google_credentials()
-        drive_service = build('drive', 'v3', credentials=creds)
+        drive_service = get_google_service('drive', 'v3')
         drive_service.files().update(fileId=self.spreadsheet_id,
                                      body={"name": spreadsheet_name},
                                      fields='id, name'
                                      ).execute()
     
     def delete(self):
-        creds = _get_google_credentials()
-        drive_service = build('drive', 'v3', credentials=creds)
+        drive_service = get_google_service('drive', 'v3')
         drive_service.files().delete(fileId=self.spreadsheet_id).execute()
+        with _snapshots_lock:
+            _snapshots.pop(self.spreadsheet_id, None)
     
     def _generate_sheet_name(self):
         sheets_names = [e.lower() for e in self.sheets_names]
@@ -149,8 +283,7 @@ class SpreadSheet():
         if sheet_name is None:
             sheet_name = self._generate_sheet_name()
         
-        creds = _get_google_credentials()
-        _sheets_service = build('sheets', 'v4', credentials=creds)
+        _sheets_service = get_google_service('sheets', 'v4')
         requests = [
                         {
                             "addSheet": {
@@ -166,10 +299,18 @@ class SpreadSheet():
                     ]
         body = {"requests": requests}
         response = _sheets_service.spreadsheets().batchUpdate(spreadsheetId=self.spreadsheet_id, body=body).execute()
-        new_sheet_id = response["replies"][0]["addSheet"]["properties"]["sheetId"]
+        new_sheet_properties = response["replies"][0]["addSheet"]["properties"]
+        new_sheet_id = new_sheet_properties["sheetId"]
+        self._update_snapshot(lambda properties: properties.append(new_sheet_properties))
         sheet = Sheet(spreadsheet_id=self, sheet_name=sheet_name, sheet_id=new_sheet_id)
         return sheet
     
+    def batch(self, value_input_option='RAW'):
+        # Collect sheet changes and writes, and send them as few batchUpdate calls as possible on exit:
+        # with spreadsheet.batch() as batch: batch.create_sheet('a'); batch.write('a', arrow)
+        # Values are stored as given; 'USER_ENTERED' has Sheets parse them as if typed in (numbers, dates, formulas)
+        return SpreadSheetBatch(self, value_input_option=value_input_option)
+    
     def get_sheet(self, sheet_name):
         sheets = [e for e in self.sheets if e.sheet_name == sheet_name]
         if len(sheets) != 1:
@@ -188,8 +329,253 @@ class SpreadSheet():
         
 
 
+class SpreadSheetBatch():
+    def __init__(self, spreadsheet, value_input_option='RAW'):
+        self.spreadsheet = spreadsheet
+        self.value_input_option = value_input_option
+        self._operations = []
+        self._writes = []
+        
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.flush()
+            
+    def create_sheet(self, sheet_name):
+        self._operations.append(('create', sheet_name))
+        return self
+    
+    def rename_sheet(self, old_name, new_name):
+        self._operations.append(('rename', old_name, new_name))
+        return self
+    
+    def delete_sheet(self, sheet_name):
+        self._operations.append(('delete', sheet_name))
+        return self
+    
+    def write(self, sheet_name, arrow, sheet_range=None, overwrite_sheet=True):
+        # sheet_range only sets the top left cell of the write, e.g. 'B2' or 'B2:F100'
+        self._writes.append((sheet_name, arrow, sheet_range, overwrite_sheet))
+        return self
+    
+    def flush(self):
+        _sheets_service = get_google_service('sheets', 'v4')
+        sheets = {each['title']: dict(each, gridProperties=dict(each.get('gridProperties', {})))
+                  for each in self.spreadsheet._sheet_properties()}
+        used_ids = {each['sheetId'] for each in sheets.values()}
+        created_ids = set()
+        refreshed = False
+        requests = []
+        
+        def add_sheet(sheet_name):
+            sheet_id = random.randint(1, 2**31 - 1)
+            while sheet_id in used_ids:
+                sheet_id = random.randint(1, 2**31 - 1)
+            used_ids.add(sheet_id)
+            created_ids.add(sheet_id)
+            sheets[sheet_name] = {'sheetId': sheet_id, 'title': sheet_name, 'gridProperties': {'rowCount': 100, 'columnCount': 20}}
+            requests.append({'addSheet': {'properties': sheets[sheet_name]}})
+            
+        for operation, sheet_name, *args in self._operations:
+            if operation == 'create':
+                add_sheet(sheet_name)
+            elif sheet_name not in sheets:
+                raise ValueError(f'sheet "{sheet_name}" NOT FOUND')
+            elif operation == 'rename':
+                sheets[args[0]] = sheets.pop(sheet_name)
+                sheets[args[0]]['title'] = args[0]
+                requests.append({'updateSheetProperties': {'properties': {'sheetId': sheets[args[0]]['sheetId'], 'title': args[0]},
+                                                           'fields': 'title'}})
+            elif operation == 'delete':
+                requests.append({'deleteSheet': {'sheetId': sheets.pop(sheet_name)['sheetId']}})
+        
+        writes = []
+        for sheet_name, arrow, sheet_range, overwrite_sheet in self._writes:
+            if sheet_name not in sheets:
+                add_sheet(sheet_name)
+            start_column, start_row = _parse_cell(sheet_range.split(':')[0] if sheet_range else 'A1')
+            values = _arrow_to_values(arrow)
+            
+            # grow the grid up front, the values API does not add rows or columns
+            grid = sheets[sheet_name]['gridProperties']
+            row_count = start_row - 1 + len(values)
+            column_count = start_column - 1 + len(arrow.column_names)
+            if not refreshed and sheets[sheet_name]['sheetId'] not in created_ids and \
+                    (grid.get('rowCount', 0) < row_count or grid.get('columnCount', 0) < column_count):
+                # the snapshot can be older than the sheet (DuckDB COPY, other clients), grow from the current size
+                refreshed = True
+                current = {each['sheetId']: each.get('gridProperties', {}) for each in self.spreadsheet.refresh()}
+                for each in sheets.values():
+                    if each['sheetId'] in current:
+                        each['gridProperties'].update(current[each['sheetId']])
+            requests += _grow_grid(sheets[sheet_name]['sheetId'], grid, row_count, column_count)
+            writes.append((sheet_name, start_column, start_row, values, overwrite_sheet))
+        
+        for i in range(0, len(requests), MAX_REQUESTS_PER_BATCH):
+            body = {'requests': requests[i:i + MAX_REQUESTS_PER_BATCH]}
+            _write_bucket.acquire()
+            _sheets_service.spreadsheets().batchUpdate(spreadsheetId=self.spreadsheet.spreadsheet_id, body=body).execute(num_retries=NUM_RETRIES)
+        
+        clear_ranges = list(dict.fromkeys(_quote_sheet_name(e[0]) for e in writes if e[4]))
+        if clear_ranges:
+            body = {'ranges': clear_ranges}
+            _write_bucket.acquire()
+            _sheets_service.spreadsheets().values().batchClear(spreadsheetId=self.spreadsheet.spreadsheet_id, body=body).execute(num_retries=NUM_RETRIES)
+        for data in _value_ranges(writes):
+            body = {'valueInputOption': self.value_input_option, 'data': data}
+            _write_bucket.acquire()
+            _sheets_service.spreadsheets().values().batchUpdate(spreadsheetId=self.spreadsheet.spreadsheet_id, body=body).execute(num_retries=NUM_RETRIES)
+        
+        with _snapshots_lock:
+            _snapshots[self.spreadsheet.spreadsheet_id] = (time.monotonic(), list(sheets.values()))
+        self._operations = []
+        self._writes = []
+        print(f'Success: {len(requests)} sheet changes and {len(writes)} writes sent to Google Sheet.')
+
+
+def _grow_grid(sheet_id, grid, row_count, column_count):
+    # appendDimension requests growing grid to at least row_count x column_count, grid is updated.
+    # Rows and columns are appended by a delta, so a resize never shrinks the sheet even from a stale grid.
+    requests = []
+    for dimension, key, count in (('ROWS', 'rowCount', row_count), ('COLUMNS', 'columnCount', column_count)):
+        length = count - grid.get(key, 0)
+        if length > 0:
+            requests.append({'appendDimension': {'sheetId': sheet_id, 'dimension': dimension, 'length': length}})
+            grid[key] = count
+    return requests
+
+
+def _quote_sheet_name(sheet_name):
+    return "'" + sheet_name.replace("'", "''") + "'"
+
+
+def _parse_cell(cell):
+    match = re.fullmatch(r'([A-Za-z]*)(\d*)', cell.strip())
+    if match is None:
+        raise ValueError(f'"{cell}" is not an A1 cell reference')
+    letters, row = match.groups()
+    column = 0
+    for letter in letters.upper():
+        column = column * 26 + ord(letter) - ord('A') + 1
+    return column or 1, int(row) if row else 1
+
+
+def _column_letter(column):
+    letters = ''
+    while column:
+        column, remainder = divmod(column - 1, 26)
+        letters = chr(ord('A') + remainder) + letters
+    return letters
+
+
+def _table_fingerprint(arrow):
+    # sha256 of the table's schema and values as an IPC stream, one batch serialized at a time
+    import pyarrow as pa
+    digest = hashlib.sha256(str(arrow.schema).encode())
+    for batch in arrow.to_batches():
+        sink = pa.BufferOutputStream()
+        with pa.ipc.new_stream(sink, arrow.schema) as writer:
+            writer.write_batch(batch)
+        digest.update(sink.getvalue())
+    return digest.hexdigest()
+
+
+def _cell_value(value):
+    if value is None:
+        return ''
+    elif isinstance(value, float):
+        return value if math.isfinite(value) else ''
+    elif isinstance(value, decimal.Decimal):
+        return float(value)
+    elif isinstance(value, datetime.datetime):
+        return value.isoformat(sep=' ')
+    elif isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+    elif isinstance(value, (bool, int, str)):
+        return value
+    return str(value)
+
+
+def _arrow_to_values(arrow):
+    # header row followed by the rows of arrow as JSON-serializable cell values
+    columns = [[_cell_value(value) for value in column.to_pylist()] for column in arrow.columns]
+    values = [list(arrow.column_names)] + [list(row) for row in zip(*columns)]
+    return values
+
+
+def _value_ranges(writes):
+    # Split writes into values.batchUpdate payloads under MAX_PAYLOAD_BYTES each
+    payloads, data, size = [], [], 0
+    for sheet_name, start_column, start_row, values, _ in writes:
+        block, block_start = [], start_row
+        for i, row in enumerate(values):
+            row_size = len(json.dumps(row)) + 1
+            if size + row_size > MAX_PAYLOAD_BYTES and (block or data):
+                if block:
+                    data.append({'range': f'{_quote_sheet_name(sheet_name)}!{_column_letter(start_column)}{block_start}', 'values': block})
+                payloads.append(data)
+                data, size = [], 0
+                block, block_start = [], start_row + i
+            block.append(row)
+            size += row_size
+        if block:
+            data.append({'range': f'{_quote_sheet_name(sheet_name)}!{_column_letter(start_column)}{block_start}', 'values': block})
+    if data:
+        payloads.append(data)
+    return payloads
+
+
+class ReadCache():
+    # Sheet reads stored as uncompressed Arrow IPC files and memory-mapped back on a hit.
+    # Entries are keyed by the Drive file version, so any edit of the spreadsheet is a miss,
+    # and are evicted least-recently-used first once the cache exceeds max_bytes.
+    def __init__(self, cache_dir=None, max_bytes=DEFAULT_CACHE_SIZE):
+        self.cache_dir = Path(cache_dir) if cache_dir is not None else Path.home()/'.cache/arrows/gsheet_reads'
+        self.max_bytes = max_bytes
+        
+    def __repr__(self):
+        return f'ReadCache: {self.cache_dir}'
+    
+    def revision(self, spreadsheet_id):
+        # a single Drive metadata call, much cheaper than reading the values
+        drive_service = get_google_service('drive', 'v3')
+        file = drive_service.files().get(fileId=spreadsheet_id, fields='version,modifiedTime',
+                                         supportsAllDrives=True).execute(num_retries=NUM_RETRIES)
+        return f"{file.get('version')}-{file.get('modifiedTime')}"
+    
+    def path(self, spreadsheet_id, revision, *key):
+        digest = hashlib.sha256(json.dumps([revision, *key]).encode()).hexdigest()
+        return self.cache_dir / spreadsheet_id / f'{digest}.arrow'
+    
+    def get(self, path):
+        import pyarrow as pa
+        try:
+            os.utime(path)
+            return pa.ipc.open_file(pa.memory_map(str(path))).read_all()
+        except FileNotFoundError:
+            return None
+    
+    def put(self, path, arrow):
+        import pyarrow as pa
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temp_path = path.with_name(f'{path.name}.{os.getpid()}.{threading.get_ident()}.tmp')
+        try:
+            with pa.OSFile(str(temp_path), 'wb') as sink, pa.ipc.new_file(sink, arrow.schema) as writer:
+                writer.write_table(arrow)
+            os.replace(temp_path, path)
+        finally:
+            if temp_path.exists():
+                temp_path.unlink()
+        _evict_lru(self.cache_dir, self.max_bytes, keep=[path])
+    
+    def clear(self):
+        _evict_lru(self.cache_dir, 0)
+
+
 class Sheet():
-    def __init__(self, spreadsheet_id, sheet_name, sheet_id=None):
+    def __init__(self, spreadsheet_id, sheet_name, sheet_id=None, cache=None):
         if isinstance(spreadsheet_id, SpreadSheet):
             self.spreadsheet = spreadsheet_id
             self.spreadsheet_id = spreadsheet_id.spreadsheet_id
@@ -199,6 +585,8 @@ class Sheet():
         
         self.sheet_name = sheet_name
         self.sheet_id = sheet_id
+        # None follows enable_local_cache(), False disables caching, or pass a ReadCache
+        self._cache = cache
         
     def __eq__(self, sheet):
         check = self.spreadsheet_id == sheet.spreadsheet_id and self.sheet_name == sheet.sheet_name
@@ -210,6 +598,16 @@ class Sheet():
             self.get_sheet_id()
         return f'https://docs.google.com/spreadsheets/d/{self.spreadsheet_id}/edit?gid={self.sheet_id}#gid={self.sheet_id}'
     
+    @property
+    def cache(self):
+        if self._cache is None:
+            return _read_cache
+        elif self._cache is True:
+            return _read_cache if _read_cache is not None else enable_local_cache()
+        elif self._cache is False:
+            return None
+        return self._cache
+    
     def exists(self):
         if_exist = self.sheet_name in self.spreadsheet.sheets_names
         return if_exist
@@ -227,58 +625,176 @@ class Sheet():
         self.sheet_id = sheet.sheet_id
         return self.sheet_id
       
-    def to_duckdb(self, sheet_range=None, all_varchar=False, sql=None):
+    def to_duckdb(self, sheet_range=None, all_varchar=False, sql=None, connection=None):
         sheet_range = f'!{sheet_range}' if sheet_range else ''
         sheet_expression = f'''
             read_gsheet('{self.spreadsheet_id}', sheet='{self.sheet_name}{sheet_range}'{', all_varchar = true' if all_varchar else ''})
         '''
         if sql:
-            sql = Template(sql).render(google_sheet = sheet_expression)
-            template = Template('''
-                                with temp_google_sheet_table as (select * from {{ sheet_expression }})
-                                {{ _parse_self_sql(sql, 'self', 'temp_google_sheet_table') }}
-                                ''')
-            sql = template.render(sql = sql, sheet_expression = sheet_expression, _parse_self_sql = _parse_self_sql)
+            sql = render_string(sql, google_sheet = sheet_expression)
+            sql = _bind_tables(sql, (('self', sheet_expression.strip()),))
         else:
             sql = f'''
                 SELECT * FROM {sheet_expression}
             '''
-        duckdb_relation = duckdb.sql(sql)
+        duckdb_relation = (connection or duckdb_session.cursor()).sql(sql)
         return duckdb_relation
     
-    def to_arrow(self, sheet_range=None, all_varchar=False, sql=None):
-        arrow = self.to_duckdb(sheet_range=sheet_range, all_varchar=all_varchar, sql=sql).to_arrow_table()
+    def to_arrow(self, sheet_range=None, all_varchar=False, sql=None, connection=None):
+        cache = self.cache
+        if cache is None:
+            return self.to_duckdb(sheet_range=sheet_range, all_varchar=all_varchar, sql=sql, connection=connection).to_arrow_table()
+        
+        path = cache.path(self.spreadsheet_id, cache.revision(self.spreadsheet_id), self.sheet_name, sheet_range, all_varchar, sql)
+        arrow = cache.get(path)
+        if arrow is None:
+            arrow = self.to_duckdb(sheet_range=sheet_range, all_varchar=all_varchar, sql=sql, connection=connection).to_arrow_table()
+            cache.put(path, arrow)
         return arrow
     
     def to_polars(self, sheet_range=None, all_varchar=False, sql=None):
+        if self.cache is not None:
+            import polars as pl
+            return pl.from_arrow(self.to_arrow(sheet_range=sheet_range, all_varchar=all_varchar, sql=sql))
         df = self.to_duckdb(sheet_range=sheet_range, all_varchar=all_varchar, sql=sql).pl()
         return df
     
     def to_pandas(self, sheet_range=None, all_varchar=False, sql=None):
+        if self.cache is not None:
+            return self.to_arrow(sheet_range=sheet_range, all_varchar=all_varchar, sql=sql).to_pandas()
         df = self.to_duckdb(sheet_range=sheet_range, all_varchar=all_varchar, sql=sql).df()
         return df
     
 
-    def from_arrow(self, arrow, sheet_range=None, overwrite_sheet=True, overwrite_range=False):
+    def from_arrow(self, arrow, sheet_range=None, overwrite_sheet=True, overwrite_range=False, chunk_rows=None, resume=False, upload_id=None,
+                   value_input_option='RAW'):
+        if chunk_rows:
+            return self.from_batches(arrow, chunk_rows=chunk_rows, sheet_range=sheet_range, overwrite_sheet=overwrite_sheet,
+                                     resume=resume, upload_id=upload_id, value_input_option=value_input_option)
         if not self.exists():
             self.create()
         
         range_str = (", range '" + sheet_range + "'") if sheet_range else ''
         overwrite_range_str = ', overwrite_range True' if overwrite_range else ''
         overwrite_sheet_str = ', overwrite_sheet False' if overwrite_sheet == False else ''
-        duckdb.execute(f'''
+        duckdb_session.cursor().execute(f'''
                     COPY arrow
                     TO '{self.spreadsheet_id}' 
                     (format gsheet, sheet '{self.sheet_name}' {range_str} {overwrite_range_str} {overwrite_sheet_str});
                     ''')
         print(f'Success: Data transfered to Google Sheet.')
     
+    def from_batches(self, data, chunk_rows=2000, sheet_range=None, overwrite_sheet=True, resume=False, upload_id=None,
+                     value_input_option='RAW'):
+        # Upload a pa.Table or RecordBatchReader in row-range writes of chunk_rows rows.
+        # Progress is recorded after every committed chunk under upload_id (for a pa.Table, a fingerprint
+        # of its contents by default). Re-running a failed upload with resume=True and the same upload_id
+        # or table continues after the last committed range. Values are stored as given, 'USER_ENTERED'
+        # has Sheets parse them as if typed in (numbers, dates, formulas).
+        import pyarrow as pa
+        if isinstance(data, pa.Table):
+            total_rows = data.num_rows
+            batches = data.to_batches(max_chunksize=chunk_rows)
+            if upload_id is None:
+                upload_id = _table_fingerprint(data)
+        else:
+            total_rows = None
+            batches = data
+            if resume and upload_id is None:
+                raise ValueError('resume=True needs an upload_id to resume a RecordBatchReader upload')
+        columns = len(data.schema.names)
+        
+        progress_path = None
+        committed_rows = 0
+        if upload_id is not None:
+            key = f'{self.spreadsheet_id}/{self.sheet_name}/{sheet_range}/{upload_id}'
+            progress_path = UPLOAD_PROGRESS_DIR/f'{hashlib.sha256(key.encode()).hexdigest()}.json'
+            if resume and progress_path.exists():
+                committed_rows = json.loads(progress_path.read_text())['committed_rows']
+                print(f'Resuming upload after row {committed_rows}.')
+        
+        if not self.exists():
+            self.create()
+        start_column, start_row = _parse_cell(sheet_range.split(':')[0] if sheet_range else 'A1')
+        _sheets_service = get_google_service('sheets', 'v4')
+        
+        def write(row, values):
+            _write_bucket.acquire()
+            _sheets_service.spreadsheets().values().update(spreadsheetId=self.spreadsheet_id,
+                                                           range=f'{_quote_sheet_name(self.sheet_name)}!{_column_letter(start_column)}{row}',
+                                                           valueInputOption=value_input_option,
+                                                           body={'values': values}).execute(num_retries=NUM_RETRIES)
+        
+        if committed_rows == 0:
+            if overwrite_sheet:
+                _write_bucket.acquire()
+                _sheets_service.spreadsheets().values().clear(spreadsheetId=self.spreadsheet_id,
+                                                              range=_quote_sheet_name(self.sheet_name)).execute(num_retries=NUM_RETRIES)
+            self._ensure_grid(start_row + (total_rows or 0), start_column - 1 + columns)
+            write(start_row, [list(data.schema.names)])
+        elif total_rows is not None:
+            self._ensure_grid(start_row + total_rows, start_column - 1 + columns)
+        
+        start = time.perf_counter()
+        rows, cells = 0, 0
+        for batch in batches:
+            for offset in range(0, batch.num_rows, chunk_rows):
+                chunk = batch.slice(offset, chunk_rows)
+                if rows + chunk.num_rows <= committed_rows:
+                    rows += chunk.num_rows
+                    continue
+                if rows < committed_rows:
+                    chunk = chunk.slice(committed_rows - rows)
+                    rows = committed_rows
+                if total_rows is None:
+                    self._ensure_grid(start_row + rows + chunk.num_rows, start_column - 1 + columns, grow=2)
+                
+                write(start_row + 1 + rows, _arrow_to_values(chunk)[1:])
+                rows += chunk.num_rows
+                cells += chunk.num_rows * columns
+                
+                if progress_path is not None:
+                    UPLOAD_PROGRESS_DIR.mkdir(parents=True, exist_ok=True)
+                    temp_path = progress_path.with_suffix('.tmp')
+                    temp_path.write_text(json.dumps({'upload_id': upload_id, 'committed_rows': rows}))
+                    os.replace(temp_path, progress_path)
+        
+        if progress_path is not None:
+            progress_path.unlink(missing_ok=True)
+        seconds = time.perf_counter() - start
+        print(f'Success: {rows} rows ({cells} cells) transfered to Google Sheet in {seconds:.1f}s, {cells / max(seconds, 1e-9):,.0f} cells/s.')
+    
+    def _ensure_grid(self, row_count, column_count, grow=1):
+        # resize the sheet before writing, the values API does not add rows or columns
+        properties = [e for e in self.spreadsheet._sheet_properties() if e['title'] == self.sheet_name]
+        grid = properties[0].get('gridProperties', {}) if properties else {}
+        if grid.get('rowCount', 0) >= row_count and grid.get('columnCount', 0) >= column_count:
+            return
+        # the snapshot can be older than the sheet (DuckDB COPY, other clients), grow from the current size
+        properties = [e for e in self.spreadsheet.refresh() if e['title'] == self.sheet_name]
+        grid = dict(properties[0].get('gridProperties', {})) if properties else {}
+        if grid.get('rowCount', 0) >= row_count and grid.get('columnCount', 0) >= column_count:
+            return
+        if self.sheet_id is None:
+            self.get_sheet_id()
+        
+        _sheets_service = get_google_service('sheets', 'v4')
+        requests = _grow_grid(self.sheet_id, grid, row_count * grow if grid.get('rowCount', 0) < row_count else 0, column_count)
+        body = {"requests": requests}
+        _write_bucket.acquire()
+        _sheets_service.spreadsheets().batchUpdate(spreadsheetId=self.spreadsheet_id, body=body).execute(num_retries=NUM_RETRIES)
+        
+        def update(properties):
+            for each in properties:
+                if each['sheetId'] == self.sheet_id:
+                    each['gridProperties'] = dict(each.get('gridProperties', {}), **grid)
+        self.spreadsheet._update_snapshot(update)
+    
     def rename(self, sheet_name):
         if self.sheet_id is None:
             self.get_sheet_id()
         
-        creds = _get_google_credentials()
-        _sheets_service = build('sheets', 'v4', credentials=creds)
+        _sheets_service = get_google_service('sheets', 'v4')
         requests = [
                         {
                             "updateSheetProperties": {
@@ -293,6 +809,12 @@ class Sheet():
         body = {"requests": requests}
         _sheets_service.spreadsheets().batchUpdate(spreadsheetId=self.spreadsheet_id, body=body).execute()
         self.sheet_name = sheet_name
+        
+        def update(properties):
+            for each in properties:
+                if each['sheetId'] == self.sheet_id:
+                    each['title'] = sheet_name
+        self.spreadsheet._update_snapshot(update)
     
     def delete(self):
         if not self.exists():
@@ -301,8 +823,7 @@ class Sheet():
         if self.sheet_id is None:
             self.get_sheet_id()
         
-        creds = _get_google_credentials()
-        _sheets_service = build('sheets', 'v4', credentials=creds)
+        _sheets_service = get_google_service('sheets', 'v4')
         requests = [
                         {
                             "deleteSheet": {
@@ -312,5 +833,9 @@ class Sheet():
                     ]
         body = {"requests": requests}
         _sheets_service.spreadsheets().batchUpdate(spreadsheetId=self.spreadsheet_id, body=body).execute()
+        
+        def update(properties):
+            properties[:] = [each for each in properties if each['sheetId'] != self.sheet_id]
+        self.spreadsheet._update_snapshot(update)
     
     
\ No newline at end of file
@@ -0,0 +1,318 @@
+import os
+import tempfile
+import time
+import pyarrow as pa
+import pyarrow.compute as pc
+from .template_renderer import render_string, render_template
+from .utils import _close_on_exhaust
+from .pool import ConnectionPool
+
+DEFAULT_BATCH_SIZE = 64 * 1024
+# rows written to each temporary TSV file and loaded with one LOAD DATA statement
+DEFAULT_LOAD_ROWS = 1024 * 1024
+# TIME columns hold -838:59:59.999999 to 838:59:59.999999
+MAX_TIME_MICROSECONDS = 839 * 3600 * 1_000_000
+
+
+def get_connection():
+    import pymysql
+    conn = pymysql.connect(host=os.getenv('MYSQL_HOST'),
+                           port=int(os.getenv('MYSQL_PORT', 3306)),
+                           user=os.getenv('MYSQL_USER'),
+                           password=os.getenv('MYSQL_PASSWORD'),
+                           database=os.getenv('MYSQL_DATABASE'),
+                           local_infile=True)
+    return conn
+
+
+def _check_connection(conn):
+    conn.ping(reconnect=False)
+    return True
+
+
+def _rollback(conn):
+    conn.rollback()
+
+
+_pool = ConnectionPool(get_connection,
+                       max_size=int(os.getenv('MYSQL_POOL_SIZE', 8)),
+                       health_check=_check_connection,
+                       reset=_rollback)
+
+
+def connection(timeout=None):
+    # Lease a pooled connection: `with mysql.connection() as conn: ...`
+    return _pool.connection(timeout=timeout)
+
+
+def close_connections():
+    _pool.close()
+
+
+def fetch_arrow(sql, stream=False, batch_size=DEFAULT_BATCH_SIZE, **kwargs):
+    reader = fetch_batches(sql, batch_size=batch_size, **kwargs)
+    if stream:
+        return reader
+    return reader.read_all()
+
+
+def fetch_batches(sql, batch_size=DEFAULT_BATCH_SIZE, **kwargs):
+    # Stream the result through an unbuffered server-side cursor as a RecordBatchReader-compatible stream.
+    # The schema comes from the result's column metadata, the connection is released
+    # once the reader is exhausted or closed.
+    import pymysql
+    conn = _pool.acquire()
+    try:
+        cursor = conn.cursor(pymysql.cursors.SSCursor)
+        cursor.execute(render_string(sql, **kwargs))
+        schema = _result_schema(cursor)
+    except Exception as e:
+        _pool.release(conn, discard=True)
+        print(f'{e}')
+        raise e
+
+    exhausted = []
+    def batches():
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                exhausted.append(True)
+                return
+            columns = list(zip(*rows))
+            yield pa.RecordBatch.from_arrays([pa.array(e, type=field.type) for e, field in zip(columns, schema)], schema=schema)
+
+    reader = pa.RecordBatchReader.from_batches(schema, batches())
+    return _close_on_exhaust(reader, lambda: _release(conn, cursor, bool(exhausted)))
+
+
+def _release(conn, cursor, exhausted):
+    if not exhausted:
+        # closing a half-read unbuffered cursor reads every remaining row from the server,
+        # the connection is dropped instead and the result is not drained when collected
+        result = getattr(cursor, '_result', None)
+        if result is not None:
+            result.unbuffered_active = False
+        _pool.release(conn, discard=True)
+        return
+    try:
+        cursor.close()
+    except Exception:
+        _pool.release(conn, discard=True)
+        return
+    _pool.release(conn)
+
+
+def _result_schema(cursor):
+    from pymysql.constants import FIELD_TYPE, FLAG
+    fields = getattr(getattr(cursor, '_result', None), 'fields', None) or [None] * len(cursor.description)
+    arrow_fields = []
+    for (name, type_code, _, length, _, scale, _), field in zip(cursor.description, fields):
+        binary = field is not None and field.charsetnr == 63
+        unsigned = field is not None and field.flags & FLAG.UNSIGNED
+        if type_code in (FIELD_TYPE.TINY, FIELD_TYPE.SHORT, FIELD_TYPE.LONG, FIELD_TYPE.INT24, FIELD_TYPE.YEAR):
+            arrow_type = pa.int64()
+        elif type_code == FIELD_TYPE.LONGLONG:
+            arrow_type = pa.uint64() if unsigned else pa.int64()
+        elif type_code == FIELD_TYPE.FLOAT:
+            arrow_type = pa.float32()
+        elif type_code == FIELD_TYPE.DOUBLE:
+            arrow_type = pa.float64()
+        elif type_code in (FIELD_TYPE.DECIMAL, FIELD_TYPE.NEWDECIMAL):
+            # the column length counts the sign and the decimal point
+            precision = max(1, length - (1 if scale else 0) - (0 if unsigned else 1))
+            arrow_type = pa.decimal128(precision, scale) if precision <= 38 else pa.decimal256(min(precision, 76), scale)
+        elif type_code in (FIELD_TYPE.DATE, FIELD_TYPE.NEWDATE):
+            arrow_type = pa.date32()
+        elif type_code in (FIELD_TYPE.DATETIME, FIELD_TYPE.TIMESTAMP):
+            arrow_type = pa.timestamp('us')
+        elif type_code == FIELD_TYPE.TIME:
+            arrow_type = pa.duration('us')
+        elif type_code in (FIELD_TYPE.BIT, FIELD_TYPE.GEOMETRY):
+            arrow_type = pa.binary()
+        elif type_code == FIELD_TYPE.NULL:
+            arrow_type = pa.null()
+        elif type_code == FIELD_TYPE.JSON:
+            arrow_type = pa.string()
+        else:
+            # CHAR/VARCHAR/TEXT/BLOB/ENUM/SET, binary collations are returned as bytes
+            arrow_type = pa.binary() if binary else pa.string()
+        arrow_fields.append(pa.field(name, arrow_type))
+    return pa.schema(arrow_fields)
+
+
+def fetch_dataframe(sql, **kwargs):
+    df = fetch_arrow(sql, **kwargs).to_pandas()
+    return df
+
+
+def arrow_to_mysql(arrow, table_name, mode='append', load_rows=DEFAULT_LOAD_ROWS):
+    # Bulk load arrow (a pa.Table or RecordBatchReader) with LOAD DATA LOCAL INFILE from temporary
+    # TSV files of load_rows rows, all in one transaction. Needs local_infile enabled on the server.
+    # mode='overwrite' drops and recreates the table first, DDL commits implicitly in MySQL.
+    if mode not in ('append', 'overwrite'):
+        raise ValueError(f'mode must be "append" or "overwrite", got "{mode}"')
+    table_name = _quote_table_name(table_name)
+    batches = arrow.to_batches(max_chunksize=load_rows) if isinstance(arrow, pa.Table) else arrow
+
+    start = time.perf_counter()
+    rows = 0
+    with connection() as conn, tempfile.TemporaryDirectory() as temp_dir:
+        cursor = conn.cursor()
+        try:
+            if mode == 'overwrite':
+                cursor.execute(f'DROP TABLE IF EXISTS {table_name}')
+            columns = ', '.join(f'{_quote(e.name)} {_mysql_type(e.type)}' for e in arrow.schema)
+            cursor.execute(f'CREATE TABLE IF NOT EXISTS {table_name} ({columns})')
+            conn.begin()
+
+            path = os.path.join(temp_dir, 'load.tsv')
+            file = open(path, 'wb')
+            pending = 0
+            for batch in batches:
+                file.write(_to_tsv(batch))
+                pending += batch.num_rows
+                if pending >= load_rows:
+                    file.close()
+                    rows += _load_file(cursor, path, table_name, arrow.schema)
+                    file = open(path, 'wb')
+                    pending = 0
+            file.close()
+            if pending:
+                rows += _load_file(cursor, path, table_name, arrow.schema)
+            conn.commit()
+        finally:
+            cursor.close()
+    seconds = time.perf_counter() - start
+    print(f'Success: {rows:,} rows transfered to MySQL in {seconds:.1f}s, {rows / max(seconds, 1e-9):,.0f} rows/s.')
+
+
+def _load_file(cursor, path, table_name, schema):
+    # binary columns are written as hex into a user variable and decoded with UNHEX
+    columns = []
+    assignments = []
+    for i, field in enumerate(schema):
+        if _is_binary(field.type):
+            columns.append(f'@binary_{i}')
+            assignments.append(f'{_quote(field.name)} = UNHEX(@binary_{i})')
+        else:
+            columns.append(_quote(field.name))
+    path = path.replace('\\', '\\\\').replace("'", "\\'")
+    return cursor.execute(f"""
+                          LOAD DATA LOCAL INFILE '{path}'
+                          INTO TABLE {table_name}
+                          CHARACTER SET utf8mb4
+                          FIELDS TERMINATED BY '\\t' ESCAPED BY '\\\\'
+                          LINES TERMINATED BY '\\n'
+                          ({', '.join(columns)})
+                          {'SET ' + ', '.join(assignments) if assignments else ''}
+                          """)
+
+
+def _is_binary(arrow_type):
+    return pa.types.is_binary(arrow_type) or pa.types.is_large_binary(arrow_type) or pa.types.is_fixed_size_binary(arrow_type)
+
+
+def _to_tsv(batch):
+    # Render a RecordBatch as TSV bytes in Arrow: tabs, newlines and backslashes in values
+    # are backslash-escaped and nulls written as \N, the defaults of LOAD DATA
+    if batch.num_rows == 0:
+        return b''
+    columns = [_tsv_column(e) for e in batch.columns]
+    lines = pc.binary_join_element_wise(*columns, pa.scalar('\t', pa.large_string()))
+    lines = pc.binary_join_element_wise(lines, pa.scalar('', pa.large_string()), pa.scalar('\n', pa.large_string()))
+    # a freshly computed array holds its values back to back from the start of the data buffer
+    size = pc.sum(pc.binary_length(lines)).as_py()
+    return lines.buffers()[2][:size]
+
+
+def _tsv_column(array):
+    arrow_type = array.type
+    if pa.types.is_dictionary(arrow_type):
+        array = array.cast(arrow_type.value_type)
+        arrow_type = array.type
+    if pa.types.is_timestamp(arrow_type) and arrow_type.tz is not None:
+        # stored as UTC DATETIME
+        array = array.cast(pa.timestamp(arrow_type.unit))
+    elif pa.types.is_boolean(arrow_type):
+        array = array.cast(pa.int8())
+    elif pa.types.is_floating(arrow_type):
+        # MySQL has no NaN or infinity, they load as NULL
+        array = pc.if_else(pc.is_finite(array), array, None)
+    elif pa.types.is_duration(arrow_type):
+        array = pa.array([_time_value(e) for e in array.cast(pa.duration('us'), safe=False).cast(pa.int64()).to_pylist()], pa.string())
+    elif pa.types.is_nested(arrow_type):
+        import json
+        array = pa.array([None if e is None else json.dumps(e, default=str) for e in array.to_pylist()], pa.string())
+    elif _is_binary(arrow_type):
+        array = pa.array([None if e is None else e.hex() for e in array.to_pylist()], pa.string())
+    array = pc.cast(array, pa.large_string()) if not pa.types.is_large_string(array.type) else array
+    if pa.types.is_string(arrow_type) or pa.types.is_large_string(arrow_type) or pa.types.is_nested(arrow_type):
+        for old, new in (('\\', '\\\\'), ('\t', '\\t'), ('\n', '\\n'), ('\r', '\\r')):
+            array = pc.replace_substring(array, old, new)
+    return pc.fill_null(array, '\\N')
+
+
+def _time_value(microseconds):
+    # a duration as a MySQL TIME literal, [-]HHH:MM:SS.ffffff
+    if microseconds is None:
+        return None
+    if abs(microseconds) >= MAX_TIME_MICROSECONDS:
+        raise ValueError(f'Duration of {microseconds:,} microseconds is outside the MySQL TIME range of +-838:59:59.999999')
+    seconds, fraction = divmod(abs(microseconds), 1_000_000)
+    minutes, seconds = divmod(seconds, 60)
+    hours, minutes = divmod(minutes, 60)
+    return f'{"-" if microseconds < 0 else ""}{hours:02d}:{minutes:02d}:{seconds:02d}.{fraction:06d}'
+
+
+def _mysql_type(arrow_type):
+    if pa.types.is_boolean(arrow_type):
+        return 'BOOLEAN'
+    elif pa.types.is_integer(arrow_type):
+        name = {8: 'TINYINT', 16: 'SMALLINT', 32: 'INT', 64: 'BIGINT'}[arrow_type.bit_width]
+        return f'{name} UNSIGNED' if pa.types.is_unsigned_integer(arrow_type) else name
+    elif pa.types.is_float32(arrow_type):
+        return 'FLOAT'
+    elif pa.types.is_floating(arrow_type):
+        return 'DOUBLE'
+    elif pa.types.is_decimal(arrow_type):
+        return f'DECIMAL({min(arrow_type.precision, 65)}, {min(arrow_type.scale, 30)})'
+    elif pa.types.is_date(arrow_type):
+        return 'DATE'
+    elif pa.types.is_timestamp(arrow_type):
+        return 'DATETIME(6)'
+    elif pa.types.is_time(arrow_type) or pa.types.is_duration(arrow_type):
+        return 'TIME(6)'
+    elif pa.types.is_nested(arrow_type):
+        return 'JSON'
+    elif _is_binary(arrow_type):
+        return 'LONGBLOB'
+    return 'LONGTEXT'
+
+
+def _quote(name):
+    return '`' + name.replace('`', '``') + '`'
+
+
+def _quote_table_name(table_name):
+    return '.'.join(_quote(e) for e in table_name.split('.'))
+
+
+def execute_sql(sql, **kwargs):
+    with connection() as conn:
+        cursor = conn.cursor()
+        try:
+            print(f'Running SQL...')
+            print(sql)
+            cursor.execute(render_string(sql, **kwargs))
+            conn.commit()
+            print('SUCCESS: SQL executed.')
+        except Exception as e:
+            conn.rollback()
+            raise e
+        finally:
+            cursor.close()
+
+
+def execute_sql_file(sql_script_path, **kwargs):
+    sql = render_template(sql_script_path, **kwargs)
+    execute_sql(sql)
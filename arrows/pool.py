@@ -0,0 +1,129 @@
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+
+class ConnectionPool():
+    # Thread-safe, size-bounded pool of DB-API connections.
+    # Idle connections are evicted after max_idle_time seconds and
+    # checked with health_check before being reused.
+    def __init__(self, connect, max_size=8, max_idle_time=300, health_check=None, health_check_interval=30, reset=None):
+        self._connect = connect
+        self.max_size = max_size
+        self.max_idle_time = max_idle_time
+        self._health_check = health_check
+        self.health_check_interval = health_check_interval
+        self._reset = reset
+
+        self._idle = deque()
+        self._size = 0
+        self._condition = threading.Condition()
+
+    def __repr__(self):
+        return f'ConnectionPool: {self._size}/{self.max_size} open, {len(self._idle)} idle'
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @contextmanager
+    def connection(self, timeout=None):
+        conn = self.acquire(timeout=timeout)
+        try:
+            yield conn
+        except Exception:
+            self.release(conn, discard=True)
+            raise
+        else:
+            self.release(conn)
+
+    def acquire(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            conn, last_used = self._checkout(deadline)
+            if conn is None:
+                try:
+                    return self._connect()
+                except Exception:
+                    self._forget()
+                    raise
+            if time.monotonic() - last_used < self.health_check_interval or self._is_healthy(conn):
+                return conn
+            self._discard(conn)
+
+    def release(self, conn, discard=False):
+        if not discard and self._reset is not None:
+            try:
+                self._reset(conn)
+            except Exception:
+                discard = True
+        if discard:
+            self._discard(conn)
+            return
+        with self._condition:
+            self._idle.append((conn, time.monotonic()))
+            self._condition.notify()
+
+    def close(self):
+        with self._condition:
+            idle = [conn for conn, _ in self._idle]
+            self._idle.clear()
+            self._size -= len(idle)
+            self._condition.notify_all()
+        for conn in idle:
+            _close_quietly(conn)
+
+    def _checkout(self, deadline):
+        expired = []
+        try:
+            with self._condition:
+                while True:
+                    expired += self._evict_expired()
+                    if self._idle:
+                        # reuse the most recently released connection, it is the most likely to be alive
+                        return self._idle.pop()
+                    if self._size < self.max_size:
+                        self._size += 1
+                        return None, None
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        raise TimeoutError(f'No connection available in pool after waiting. {self}')
+                    self._condition.wait(remaining)
+        finally:
+            for each in expired:
+                _close_quietly(each)
+
+    def _evict_expired(self):
+        now = time.monotonic()
+        expired = []
+        while self._idle and now - self._idle[0][1] > self.max_idle_time:
+            expired.append(self._idle.popleft()[0])
+        self._size -= len(expired)
+        return expired
+
+    def _is_healthy(self, conn):
+        if self._health_check is None:
+            return True
+        try:
+            return self._health_check(conn)
+        except Exception:
+            return False
+
+    def _discard(self, conn):
+        _close_quietly(conn)
+        self._forget()
+
+    def _forget(self):
+        with self._condition:
+            self._size -= 1
+            self._condition.notify()
+
+
+def _close_quietly(conn):
+    try:
+        conn.close()
+    except Exception:
+        pass
@@ -0,0 +1,153 @@
+import os
+import json
+import uuid
+import hashlib
+import threading
+import pyarrow as pa
+
+DEFAULT_TTL = 60 * 60
+KEY_PREFIX = 'arrows:result:'
+# redis values are capped at 512MB, results are split across keys of CHUNK_SIZE bytes
+CHUNK_SIZE = 32 * 1024 * 1024
+# chunks sent per round trip
+CHUNKS_PER_WRITE = 4
+# per-entry cap: compressed results larger than this are returned but not cached. The total budget
+# is the server's maxmemory; every key has a TTL, so a volatile-lru/volatile-ttl policy evicts entries
+MAX_ENTRY_BYTES = 256 * 1024 * 1024
+# a worker computing a result holds the lock at most this long, waiting workers give up after LOCK_WAIT
+LOCK_TIMEOUT = 15 * 60
+LOCK_WAIT = 15 * 60
+# results that were too large to cache or failed to compute are not waited on for this long
+UNCACHEABLE_TTL = 60
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    # One client per process, redis-py clients are thread-safe and pool their connections
+    global _client
+    import redis
+    with _client_lock:
+        if _client is None:
+            _client = redis.Redis.from_url(os.getenv('REDIS_URL', 'redis://localhost:6379/0'))
+    return _client
+
+
+def cache_key(*parts):
+    return hashlib.sha256(json.dumps(parts, default=str).encode()).hexdigest()
+
+
+def get(key):
+    # Return the cached pa.Table for key, or None
+    client = get_client()
+    meta = client.get(f'{KEY_PREFIX}{key}')
+    if meta is None:
+        return None
+    meta = json.loads(meta)
+    chunks = client.mget([f'{KEY_PREFIX}{key}:{meta["id"]}:{i}' for i in range(meta['chunks'])])
+    if any(e is None for e in chunks):
+        return None
+    return pa.ipc.open_stream(pa.py_buffer(b''.join(chunks))).read_all()
+
+
+def put(key, arrow, ttl=DEFAULT_TTL):
+    # Store arrow as a zstd compressed IPC stream. Chunks are written under a new id before the
+    # metadata key that points at them, so readers never see a partially written entry.
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, arrow.schema, options=pa.ipc.IpcWriteOptions(compression='zstd')) as writer:
+        writer.write_table(arrow)
+    buffer = sink.getvalue()
+    if buffer.size > MAX_ENTRY_BYTES:
+        print(f'Result of {buffer.size / 1024 ** 2:,.0f} MiB is over the per-entry cap MAX_ENTRY_BYTES, not cached.')
+        return False
+
+    entry_id = uuid.uuid4().hex
+    chunks = [buffer[i:i + CHUNK_SIZE] for i in range(0, max(buffer.size, 1), CHUNK_SIZE)]
+    client = get_client()
+    # chunks go under a new id in small batches, the metadata key pointing at them is set last,
+    # so readers never see a partially written entry and no single transaction carries the whole result
+    for start in range(0, len(chunks), CHUNKS_PER_WRITE):
+        pipeline = client.pipeline(transaction=False)
+        for i, chunk in enumerate(chunks[start:start + CHUNKS_PER_WRITE], start):
+            pipeline.set(f'{KEY_PREFIX}{key}:{entry_id}:{i}', chunk.to_pybytes(), ex=ttl)
+        pipeline.execute()
+    # superseded chunks are not deleted, they expire with their ttl
+    client.set(f'{KEY_PREFIX}{key}', json.dumps({'id': entry_id, 'chunks': len(chunks), 'bytes': buffer.size}), ex=ttl)
+    return True
+
+
+def delete(key):
+    get_client().delete(f'{KEY_PREFIX}{key}')
+
+
+def cached(key_parts, compute, ttl=DEFAULT_TTL):
+    # Return the cached result for key_parts, or compute() and cache it.
+    # Single flight: while one worker computes a key, the others wait on a redis lock
+    # and read its result instead of running the same query. When the result cannot be cached
+    # (over MAX_ENTRY_BYTES, or compute() raised), a marker lets the waiters compute concurrently
+    # instead of one after another behind the lock.
+    # Redis errors (unreachable, timeouts, out of memory) never fail the query, it runs or returns uncached.
+    import redis
+    key = cache_key(*key_parts)
+    try:
+        arrow = get(key)
+        if arrow is not None:
+            return arrow
+        if _is_uncacheable(key):
+            return compute()
+        lock = get_client().lock(f'{KEY_PREFIX}{key}:lock', timeout=LOCK_TIMEOUT, blocking_timeout=LOCK_WAIT)
+        acquired = lock.acquire()
+    except redis.exceptions.RedisError as e:
+        print(f'Redis cache unavailable, running without it: {e}')
+        return compute()
+
+    try:
+        if acquired:
+            try:
+                arrow = get(key)
+                uncacheable = arrow is None and _is_uncacheable(key)
+            except redis.exceptions.RedisError as e:
+                print(f'Redis cache read failed: {e}')
+                arrow, uncacheable = None, False
+            if arrow is not None:
+                return arrow
+            if uncacheable:
+                _release(lock)
+                acquired = False
+                return compute()
+        try:
+            arrow = compute()
+        except Exception:
+            _mark_uncacheable(key)
+            raise
+        try:
+            if not put(key, arrow, ttl=ttl):
+                _mark_uncacheable(key)
+        except redis.exceptions.RedisError as e:
+            print(f'Result not cached, Redis write failed: {e}')
+        return arrow
+    finally:
+        if acquired:
+            _release(lock)
+
+
+def _is_uncacheable(key):
+    return get_client().exists(f'{KEY_PREFIX}{key}:uncacheable') > 0
+
+
+def _mark_uncacheable(key):
+    import redis
+    try:
+        get_client().set(f'{KEY_PREFIX}{key}:uncacheable', 1, ex=UNCACHEABLE_TTL)
+    except redis.exceptions.RedisError:
+        pass
+
+
+def _release(lock):
+    import redis
+    try:
+        lock.release()
+    except redis.exceptions.RedisError:
+        # the lock expired while computing or the connection dropped, it expires on its own
+        pass
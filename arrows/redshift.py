@@ -1,18 +1,29 @@
 import os
-import adbc_driver_postgresql.dbapi as postgresql
+import json
 import uuid
-import boto3
-import awswrangler as wr
-import duckdb
-import pandas as pd
-import psycopg2
-from jinja2 import Template
-from .template_renderer import TemplateRenderer, render_template
+import datetime
+import decimal
+import time
+from concurrent.futures import ThreadPoolExecutor
+import pyarrow as pa
+from .template_renderer import TemplateRenderer, render_template, render_string
 from . import s3
+from . import auth
 from .auth import load_redshift_credentials
+from .utils import _close_on_exhaust, _sql_literal
+from .pool import ConnectionPool
 
+# COPY loads one file per slice at a time, staged files are sized so every slice gets the same work
+COPY_TARGET_FILE_SIZE = 128 * 1024 * 1024
+COPY_ROW_GROUP_SIZE = 1024 * 1024
+DEFAULT_SLICE_COUNT = 4
+SLICE_COUNT_RETRY_SECONDS = 5 * 60
+
+# (count, monotonic expiry or None once read from the cluster)
+_slice_count = (None, None)
 
 def get_connection():
+    import psycopg2
     conn = psycopg2.connect(host=os.getenv('REDSHIFT_HOST'), 
                             database=os.getenv('REDSHIFT_DATABASE'),
                             user=os.getenv('REDSHIFT_USER'),
@@ -21,33 +32,74 @@ def get_connection():
     return conn
 
 
+def get_adbc_connection():
+    import adbc_driver_postgresql.dbapi as postgresql
+    host=os.getenv('REDSHIFT_HOST')
+    database=os.getenv('REDSHIFT_DATABASE')
+    user=os.getenv('REDSHIFT_USER')
+    password=os.getenv('REDSHIFT_PASSWORD')
+    port=os.getenv('REDSHIFT_PORT')
+    conn = postgresql.connect(f"postgresql://{user}:{password}@{host}:{port}/{database}")
+    return conn
+
+
+def _check_connection(conn):
+    cursor = conn.cursor()
+    try:
+        cursor.execute('SELECT 1')
+        cursor.fetchall()
+    finally:
+        cursor.close()
+    return True
+
+
+def _rollback(conn):
+    conn.rollback()
+
+
+_pools = {
+    'psycopg2': ConnectionPool(get_connection,
+                               max_size=int(os.getenv('REDSHIFT_POOL_SIZE', 8)),
+                               health_check=_check_connection,
+                               reset=_rollback),
+    'adbc': ConnectionPool(get_adbc_connection,
+                           max_size=int(os.getenv('REDSHIFT_POOL_SIZE', 8)),
+                           health_check=_check_connection,
+                           reset=_rollback),
+}
+
+
+def connection(driver='psycopg2', timeout=None):
+    # Lease a pooled connection: `with redshift.connection() as conn: ...`
+    return _pools[driver].connection(timeout=timeout)
+
+
+def close_connections():
+    for pool in _pools.values():
+        pool.close()
+
+
 def get_boto3_session():
-    boto3_session = boto3.Session(aws_access_key_id=os.getenv('AWS_ACCESS_KEY_ID'),
-                                  aws_secret_access_key=os.getenv('AWS_SECRET_ACCESS_KEY'),
-                                  aws_session_token=os.getenv('AWS_SESSION_TOKEN')
-                                  )
-    return boto3_session
+    return auth.get_boto3_session()
 
 
 def unload(sql, s3_path=None, bucket=None, **kwargs):
+    import awswrangler as wr
     if isinstance(s3_path, s3.S3Dataset):
         dataset = s3_path
     else:
         dataset = s3.S3Dataset(s3_path=s3_path, bucket=bucket)
     try:
         dataset.clear_contents()
-        conn = get_connection()
-        
         boto3_session = get_boto3_session()
 
-        wr.redshift.unload_to_files(
-                                    sql=Template(sql).render(**kwargs),
-                                    path=dataset.s3_path,
-                                    con=conn,
-                                    boto3_session=boto3_session
-                                    )
-        
-        conn.close()
+        with connection() as conn:
+            wr.redshift.unload_to_files(
+                                        sql=render_string(sql, **kwargs),
+                                        path=dataset.s3_path,
+                                        con=conn,
+                                        boto3_session=boto3_session
+                                        )
         
     except Exception as e:
             print(f'{e}')
@@ -55,21 +107,99 @@ def unload(sql, s3_path=None, bucket=None, **kwargs):
     return dataset
 
 
-def fetch_arrow(sql, engine = 's3', bucket=None, **kwargs):
-    if engine == 'adbc':
-        host=os.getenv('REDSHIFT_HOST')
-        database=os.getenv('REDSHIFT_DATABASE')
-        user=os.getenv('REDSHIFT_USER')
-        password=os.getenv('REDSHIFT_PASSWORD')
-        port=os.getenv('REDSHIFT_PORT')
-        
+def unload_incremental(sql, s3_path=None, watermark_column=None, initial_watermark=None, bucket=None, **kwargs):
+    # UNLOAD only the rows with watermark_column past the high-watermark stored in the dataset manifest.
+    # Each run lands in a new hive partition (unload_batch=...), so the dataset reads as the union of all runs.
+    if isinstance(s3_path, s3.S3Dataset):
+        dataset = s3_path
+    else:
+        dataset = s3.S3Dataset(s3_path=s3_path, bucket=bucket)
+    if watermark_column is None:
+        raise ValueError('watermark_column is required')
+    
+    manifest = dataset.read_manifest() or {'watermark_column': watermark_column, 'watermark': None, 'batches': []}
+    if manifest['watermark_column'] != watermark_column:
+        raise ValueError(f'{dataset} is tracked on "{manifest["watermark_column"]}", not "{watermark_column}"')
+    
+    low = _decode_watermark(manifest['watermark']) if manifest['watermark'] is not None else initial_watermark
+    sql = render_string(sql, **kwargs)
+    
+    # bound the extract by the current maximum so rows arriving during the UNLOAD are picked up next run
+    with connection() as conn:
+        cursor = conn.cursor()
         try:
-            conn = postgresql.connect(f"postgresql://{user}:{password}@{host}:{port}/{database}")
-            cursor = conn.cursor()
-            cursor.execute(Template(sql).render(**kwargs))
-            arrow = cursor.fetch_arrow_table()
+            cursor.execute(f'SELECT MAX({watermark_column}) FROM ({sql}) AS incremental_source')
+            high = cursor.fetchone()[0]
+        finally:
             cursor.close()
-            conn.close()
+    
+    if high is None or (low is not None and high <= low):
+        print(f'No new rows past {watermark_column} = {low}. Nothing unloaded.')
+        return dataset
+    
+    conditions = [f'{watermark_column} <= {_sql_literal(high)}']
+    if low is not None:
+        conditions.insert(0, f'{watermark_column} > {_sql_literal(low)}')
+    batch = datetime.datetime.now(datetime.timezone.utc).strftime('%Y%m%dT%H%M%S%f')
+    unload(f'SELECT * FROM ({sql}) AS incremental_source WHERE {" AND ".join(conditions)}',
+           s3_path=f'{dataset.s3_path}unload_batch={batch}/')
+    
+    manifest['watermark'] = _encode_watermark(high)
+    manifest['batches'].append({'unload_batch': batch,
+                                'low': _encode_watermark(low) if low is not None else None,
+                                'high': manifest['watermark']})
+    dataset.write_manifest(manifest)
+    print(f'Success: {watermark_column} unloaded up to {high}.')
+    return dataset
+
+
+def _encode_watermark(value):
+    if isinstance(value, datetime.datetime):
+        return {'type': 'timestamp', 'value': value.isoformat()}
+    elif isinstance(value, datetime.date):
+        return {'type': 'date', 'value': value.isoformat()}
+    elif isinstance(value, decimal.Decimal):
+        return {'type': 'decimal', 'value': str(value)}
+    return {'type': type(value).__name__, 'value': value}
+
+
+def _decode_watermark(watermark):
+    decoders = {
+        'timestamp': datetime.datetime.fromisoformat,
+        'date': datetime.date.fromisoformat,
+        'decimal': decimal.Decimal,
+    }
+    decoder = decoders.get(watermark['type'], lambda value: value)
+    return decoder(watermark['value'])
+
+
+def fetch_arrow(sql, engine = 's3', bucket=None, stream=False, slices=None, slice_column=None, slice_method='modulo', cache_ttl=None, **kwargs):
+    if stream:
+        if slices:
+            raise ValueError('slices cannot be combined with stream=True, fetch_batches streams a single query')
+        return fetch_batches(sql, engine=engine, bucket=bucket, **kwargs)
+    
+    if cache_ttl:
+        # shared redis result cache keyed by the rendered SQL and the engine, see arrows/redis.py
+        from . import redis as result_cache
+        rendered = render_string(sql, **kwargs) if engine == 'adbc' else sql.format(**kwargs)
+        return result_cache.cached(('redshift', engine, rendered),
+                                   lambda: fetch_arrow(sql, engine=engine, bucket=bucket, slices=slices, slice_column=slice_column,
+                                                       slice_method=slice_method, **kwargs),
+                                   ttl=cache_ttl)
+    
+    if engine == 'adbc' and slices:
+        return _fetch_arrow_sliced(render_string(sql, **kwargs), slices, slice_column, slice_method)
+    
+    if engine == 'adbc':
+        try:
+            with connection('adbc') as conn:
+                cursor = conn.cursor()
+                try:
+                    cursor.execute(render_string(sql, **kwargs))
+                    arrow = cursor.fetch_arrow_table()
+                finally:
+                    cursor.close()
             
         except Exception as e:
             print(f'{e}')
@@ -79,7 +209,8 @@ def fetch_arrow(sql, engine = 's3', bucket=None, **kwargs):
 
     else:
         try:
-            s3_dataset = unload(sql.format(**kwargs), bucket=bucket)
+            # temporary unload, read once: kept out of the local cache
+            s3_dataset = unload(sql.format(**kwargs), s3_path=s3.S3Dataset(bucket=bucket, cache=False))
             arrow = s3_dataset.to_arrow()
         except Exception as e:
             raise e
@@ -87,8 +218,105 @@ def fetch_arrow(sql, engine = 's3', bucket=None, **kwargs):
             s3_dataset.delete()
                 
         return arrow
+
+
+def _fetch_arrow_sliced(sql, slices, slice_column, slice_method):
+    # Split the query into slices over slice_column and fetch them concurrently on pooled ADBC connections
+    if slice_column is None:
+        raise ValueError('slice_column is required to fetch in slices')
+    
+    if slice_method == 'modulo':
+        predicates = _modulo_predicates(slice_column, slices)
+    elif slice_method == 'range':
+        with connection('adbc') as conn:
+            cursor = conn.cursor()
+            try:
+                cursor.execute(f'SELECT MIN({slice_column}), MAX({slice_column}) FROM ({sql}) AS sliced_source')
+                low, high = cursor.fetchone()
+            finally:
+                cursor.close()
+        if low is None:
+            predicates = ['TRUE']
+        else:
+            bounds = _range_bounds(low, high, slices)
+            predicates = [f'{slice_column} >= {_sql_literal(bounds[i])} AND {slice_column} < {_sql_literal(bounds[i + 1])}'
+                          for i in range(slices - 1)]
+            predicates.append(f'{slice_column} >= {_sql_literal(bounds[-1])} AND {slice_column} <= {_sql_literal(high)}')
+    else:
+        raise ValueError(f'slice_method must be "modulo" or "range", got "{slice_method}"')
+    # NULLs match no slice predicate, the first slice picks them up
+    predicates[0] = f'({predicates[0]}) OR {slice_column} IS NULL'
+    
+    def fetch_slice(predicate):
+        start = time.perf_counter()
+        with connection('adbc') as conn:
+            cursor = conn.cursor()
+            try:
+                cursor.execute(f'SELECT * FROM ({sql}) AS sliced_source WHERE {predicate}')
+                arrow = cursor.fetch_arrow_table()
+            finally:
+                cursor.close()
+        return arrow, time.perf_counter() - start
+    
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=len(predicates)) as executor:
+        results = list(executor.map(fetch_slice, predicates))
+    elapsed = time.perf_counter() - start
+    
+    print(f'{"slice":>5} {"rows":>12} {"seconds":>9} {"rows/s":>12}')
+    for i, (arrow, seconds) in enumerate(results):
+        print(f'{i:>5} {arrow.num_rows:>12,} {seconds:>9.2f} {arrow.num_rows / max(seconds, 1e-9):>12,.0f}')
+    total_rows = sum(arrow.num_rows for arrow, _ in results)
+    print(f'{"total":>5} {total_rows:>12,} {elapsed:>9.2f} {total_rows / max(elapsed, 1e-9):>12,.0f}')
+    
+    # concat_tables only collects the record batches of each slice, nothing is copied
+    arrow = pa.concat_tables([arrow for arrow, _ in results])
+    return arrow
+
+
+def _modulo_predicates(slice_column, slices):
+    # Redshift's MOD keeps the sign of the dividend, shift negative remainders into 0..slices-1
+    return [f'MOD(MOD({slice_column}, {slices}) + {slices}, {slices}) = {i}' for i in range(slices)]
+
+
+def _range_bounds(low, high, slices):
+    # lower bound of each slice; integer keys stay integers, float division would round large bigints
+    if isinstance(low, int) and isinstance(high, int):
+        return [low + (high - low) * i // slices for i in range(slices)]
+    return [low + (high - low) * i / slices for i in range(slices)]
+
+
+def fetch_batches(sql, engine='s3', bucket=None, batch_size=None, **kwargs):
+    # Return a RecordBatchReader-compatible stream (ClosingRecordBatchReader) instead of materializing the whole result.
+    # Connections and temporary S3 datasets are released once the reader is exhausted or closed.
+    if engine == 'adbc':
+        pool = _pools['adbc']
+        conn = pool.acquire()
+        try:
+            cursor = conn.cursor()
+            cursor.execute(render_string(sql, **kwargs))
+            reader = cursor.fetch_record_batch()
+        except Exception as e:
+            pool.release(conn, discard=True)
+            print(f'{e}')
+            raise e
+        
+        return _close_on_exhaust(reader, cursor.close, lambda: pool.release(conn))
+
+    else:
+        # streamed once, a local cache copy would download the whole unload before the first batch
+        s3_dataset = unload(sql.format(**kwargs), s3_path=s3.S3Dataset(bucket=bucket, cache=False))
+        try:
+            reader = s3_dataset.to_batches(batch_size=batch_size)
+        except Exception as e:
+            s3_dataset.delete()
+            raise e
+        
+        return _close_on_exhaust(reader, s3_dataset.delete)
+
     
 def fetch_dataframe(sql, engine='adbc', dtype_backend='numpy', **kwargs):
+    import pandas as pd
     arrow = fetch_arrow(sql, engine=engine, **kwargs)
     if dtype_backend == 'pyarrow':
         df = arrow.to_pandas(types_mapper=pd.ArrowDtype)
@@ -97,53 +325,162 @@ def fetch_dataframe(sql, engine='adbc', dtype_backend='numpy', **kwargs):
     return df
 
 
-def copy(table_name, s3_path, mode='append', **kwargs):
+def copy(table_name, s3_path, mode='append', manifest=False, **kwargs):
+    # s3_path is a dataset prefix, or the path of a COPY manifest file when manifest=True
+    import awswrangler as wr
     boto3_session = get_boto3_session()
-    conn = get_connection()
     schema, table = table_name.split('.')
-    dataset = s3.S3Dataset(s3_path=s3_path)
-    wr.redshift.copy_from_files(
-                                path=dataset.s3_path,
-                                con=conn,
-                                table=table,
-                                schema=schema,
-                                boto3_session=boto3_session,
-                                mode=mode,
-                                **kwargs
-                                )
-    conn.close()
+    path = s3_path if manifest else s3.S3Dataset(s3_path=s3_path).s3_path
+    with connection() as conn:
+        wr.redshift.copy_from_files(
+                                    path=path,
+                                    con=conn,
+                                    table=table,
+                                    schema=schema,
+                                    boto3_session=boto3_session,
+                                    mode=mode,
+                                    manifest=manifest,
+                                    **kwargs
+                                    )
     print(f'Success: Data transfered to Redshift.')
 
 
-def arrow_to_redshift(arrow, table_name, mode = 'append', bucket=None, **kwargs):
+def get_slice_count():
+    # Number of slices of the cluster, cached per process. When it cannot be read the default is
+    # used and the query retried after SLICE_COUNT_RETRY_SECONDS, a transient error does not pin it.
+    global _slice_count
+    count, expires = _slice_count
+    if count is not None and (expires is None or time.monotonic() < expires):
+        return count
+    try:
+        with connection() as conn:
+            cursor = conn.cursor()
+            try:
+                cursor.execute('SELECT COUNT(*) FROM stv_slices')
+                count = cursor.fetchone()[0]
+            finally:
+                cursor.close()
+    except Exception as e:
+        # stv_slices is not available on Redshift Serverless
+        print(f'Could not read the slice count, using {DEFAULT_SLICE_COUNT}: {e}')
+        count = None
+    if count:
+        _slice_count = (count, None)
+    else:
+        _slice_count = (DEFAULT_SLICE_COUNT, time.monotonic() + SLICE_COUNT_RETRY_SECONDS)
+    return _slice_count[0]
+
+
+def arrow_to_redshift(arrow, table_name, mode = 'append', bucket=None, compression='zstd',
+                      primary_keys=None, precombine_key=None, dedupe=True, **kwargs):
+    # Stage arrow as a multiple of the cluster slice count of evenly sized parquet files
+    # and load them with a single manifest COPY.
+    # mode='upsert' COPYs into a staging table, then deletes the matching primary_keys rows
+    # and inserts the staged rows in one transaction, so the cost follows the size of arrow.
+    if primary_keys is not None:
+        kwargs['primary_keys'] = primary_keys
+    if mode == 'upsert':
+        if not primary_keys:
+            raise ValueError('mode="upsert" requires primary_keys')
+        if precombine_key is not None:
+            kwargs['precombine_key'] = precombine_key
+        if dedupe:
+            arrow = _dedupe(arrow, primary_keys, precombine_key)
+    
     dataset = s3.S3Dataset(bucket=bucket)
     
     try:
-        dataset.from_arrow(arrow)
-        dataset.to_redshift(table_name, mode=mode, **kwargs)
+        timings = {}
+        start = time.perf_counter()
+        buffers = _encode_copy_files(arrow, get_slice_count(), compression)
+        timings['write'] = time.perf_counter() - start
+        
+        start = time.perf_counter()
+        manifest_path = _upload_copy_files(dataset, buffers)
+        timings['upload'] = time.perf_counter() - start
+        
+        start = time.perf_counter()
+        copy(table_name, manifest_path, mode=mode, manifest=True, **kwargs)
+        timings['copy'] = time.perf_counter() - start
+        
+        size = sum(e.size for e in buffers)
+        print(f'{len(buffers)} {compression} parquet files ({size / 1024 ** 2:,.1f} MiB) for {get_slice_count()} slices: '
+              + ', '.join(f'{stage} {seconds:.1f}s' for stage, seconds in timings.items()))
 
     except Exception as e:
         raise e
     finally:
         dataset.delete()
+
+
+def _dedupe(arrow, primary_keys, precombine_key=None):
+    # Keep one row per primary key: the one with the largest precombine_key, else the last one
+    import pyarrow.compute as pc
+    if precombine_key is not None:
+        # nulls sort first so they never win, sort_indices is stable so ties keep their original order
+        order = pa.table({'valid': pc.is_valid(arrow[precombine_key]), 'key': arrow[precombine_key]})
+        arrow = arrow.take(pc.sort_indices(order, sort_keys=[('valid', 'ascending'), ('key', 'ascending')]))
+    # take the last row of each key by index, aggregating the values themselves fails on nested columns
+    rows = pc.subtract(pc.cumulative_sum(pa.repeat(pa.scalar(1, pa.int64()), arrow.num_rows)), 1)
+    index = pa.table({e: arrow[e] for e in primary_keys}).append_column('_arrows_row', rows)
+    last_rows = index.group_by(primary_keys).aggregate([('_arrows_row', 'max')])['_arrows_row_max']
+    deduped = arrow.take(last_rows.take(pc.sort_indices(last_rows)))
+    if deduped.num_rows < arrow.num_rows:
+        print(f'Dropped {arrow.num_rows - deduped.num_rows:,} duplicate rows on {", ".join(primary_keys)}.')
+    return deduped
+
+
+def _encode_copy_files(arrow, slice_count, compression):
+    import pyarrow.parquet as pq
+    files_per_slice = max(1, -(-arrow.nbytes // (slice_count * COPY_TARGET_FILE_SIZE)))
+    num_files = max(1, min(slice_count * files_per_slice, arrow.num_rows))
+    rows_per_file = max(1, -(-arrow.num_rows // num_files))
+    
+    def encode(offset):
+        sink = pa.BufferOutputStream()
+        pq.write_table(arrow.slice(offset, rows_per_file), sink,
+                       compression=compression,
+                       row_group_size=min(rows_per_file, COPY_ROW_GROUP_SIZE))
+        return sink.getvalue()
+    
+    with ThreadPoolExecutor(max_workers=min(num_files, os.cpu_count() or 1)) as executor:
+        buffers = list(executor.map(encode, range(0, max(arrow.num_rows, 1), rows_per_file)))
+    return buffers
+
+
+def _upload_copy_files(dataset, buffers):
+    # Upload the files concurrently and return the s3 path of their COPY manifest
+    def upload(i):
+        path = f'{dataset.s3_path}part-{i:05d}.parquet'
+        with dataset.s3.open_output_stream(path[5:]) as stream:
+            stream.write(buffers[i])
+        # content_length is required in manifests of columnar files
+        return {'url': path, 'mandatory': True, 'meta': {'content_length': buffers[i].size}}
+    
+    with ThreadPoolExecutor(max_workers=min(len(buffers), 16)) as executor:
+        entries = list(executor.map(upload, range(len(buffers))))
+    
+    manifest_path = f'{dataset.s3_path}_copy.manifest'
+    with dataset.s3.open_output_stream(manifest_path[5:]) as stream:
+        stream.write(json.dumps({'entries': entries}).encode())
+    return manifest_path
     
         
 
 def execute_sql(sql, **kwargs):
-    conn = get_connection()
-    cursor = conn.cursor()
-    try:
-        print(f'Running SQL...')
-        print(sql)
-        cursor.execute(Template(sql).render(**kwargs))
-        conn.commit()
-        print('SUCCESS: SQL executed.')
-    except Exception as e:
-        conn.rollback()
-        raise e
-    finally:
-        cursor.close()
-        conn.close()
+    with connection() as conn:
+        cursor = conn.cursor()
+        try:
+            print(f'Running SQL...')
+            print(sql)
+            cursor.execute(render_string(sql, **kwargs))
+            conn.commit()
+            print('SUCCESS: SQL executed.')
+        except Exception as e:
+            conn.rollback()
+            raise e
+        finally:
+            cursor.close()
         
         
 def execute_sql_file(sql_script_path, sql_script_folder=None, **kwargs):
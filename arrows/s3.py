@@ -1,18 +1,42 @@
-from pyarrow.fs import S3FileSystem, FileType
+from pyarrow.fs import S3FileSystem, LocalFileSystem, FileType, FileSelector, copy_files
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
 import os
-import duckdb
-import polars as pl
-from . import redshift
+import json
+import time
 import uuid
+import tempfile
+import pyarrow as pa
 import pyarrow.parquet as pq
-import polars as pl
-from jinja2 import Template
-from .utils import _parse_self_sql
-from .auth import load_aws_credentials
+import pyarrow.dataset as ds
+from .template_renderer import render_string
+from . import duckdb_session
+from .utils import _parse_self_sql, _bind_tables, _evict_lru, _sql_literal, _close_on_exhaust
+
+DEFAULT_TARGET_FILE_SIZE = 256 * 1024 * 1024
+DEFAULT_ROW_GROUP_SIZE = 1024 * 1024
+DEFAULT_ROWS_PER_FILE = 4 * 1024 * 1024
+DEFAULT_CACHE_SIZE = 20 * 1024 ** 3
+MANIFEST_NAME = '_arrows_manifest.json'
+DEFAULT_QUERY_BATCH_SIZE = 128 * 1024
+# where out-of-core queries spill, memory_limit defaults to duckdb's 80% of RAM
+SPILL_DIRECTORY = Path(tempfile.gettempdir())/'arrows/duckdb_spill'
+
+_local_cache = None
 
 def set_default_bucket_name(default_bucket_name):
     os.environ.update({'DEFAULT_BUCKET_NAME': default_bucket_name})
 
+def _s3_filesystem():
+    # AWS_ENDPOINT_URL points pyarrow reads and writes at an S3 compatible store such as MinIO
+    endpoint = os.getenv('AWS_ENDPOINT_URL')
+    return S3FileSystem(endpoint_override=endpoint) if endpoint else S3FileSystem()
+
+def set_io_threads(io_threads):
+    # pyarrow's IO thread pool, used to fetch files concurrently, is shared by the whole process:
+    # every S3Dataset and any other pyarrow user
+    pa.set_io_thread_count(io_threads)
+
 def format_s3_path(s3_path:str):
     if not s3_path.endswith('/'):
         s3_path = s3_path + '/'
@@ -21,6 +45,18 @@ def format_s3_path(s3_path:str):
     return s3_path
 
 
+def enable_local_cache(cache_dir=None, max_bytes=DEFAULT_CACHE_SIZE):
+    # Serve S3Dataset reads from a local on-disk parquet cache
+    global _local_cache
+    _local_cache = LocalCache(cache_dir=cache_dir, max_bytes=max_bytes)
+    return _local_cache
+
+
+def disable_local_cache():
+    global _local_cache
+    _local_cache = None
+
+
 def create_dataset(s3_path=None, bucket=None):
     dataset = S3Dataset(s3_path=s3_path, bucket=bucket)
     return dataset
@@ -31,97 +67,518 @@ def get_dataset(s3_path):
     return dataset
 
 
-def arrow_to_s3(arrow, s3_path=None, bucket=None, engine='duckdb'):
-    dataset = S3Dataset(s3_path=s3_path, bucket=bucket)
+def arrow_to_s3(arrow, s3_path=None, bucket=None, engine='duckdb', **io_options):
+    dataset = S3Dataset(s3_path=s3_path, bucket=bucket, **io_options)
     dataset.from_arrow(arrow, engine=engine)
     return dataset
 
-def polars_to_s3(df, s3_path=None, bucket=None):
-    dataset = S3Dataset(s3_path=s3_path, bucket=bucket)
+def polars_to_s3(df, s3_path=None, bucket=None, **io_options):
+    dataset = S3Dataset(s3_path=s3_path, bucket=bucket, **io_options)
     dataset.from_polars(df)
     return dataset
 
 
+def _bind_datasets(sql, datasets):
+    return _bind_tables(sql, tuple((name, dataset._parquet_source()) for name, dataset in datasets))
+
+
+def _out_of_core_connection(memory_limit=None, temp_directory=None):
+    temp_directory = Path(temp_directory if temp_directory is not None else SPILL_DIRECTORY)
+    temp_directory.mkdir(parents=True, exist_ok=True)
+    settings = {'temp_directory': str(temp_directory), 'preserve_insertion_order': False}
+    if memory_limit is not None:
+        settings['memory_limit'] = memory_limit
+    return duckdb_session.connect(**settings)
+
+
+def _partition_paths(arrow, partition_by):
+    # hive directories (col=value/...) of the partitions in arrow, encoded like the pyarrow and duckdb
+    # writers do: values are URL-encoded and nulls become __HIVE_DEFAULT_PARTITION__
+    keys = arrow.select(partition_by)
+    partitioning = ds.partitioning(keys.schema, flavor='hive')
+    paths = []
+    for partition in keys.group_by(partition_by).aggregate([]).to_pylist():
+        expression = None
+        for column, value in partition.items():
+            predicate = ds.field(column).is_null() if value is None else ds.field(column) == value
+            expression = predicate if expression is None else expression & predicate
+        paths.append(partitioning.format(expression)[0])
+    return paths
+
+
+def _partition_schema(discovered, relative_paths):
+    # One partition type policy for every engine: the types pyarrow infers from the hive paths, int32 for
+    # integers and string otherwise (d=2024-01-01 is a string), partitions holding only nulls are strings.
+    # duckdb and polars would infer dates and int64, they are given this schema explicitly.
+    # Only keys found in the paths are kept, pyarrow reports the file columns when there are none.
+    keys = {segment.split('=', 1)[0] for path in relative_paths for segment in path.split('/')[:-1] if '=' in segment}
+    return pa.schema([e.with_type(pa.string()) if pa.types.is_null(e.type) else e for e in discovered if e.name in keys])
+
+
+def _row_bytes(schema, variable_width_bytes=32):
+    # estimated in-memory bytes per row: the width of fixed-size types, variable_width_bytes per string,
+    # binary or nested value
+    total = 0
+    for field in schema:
+        try:
+            total += max(1, field.type.bit_width // 8)
+        except ValueError:
+            total += variable_width_bytes
+    return total
+
+
+def _normalize_filters(filters):
+    # DNF filters: a list of (column, op, value) tuples is one AND group, a list of lists is OR of AND groups
+    if filters and isinstance(filters[0], tuple):
+        filters = [filters]
+    return [list(e) for e in filters]
+
+
+def _to_expression(filters):
+    if filters is None or isinstance(filters, ds.Expression):
+        return filters
+    return pq.filters_to_expression(_normalize_filters(filters))
+
+
+def _filters_to_sql(filters):
+    disjunction = []
+    for conjunction in _normalize_filters(filters):
+        predicates = []
+        for column, op, value in conjunction:
+            column = '"' + column.replace('"', '""') + '"'
+            op = op.lower()
+            if op in ('in', 'not in'):
+                values = ', '.join(_sql_literal(e) for e in value)
+                predicates.append(f'{column} {op.upper()} ({values})')
+            else:
+                op = '=' if op == '==' else op
+                predicates.append(f'{column} {op} {_sql_literal(value)}')
+        disjunction.append('(' + ' AND '.join(predicates) + ')')
+    return ' OR '.join(disjunction)
+
+
+def _filters_to_polars(filters):
+    import polars as pl
+    operators = {
+        '=': lambda c, v: c == v,
+        '==': lambda c, v: c == v,
+        '!=': lambda c, v: c != v,
+        '<': lambda c, v: c < v,
+        '>': lambda c, v: c > v,
+        '<=': lambda c, v: c <= v,
+        '>=': lambda c, v: c >= v,
+        'in': lambda c, v: c.is_in(list(v)),
+        'not in': lambda c, v: ~c.is_in(list(v)),
+    }
+    disjunction = None
+    for conjunction in _normalize_filters(filters):
+        expression = None
+        for column, op, value in conjunction:
+            predicate = operators[op.lower()](pl.col(column), value)
+            expression = predicate if expression is None else expression & predicate
+        disjunction = expression if disjunction is None else disjunction | expression
+    return disjunction
+
+
+class LocalCache():
+    # On-disk copy of S3 parquet objects, keyed by object key, size and mtime.
+    # Files are evicted least-recently-used first once the cache exceeds max_bytes.
+    def __init__(self, cache_dir=None, max_bytes=DEFAULT_CACHE_SIZE, max_workers=16):
+        self.cache_dir = Path(cache_dir) if cache_dir is not None else Path.home()/'.cache/arrows/s3'
+        self.max_bytes = max_bytes
+        self.max_workers = max_workers
+        self.filesystem = LocalFileSystem(use_mmap=True)
+        
+    def __repr__(self):
+        return f'LocalCache: {self.cache_dir}'
+    
+    def local_dir(self, s3_path):
+        return self.cache_dir / format_s3_path(s3_path)[5:].lstrip('/')
+        
+    def local_path(self, file_info):
+        # the size and mtime are part of the file name, so a rewritten object is a new cache entry
+        directory, name = file_info.path.rsplit('/', 1)
+        return self.cache_dir / directory.lstrip('/') / f'{file_info.size}-{file_info.mtime_ns}-{name}'
+    
+    def fetch(self, s3, file_infos):
+        # Return local paths for file_infos, downloading the misses concurrently
+        paths = []
+        misses = []
+        for file_info in file_infos:
+            path = self.local_path(file_info)
+            paths.append(path)
+            try:
+                os.utime(path)
+            except FileNotFoundError:
+                misses.append((file_info, path))
+        
+        if misses:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                list(executor.map(lambda miss: self._download(s3, *miss), misses))
+            _evict_lru(self.cache_dir, self.max_bytes, keep=paths)
+        return [str(e) for e in paths]
+    
+    def _download(self, s3, file_info, path):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temp_path = path.with_name(f'{path.name}.{uuid.uuid4()}.tmp')
+        try:
+            copy_files(file_info.path, str(temp_path), source_filesystem=s3, destination_filesystem=self.filesystem)
+            os.replace(temp_path, path)
+        finally:
+            if temp_path.exists():
+                temp_path.unlink()
+                
+    def clear(self):
+        _evict_lru(self.cache_dir, 0)
+
+
 class S3Dataset():
-    def __init__(self, s3_path=None, bucket=None):
-        self.s3 = S3FileSystem()
+    def __init__(self, s3_path=None, bucket=None, fragment_readahead=8, batch_readahead=16,
+                 target_file_size=DEFAULT_TARGET_FILE_SIZE, row_group_size=DEFAULT_ROW_GROUP_SIZE, cache=None):
+        self.s3 = _s3_filesystem()
         bucket = bucket if bucket else os.getenv('DEFAULT_BUCKET_NAME')
         s3_path = s3_path if s3_path is not None else f's3://{bucket}/{uuid.uuid4()}/'
         self.s3_path = format_s3_path(s3_path)
         
+        # read parallelism: number of files fetched concurrently and batches prefetched per file
+        self.fragment_readahead = fragment_readahead
+        self.batch_readahead = batch_readahead
+        # write layout: approximate bytes per parquet file and rows per row group
+        self.target_file_size = target_file_size
+        self.row_group_size = row_group_size
+        # None follows enable_local_cache(), False disables caching, or pass a LocalCache
+        self._cache = cache
+        
     def __repr__(self):
         return f'S3Dataset: {self.s3_path}'
     
+    @property
+    def cache(self):
+        if self._cache is None:
+            return _local_cache
+        elif self._cache is True:
+            return _local_cache if _local_cache is not None else enable_local_cache()
+        elif self._cache is False:
+            return None
+        return self._cache
+    
+    def _files(self):
+        selector = FileSelector(self.s3_path[5:], allow_not_found=True, recursive=True)
+        file_infos = [e for e in self.s3.get_file_info(selector)
+                      if e.type == FileType.File and not e.base_name.startswith(('_', '.'))]
+        return file_infos
+    
+    def _parquet_glob(self):
+        # the data files only, the manifest and other state files next to them are not scanned
+        return f'{self.s3_path}**/*.parquet'
+    
+    def _s3_dataset(self, files):
+        # pyarrow dataset over the listed S3 files with the partition types of _partition_schema
+        options = {'format': 'parquet', 'filesystem': self.s3, 'partition_base_dir': self.s3_path[5:]}
+        paths = [e.path for e in files]
+        dataset = ds.dataset(paths, partitioning='hive', **options)
+        discovered = dataset.partitioning.schema if dataset.partitioning is not None else pa.schema([])
+        partition_schema = _partition_schema(discovered, [e[len(options['partition_base_dir']):] for e in paths])
+        if partition_schema.equals(discovered):
+            return dataset
+        schema = pa.schema([partition_schema.field(e.name) if e.name in partition_schema.names else e for e in dataset.schema])
+        return ds.dataset(paths, schema=schema, partitioning=ds.partitioning(partition_schema, flavor='hive'), **options)
+    
+    def _read_dataset(self, filter=None):
+        # (dataset, cached): the local cache copy of the files a read scans, or the S3 dataset when caching
+        # is off or the read is larger than the cache. Partitions are pruned with filter before downloading.
+        files = self._files()
+        dataset = self._s3_dataset(files)
+        cache = self.cache
+        if cache is None:
+            return dataset, False
+        scanned = {e.path for e in dataset.get_fragments(filter=_to_expression(filter))}
+        files = [e for e in files if e.path in scanned]
+        if sum(e.size for e in files) > cache.max_bytes:
+            # streamed from S3 instead of flushing the cache
+            return dataset, False
+        local = ds.dataset(cache.fetch(self.s3, files), format='parquet', schema=dataset.schema,
+                           partitioning=dataset.partitioning, filesystem=cache.filesystem,
+                           partition_base_dir=str(cache.local_dir(self.s3_path)))
+        return local, True
+    
+    def _dataset(self, filter=None):
+        return self._read_dataset(filter)[0]
+    
+    def _parquet_source(self, filter=None):
+        # the parquet files of the dataset as a duckdb table expression
+        dataset, cached = self._read_dataset(filter)
+        if cached:
+            source = '[' + ', '.join(_sql_literal(e) for e in dataset.files) + ']'
+        else:
+            source = _sql_literal(self._parquet_glob())
+        partition_schema = dataset.partitioning.schema if dataset.partitioning is not None else pa.schema([])
+        if len(partition_schema) == 0:
+            return f'read_parquet({source}, hive_partitioning = true)'
+        types = duckdb_session.cursor().from_arrow(partition_schema.empty_table()).types
+        hive_types = ', '.join(f'{_sql_literal(e.name)}: {_sql_literal(str(t))}' for e, t in zip(partition_schema, types))
+        return f'read_parquet({source}, hive_partitioning = true, hive_types = {{{hive_types}}})'
+    
     def to_redshift(self, table_name, mode='append', **kwargs):
+        from . import redshift
         redshift.copy(table_name, self.s3_path, mode=mode, **kwargs)
     
-    def to_arrow(self, engine='pyarrow'):
-        #fetch_arrow
+    def to_arrow(self, engine='pyarrow', columns=None, filter=None):
+        # columns and filter are pushed down to the parquet scan.
+        # filter is a pyarrow.dataset expression or DNF tuples, e.g. [('date', '=', '2024-01-01'), ('id', 'in', [1, 2])].
+        # Every engine reads hive partition columns with the same types, see _partition_schema.
         if engine == 'pyarrow':
-            arrow = pq.read_table(self.s3_path)
+            dataset = self._dataset(filter)
+            arrow = dataset.to_table(columns=columns,
+                                     filter=_to_expression(filter),
+                                     fragment_readahead=self.fragment_readahead,
+                                     batch_readahead=self.batch_readahead,
+                                     fragment_scan_options=ds.ParquetFragmentScanOptions(pre_buffer=True))
         else:
-            arrow = self.to_duckdb().to_arrow_table()
+            arrow = self.to_duckdb(columns=columns, filter=filter).to_arrow_table()
         return arrow
     
-    def to_duckdb(self):
+    def to_batches(self, batch_size=None, columns=None, filter=None):
+        # stream the dataset one file at a time as a pyarrow RecordBatchReader
+        dataset = self._dataset(filter)
+        options = {'fragment_readahead': 1, 'columns': columns, 'filter': _to_expression(filter)}
+        if batch_size is not None:
+            options['batch_size'] = batch_size
+        reader = dataset.scanner(**options).to_reader()
+        return reader
+    
+    def to_duckdb(self, columns=None, filter=None):
         # fetch duckdb connection instance using duckdb
-        duckdb_relation = duckdb.from_parquet(f'{self.s3_path}*.parquet')
+        if isinstance(filter, ds.Expression):
+            # duckdb cannot translate pyarrow expressions, let the pyarrow scanner apply them
+            scanner = self._dataset(filter).scanner(columns=columns, filter=filter)
+            return duckdb_session.cursor().from_arrow(scanner)
+        
+        select = ', '.join('"' + e.replace('"', '""') + '"' for e in columns) if columns else '*'
+        where = f'WHERE {_filters_to_sql(filter)}' if filter else ''
+        duckdb_relation = duckdb_session.cursor().sql(f'SELECT {select} FROM {self._parquet_source(filter)} {where}')
         return duckdb_relation
     
-    def to_polars(self, lazy=False):
+    def to_polars(self, lazy=False, columns=None, filter=None):
         # fetch polars dataframe using polars
-        if lazy == False:
-            df = pl.read_parquet(self.s3_path)
+        import polars as pl
+        dataset, cached = self._read_dataset(filter)
+        if cached or isinstance(filter, ds.Expression):
+            # cached files are memory-mapped by pyarrow and handed to polars without a copy
+            if isinstance(filter, ds.Expression):
+                dataset = dataset.filter(filter)
+            df = pl.scan_pyarrow_dataset(dataset)
         else:
-            df = pl.scan_parquet(self.s3_path)
+            partition_schema = dataset.partitioning.schema if dataset.partitioning is not None else pa.schema([])
+            hive_schema = pl.from_arrow(partition_schema.empty_table()).schema if len(partition_schema) else None
+            df = pl.scan_parquet(self._parquet_glob(), hive_partitioning=True, hive_schema=hive_schema)
+        
+        if filter is not None and not isinstance(filter, ds.Expression) and len(filter) > 0:
+            df = df.filter(_filters_to_polars(filter))
+        if columns:
+            df = df.select(columns)
+        if lazy == False:
+            df = df.collect()
         return df
     
-    def from_arrow(self, arrow, engine='pyarrow'):
-        self.clear_contents()   
+    def from_arrow(self, arrow, engine='pyarrow', partition_by=None, sort_by=None, overwrite_partitions=False):
+        # partition_by writes hive-style directories (col=value/), sort_by orders rows within each file
+        # for tighter min/max statistics. overwrite_partitions only replaces the partitions present in arrow.
+        partition_by = [partition_by] if isinstance(partition_by, str) else partition_by
+        sort_by = [sort_by] if isinstance(sort_by, str) else sort_by
+        if overwrite_partitions and not partition_by:
+            raise ValueError('overwrite_partitions requires partition_by')
+        if not overwrite_partitions:
+            self.clear_contents()
+        
+        sort_keys = [(e, 'ascending') if isinstance(e, str) else e for e in (partition_by or []) + (sort_by or [])]
+        if sort_by:
+            arrow = arrow.sort_by(sort_keys)
         
         try:
             if engine == 'pyarrow':
-                pq.write_to_dataset(arrow, self.s3_path)
+                rows_per_file = self._rows_per_file(arrow.nbytes, arrow.num_rows)
+                rows_per_group = min(self.row_group_size, rows_per_file)
+                ds.write_dataset(arrow, self.s3_path[5:], format='parquet', filesystem=self.s3,
+                                 partitioning=partition_by,
+                                 partitioning_flavor='hive' if partition_by else None,
+                                 basename_template=f'{uuid.uuid4()}-{{i}}.parquet',
+                                 existing_data_behavior='delete_matching' if overwrite_partitions else 'overwrite_or_ignore',
+                                 max_rows_per_file=rows_per_file,
+                                 max_rows_per_group=rows_per_group,
+                                 min_rows_per_group=rows_per_group)
             else:
-                duckdb.execute(f'''
-                                COPY arrow TO
-                                '{self.s3_path[:-1]}'
-                                (
-                                    FORMAT parquet,
-                                    FILE_SIZE_BYTES '1G'
-                                )
+                if overwrite_partitions:
+                    self._clear_partitions(arrow, partition_by)
+                order_by = ', '.join(f'"{c}" {"DESC" if o == "descending" else "ASC"}' for c, o in sort_keys)
+                duckdb_session.cursor().execute(f'''
+                                COPY (SELECT * FROM arrow {f'ORDER BY {order_by}' if sort_by else ''}) TO
+                                {_sql_literal(self._copy_destination())}
+                                ({self._copy_options(partition_by)})
                                 ''')
         except Exception as e:
             print(f'{e}')
             raise e
         
-    def from_polars(self, df:pl.DataFrame|pl.LazyFrame):
+    def _copy_destination(self):
+        # the dataset directory as the target of duckdb COPY ... TO and polars sinks
+        return self.s3_path[:-1]
+    
+    def _copy_options(self, partition_by=None):
+        # parquet layout options of a duckdb COPY ... TO this dataset. Files get new uuid names, so a COPY
+        # adds files next to the existing ones instead of overwriting them.
+        if partition_by:
+            # duckdb cannot rotate files inside partitions, so target_file_size only applies unpartitioned
+            layout_options = f"""
+                                    PARTITION_BY ({', '.join(f'"{e}"' for e in partition_by)}),"""
+        else:
+            layout_options = f"""
+                                    FILE_SIZE_BYTES {self.target_file_size},"""
+        return f"""
+                                    FORMAT parquet,{layout_options}
+                                    OVERWRITE_OR_IGNORE true,
+                                    FILENAME_PATTERN '{{uuid}}',
+                                    ROW_GROUP_SIZE {self.row_group_size}
+                                """
+        
+    def _clear_partitions(self, arrow, partition_by):
+        # delete the hive partition directories that arrow is about to rewrite
+        for partition_path in _partition_paths(arrow, partition_by):
+            path = f'{self.s3_path[5:]}{partition_path}'
+            if self.s3.get_file_info(path).type == FileType.Directory:
+                self.s3.delete_dir(path)
+        
+    def from_polars(self, df:'pl.DataFrame|pl.LazyFrame'):
+        # files of about target_file_size bytes, measured on the in-memory size like from_arrow
+        import polars as pl
         self.clear_contents()  
         
-        partition_info = pl.PartitionMaxSize(base_path=self.s3_path, max_size=512_000)
+        base_path = f'{self._copy_destination()}/'
         if isinstance(df, pl.LazyFrame):
-            df.sink_parquet(partition_info)
+            # the row count is unknown before the sink runs, rows per file come from the schema's row width
+            rows_per_file = max(1, self.target_file_size // _row_bytes(pl.DataFrame(schema=df.collect_schema()).to_arrow().schema))
         else:
-            df.write_parquet(partition_info)
+            rows_per_file = self._rows_per_file(df.estimated_size(), df.height)
+        # files are only rotated between row groups
+        rows_per_group = min(self.row_group_size, rows_per_file)
+        if hasattr(pl, 'PartitionBy'):
+            # polars >= 2 rotates files by their estimated size, for DataFrames and lazy sinks alike
+            partition_info = pl.PartitionBy(base_path, approximate_bytes_per_file=self.target_file_size)
+            df.lazy().sink_parquet(partition_info, row_group_size=rows_per_group)
+            return
         
-    def from_redshift(self, sql, **kwargs):
+        partition_info = pl.PartitionMaxSize(base_path=base_path, max_size=rows_per_file)
+        if isinstance(df, pl.LazyFrame):
+            df.sink_parquet(partition_info, row_group_size=rows_per_group)
+        else:
+            df.write_parquet(partition_info, row_group_size=rows_per_group)
+    
+    def _rows_per_file(self, nbytes, num_rows):
+        # translate target_file_size into a row count using the in-memory size as an estimate
+        if not nbytes or not num_rows:
+            return DEFAULT_ROWS_PER_FILE
+        return max(1, int(self.target_file_size * num_rows / nbytes))
+        
+    def from_redshift(self, sql, watermark_column=None, **kwargs):
+        from . import redshift
+        if watermark_column is not None:
+            # append only the rows past the stored watermark as a new partition
+            redshift.unload_incremental(sql, s3_path=self, watermark_column=watermark_column, **kwargs)
+            return
         self.clear_contents()
         redshift.unload(sql, s3_path=self, **kwargs)
         
-    def query(self, sql, **kwargs):
-        sql = Template(sql).render(**kwargs)
-        template = Template('''
-        with temp_s3_dataset_table as (select * from '{{ s3_path + '*.parquet'}}')
-        {{ _parse_self_sql(sql, 'self', 'temp_s3_dataset_table') }}
-        ''')
-        sql = template.render(sql = sql , s3_path = self.s3_path, _parse_self_sql = _parse_self_sql)
-        return duckdb.sql(sql)
+    def to_spark(self, spark=None):
+        # executors read the parquet files directly, the data never passes through the driver
+        from . import spark as spark_interop
+        return spark_interop.read_s3(self, spark=spark)
+        
+    def from_spark(self, df, partition_by=None):
+        from . import spark as spark_interop
+        spark_interop.to_s3(df, self, mode='overwrite', partition_by=partition_by)
+        
+    def from_mysql(self, sql, **kwargs):
+        # stream the query result into parquet files batch by batch, the table is never held in memory
+        from . import mysql
+        self.clear_contents()
+        reader = mysql.fetch_batches(sql, **kwargs)
+        rows_per_file = self._rows_per_file(None, None)
+        rows_per_group = min(self.row_group_size, rows_per_file)
+        ds.write_dataset(reader, self.s3_path[5:], format='parquet', filesystem=self.s3,
+                         basename_template=f'{uuid.uuid4()}-{{i}}.parquet',
+                         max_rows_per_file=rows_per_file,
+                         max_rows_per_group=rows_per_group,
+                         min_rows_per_group=rows_per_group)
+        
+    def query(self, sql, cache_ttl=None, **kwargs):
+        # S3Dataset kwargs are joinable by name besides self, e.g.
+        # query('SELECT * FROM self JOIN users USING (user_id)', users=users_dataset)
+        sql, datasets = self._render(sql, kwargs)
+        if cache_ttl:
+            # shared redis result cache, the key includes the datasets' files so a rewrite invalidates it
+            from . import redis as result_cache
+            files = {name: sorted((e.path, e.size, e.mtime_ns) for e in dataset._files()) for name, dataset in datasets}
+            arrow = result_cache.cached(('s3', self.s3_path, files, sql),
+                                        lambda: duckdb_session.cursor().sql(_bind_datasets(sql, datasets)).to_arrow_table(),
+                                        ttl=cache_ttl)
+            return duckdb_session.cursor().from_arrow(arrow)
+        return duckdb_session.cursor().sql(_bind_datasets(sql, datasets))
+    
+    def query_batches(self, sql, batch_size=DEFAULT_QUERY_BATCH_SIZE, memory_limit=None, temp_directory=None, **kwargs):
+        # Out-of-core query: runs on a dedicated connection limited to memory_limit (e.g. '4GB'), large joins,
+        # aggregations and sorts spill to temp_directory. The result is streamed as a RecordBatchReader-compatible
+        # stream of batch_size rows, the connection is closed once the reader is exhausted or closed.
+        sql, datasets = self._render(sql, kwargs)
+        connection = _out_of_core_connection(memory_limit, temp_directory)
+        try:
+            reader = connection.sql(_bind_datasets(sql, datasets)).to_arrow_reader(batch_size)
+        except Exception as e:
+            connection.close()
+            print(f'{e}')
+            raise e
+        return _close_on_exhaust(reader, connection.close)
+    
+    def query_to_s3(self, sql, target=None, partition_by=None, memory_limit=None, temp_directory=None, **kwargs):
+        # Out-of-core query written by duckdb straight to the target S3Dataset (or s3 path, a new
+        # dataset by default) with COPY ... TO, the result never goes through Python.
+        # The new files are written next to the target's current files, which are only deleted once the
+        # COPY succeeds: a failing query leaves the target as it was, and target=self rewrites in place.
+        sql, datasets = self._render(sql, kwargs)
+        target = target if isinstance(target, S3Dataset) else S3Dataset(s3_path=target)
+        partition_by = [partition_by] if isinstance(partition_by, str) else partition_by
+        replaced = {e.path for e in target._files()}
+        
+        start = time.perf_counter()
+        connection = _out_of_core_connection(memory_limit, temp_directory)
+        try:
+            rows = connection.execute(f'''
+                                COPY ({_bind_datasets(sql, datasets)}) TO
+                                {_sql_literal(target._copy_destination())}
+                                ({target._copy_options(partition_by)})
+                                ''').fetchone()[0]
+        except Exception as e:
+            # drop the files of the failed COPY
+            target._delete_files([file_info.path for file_info in target._files() if file_info.path not in replaced])
+            print(f'{e}')
+            raise e
+        finally:
+            connection.close()
+        target._delete_files(replaced)
+        seconds = time.perf_counter() - start
+        print(f'Success: {rows:,} rows transfered to {target.s3_path} in {seconds:.1f}s, {rows / max(seconds, 1e-9):,.0f} rows/s.')
+        return target
+    
+    def _render(self, sql, kwargs):
+        # split kwargs into datasets bound as tables and template variables
+        datasets = [('self', self)] + [(k, v) for k, v in kwargs.items() if isinstance(v, S3Dataset)]
+        variables = {k: v for k, v in kwargs.items() if not isinstance(v, S3Dataset)}
+        return render_string(sql, **variables), datasets
     
     def sql(self, sql, **kwargs):
         df = self.to_polars(lazy=True)
-        sql = Template(sql).render(**kwargs)
+        sql = render_string(sql, **kwargs)
         sql = _parse_self_sql(sql, 'self', 'df')
-        return duckdb.sql(sql)
+        return duckdb_session.cursor().sql(sql)
     
     def delete(self):
         try:
@@ -136,6 +593,23 @@ class S3Dataset():
         except Exception as e:
             raise e
         
+    def read_manifest(self):
+        # small JSON state file stored next to the data, ignored by parquet readers
+        path = f'{self.s3_path[5:]}{MANIFEST_NAME}'
+        if self.s3.get_file_info(path).type != FileType.File:
+            return None
+        with self.s3.open_input_stream(path) as file:
+            return json.loads(file.read())
+        
+    def write_manifest(self, manifest):
+        path = f'{self.s3_path[5:]}{MANIFEST_NAME}'
+        with self.s3.open_output_stream(path) as file:
+            file.write(json.dumps(manifest, indent=2, default=str).encode())
+        
+    def _delete_files(self, paths):
+        with ThreadPoolExecutor(max_workers=16) as executor:
+            list(executor.map(self.s3.delete_file, paths))
+        
     def clear_contents(self):
         try:
             path = self.s3_path[5:]
@@ -0,0 +1,127 @@
+import os
+import pyarrow as pa
+
+DEFAULT_CONF = {
+    'spark.sql.execution.arrow.pyspark.enabled': 'true',
+    'spark.sql.execution.arrow.pyspark.fallback.enabled': 'false',
+    'spark.sql.parquet.mergeSchema': 'false',
+}
+# rows per serialized Arrow chunk when handing a pa.Table to Spark 3
+DEFAULT_CHUNK_ROWS = 256 * 1024
+
+
+def get_session(app_name='arrows', master=None, conf=None):
+    # Local or standalone session (SPARK_MASTER, default local[*]) with Arrow transfers enabled and
+    # s3a reading the AWS credentials from the environment, see auth.load_aws_credentials.
+    # hadoop-aws must be on the classpath, e.g. conf={'spark.jars.packages': 'org.apache.hadoop:hadoop-aws:3.3.4'}
+    from pyspark.sql import SparkSession
+    builder = SparkSession.builder.appName(app_name).master(master or os.getenv('SPARK_MASTER', 'local[*]'))
+    for key, value in {**DEFAULT_CONF, **_s3a_conf(), **(conf or {})}.items():
+        builder = builder.config(key, value)
+    return builder.getOrCreate()
+
+
+def _s3a_conf():
+    if not os.getenv('AWS_ACCESS_KEY_ID'):
+        return {}
+    conf = {
+        'spark.hadoop.fs.s3a.access.key': os.getenv('AWS_ACCESS_KEY_ID'),
+        'spark.hadoop.fs.s3a.secret.key': os.getenv('AWS_SECRET_ACCESS_KEY'),
+    }
+    if os.getenv('AWS_SESSION_TOKEN'):
+        conf['spark.hadoop.fs.s3a.session.token'] = os.getenv('AWS_SESSION_TOKEN')
+        conf['spark.hadoop.fs.s3a.aws.credentials.provider'] = 'org.apache.hadoop.fs.s3a.TemporaryAWSCredentialsProvider'
+    return conf
+
+
+def s3a_path(s3_path):
+    return 's3a://' + s3_path.split('://', 1)[-1]
+
+
+def _spark_major():
+    import pyspark
+    return int(pyspark.__version__.split('.')[0])
+
+
+def to_arrow(df):
+    # Collect a Spark DataFrame to the driver as a pa.Table, batches are sent as Arrow without pandas.
+    # The whole result is held by the driver: write large results with to_s3 instead.
+    if hasattr(df, 'toArrow'):
+        return df.toArrow()
+    from pyspark.sql.pandas.types import to_arrow_schema
+    batches = df._collect_as_arrow()
+    return pa.Table.from_batches(batches, schema=to_arrow_schema(df.schema))
+
+
+def from_arrow(arrow, spark=None, chunk_rows=DEFAULT_CHUNK_ROWS):
+    # Create a Spark DataFrame from a pa.Table without a pandas round trip
+    spark = spark if spark is not None else get_session()
+    if _spark_major() >= 4:
+        return spark.createDataFrame(arrow)
+
+    # Spark 3: ship the table as IPC stream chunks and decode them on the executors with mapInArrow
+    from pyspark.sql.pandas.types import from_arrow_schema
+    chunks = []
+    for batch in arrow.to_batches(max_chunksize=chunk_rows):
+        sink = pa.BufferOutputStream()
+        with pa.ipc.new_stream(sink, arrow.schema) as writer:
+            writer.write_batch(batch)
+        chunks.append((sink.getvalue().to_pybytes(),))
+
+    def decode(batches):
+        for batch in batches:
+            for ipc in batch.column(0).to_pylist():
+                yield from pa.ipc.open_stream(ipc)
+
+    ipc_df = spark.createDataFrame(chunks, 'ipc binary').repartition(max(1, len(chunks)))
+    return ipc_df.mapInArrow(decode, from_arrow_schema(arrow.schema))
+
+
+def map_in_arrow(df, func, schema):
+    # Apply func(pa.RecordBatch) -> pa.RecordBatch | pa.Table to every batch on the executors.
+    # schema is the output schema as a pa.Schema, a Spark StructType or a DDL string.
+    if isinstance(schema, pa.Schema):
+        from pyspark.sql.pandas.types import from_arrow_schema
+        schema = from_arrow_schema(schema)
+
+    def apply(batches):
+        for batch in batches:
+            result = func(batch)
+            if isinstance(result, pa.Table):
+                yield from result.to_batches()
+            else:
+                yield result
+
+    return df.mapInArrow(apply, schema)
+
+
+def read_s3(dataset, spark=None):
+    # Read an S3Dataset (or s3 path) as a Spark DataFrame. The executors read the parquet files directly
+    # from S3, nothing passes through the driver. The file listing is reused instead of having Spark list
+    # the prefix again; basePath keeps hive partition columns (date=.../) as columns. Spark packs the files
+    # into input partitions of at most spark.sql.files.maxPartitionBytes, splitting large files on row
+    # groups. That is a session setting applied when the DataFrame is planned, set it on the session,
+    # e.g. get_session(conf={'spark.sql.files.maxPartitionBytes': str(128 * 1024 ** 2)}).
+    from .s3 import S3Dataset
+    dataset = dataset if isinstance(dataset, S3Dataset) else S3Dataset(s3_path=dataset)
+    spark = spark if spark is not None else get_session()
+
+    files = [s3a_path(e.path) for e in dataset._files() if e.path.endswith('.parquet')]
+    if not files:
+        raise ValueError(f'No parquet files in {dataset.s3_path}')
+    return spark.read.option('basePath', s3a_path(dataset.s3_path)).parquet(*files)
+
+
+def to_s3(df, dataset, mode='overwrite', partition_by=None, max_rows_per_file=None):
+    # Write a Spark DataFrame to an S3Dataset (or s3 path) as parquet, each executor writes its partitions
+    from .s3 import S3Dataset
+    dataset = dataset if isinstance(dataset, S3Dataset) else S3Dataset(s3_path=dataset)
+    partition_by = [partition_by] if isinstance(partition_by, str) else partition_by
+    writer = df.write.mode(mode).option('compression', 'zstd')
+    if max_rows_per_file is None:
+        max_rows_per_file = dataset._rows_per_file(None, None)
+    writer = writer.option('maxRecordsPerFile', max_rows_per_file)
+    if partition_by:
+        writer = writer.partitionBy(*partition_by)
+    writer.parquet(s3a_path(dataset.s3_path))
+    return dataset
@@ -0,0 +1,338 @@
+import os
+import json
+import sqlite3
+import time
+import uuid
+from contextlib import contextmanager
+import pyarrow as pa
+import pyarrow.compute as pc
+from .template_renderer import render_string, render_template
+from .utils import _close_on_exhaust
+
+DEFAULT_BATCH_SIZE = 64 * 1024
+
+# WAL lets readers run while a load is writing, synchronous=NORMAL only syncs at checkpoints
+PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'temp_store': 'MEMORY',
+    'cache_size': -256 * 1024,          # KiB, 256MB page cache
+    'mmap_size': 1024 * 1024 * 1024,
+    'busy_timeout': 30 * 1000,
+}
+
+
+def get_connection(database=None):
+    database = database if database is not None else os.getenv('SQLITE_DATABASE')
+    if database is None:
+        raise ValueError('Pass database or set the SQLITE_DATABASE ENV variable')
+    # transactions are managed explicitly with BEGIN/COMMIT
+    conn = sqlite3.connect(database, isolation_level=None, check_same_thread=False)
+    for name, value in PRAGMAS.items():
+        conn.execute(f'PRAGMA {name} = {value}')
+    return conn
+
+
+def get_adbc_connection(database=None):
+    import adbc_driver_sqlite.dbapi as adbc_sqlite
+    database = database if database is not None else os.getenv('SQLITE_DATABASE')
+    return adbc_sqlite.connect(database)
+
+
+@contextmanager
+def connection(database=None):
+    # database is a path, or an open sqlite3 connection which is left open
+    if isinstance(database, sqlite3.Connection):
+        yield database
+        return
+    conn = get_connection(database)
+    try:
+        yield conn
+    finally:
+        conn.close()
+
+
+def fetch_arrow(sql, database=None, engine='sqlite3', stream=False, batch_size=DEFAULT_BATCH_SIZE, schema=None, **kwargs):
+    if stream or engine == 'adbc' or schema is not None:
+        reader = fetch_batches(sql, database=database, engine=engine, batch_size=batch_size, schema=schema, **kwargs)
+        return reader if stream else reader.read_all()
+    
+    # The whole result is read, so column types are unified across batches instead of being
+    # fixed by the first one: an all-NULL start or a column mixing storage classes is fine here
+    sql = render_string(sql, **kwargs)
+    with connection(database) as conn:
+        try:
+            declared = _declared_types(conn, sql)
+            cursor = conn.execute(sql)
+        except Exception as e:
+            print(f'{e}')
+            raise e
+        try:
+            names = [e[0] for e in cursor.description]
+            declared = declared or [None] * len(names)
+            batches = []
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                batches.append([_infer_array(e, arrow_type) for e, arrow_type in zip(zip(*rows), declared)])
+        finally:
+            cursor.close()
+    return _unify_batches(batches, names, declared)
+
+
+def fetch_batches(sql, database=None, engine='sqlite3', batch_size=DEFAULT_BATCH_SIZE, schema=None, **kwargs):
+    # Return a RecordBatchReader-compatible stream (ClosingRecordBatchReader) of batch_size rows per batch.
+    # SQLite columns are untyped: with the sqlite3 engine each column takes the type given in schema,
+    # else its declared type (table columns), else the type of its values in the first batch, with
+    # all-NULL columns read as text. The adbc engine uses the driver's own type inference.
+    sql = render_string(sql, **kwargs)
+    if engine == 'adbc':
+        conn = get_adbc_connection(database)
+        try:
+            cursor = conn.cursor()
+            cursor.execute(sql)
+            reader = cursor.fetch_record_batch()
+        except Exception as e:
+            conn.close()
+            print(f'{e}')
+            raise e
+        return _close_on_exhaust(reader, cursor.close, conn.close)
+
+    owned = not isinstance(database, sqlite3.Connection)
+    conn = get_connection(database) if owned else database
+    try:
+        declared = None if schema is not None else _declared_types(conn, sql)
+        cursor = conn.execute(sql)
+        names = [e[0] for e in cursor.description]
+        rows = cursor.fetchmany(batch_size)
+        if schema is None:
+            schema = _stream_schema(rows, names, declared or [None] * len(names))
+        first = _rows_to_batch(rows, schema)
+    except Exception as e:
+        if owned:
+            conn.close()
+        print(f'{e}')
+        raise e
+
+    def batches():
+        yield first
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                return
+            yield _rows_to_batch(rows, schema)
+
+    reader = pa.RecordBatchReader.from_batches(schema, batches())
+    return _close_on_exhaust(reader, cursor.close, conn.close if owned else (lambda: None))
+
+
+def _declared_types(conn, sql):
+    # Arrow types of the declared types of the result columns, None where SQLite has no type to go by
+    # (expressions, NUMERIC or untyped columns). Read from a temporary view, or None if sql is not a query.
+    view = f'_arrows_decltypes_{uuid.uuid4().hex}'
+    try:
+        conn.execute(f'CREATE TEMP VIEW "{view}" AS {sql}')
+    except sqlite3.Error:
+        return None
+    try:
+        return [_affinity_type(e[2]) for e in conn.execute(f'PRAGMA table_info("{view}")')]
+    finally:
+        conn.execute(f'DROP VIEW temp."{view}"')
+
+
+def _affinity_type(declared_type):
+    # SQLite's column affinity rules, https://www.sqlite.org/datatype3.html#determination_of_column_affinity
+    declared_type = declared_type.upper()
+    if 'INT' in declared_type:
+        return pa.int64()
+    elif any(e in declared_type for e in ('CHAR', 'CLOB', 'TEXT')):
+        return pa.string()
+    elif 'BLOB' in declared_type:
+        return pa.binary()
+    elif any(e in declared_type for e in ('REAL', 'FLOA', 'DOUB')):
+        return pa.float64()
+    return None
+
+
+def _stream_schema(rows, names, declared):
+    columns = list(zip(*rows)) if rows else [() for _ in names]
+    fields = []
+    for name, values, arrow_type in zip(names, columns, declared):
+        if arrow_type is None:
+            arrow_type = _infer_array(values).type
+            arrow_type = pa.string() if pa.types.is_null(arrow_type) else arrow_type
+        fields.append(pa.field(name, arrow_type))
+    return pa.schema(fields)
+
+
+def _rows_to_batch(rows, schema):
+    columns = list(zip(*rows)) if rows else [() for _ in schema]
+    return pa.RecordBatch.from_arrays([_to_array(e, field) for e, field in zip(columns, schema)], schema=schema)
+
+
+def _to_array(values, field):
+    try:
+        return pa.array(values, type=field.type)
+    except (pa.ArrowInvalid, pa.ArrowTypeError, OverflowError) as e:
+        if pa.types.is_string(field.type):
+            return pa.array([_text(value) for value in values], pa.string())
+        raise ValueError(f'Column "{field.name}" holds values that are not {field.type}, '
+                         f'pass schema with a wider type (e.g. pa.string()) or read it with stream=False') from e
+
+
+def _infer_array(values, declared_type=None):
+    if declared_type is not None:
+        try:
+            return pa.array(values, type=declared_type)
+        except (pa.ArrowInvalid, pa.ArrowTypeError, OverflowError):
+            pass
+    try:
+        return pa.array(values)
+    except (pa.ArrowInvalid, pa.ArrowTypeError, OverflowError):
+        # a column holding several storage classes, e.g. INTEGER and TEXT values, is read as text
+        return pa.array([_text(e) for e in values], pa.string())
+
+
+def _text(value):
+    if value is None:
+        return None
+    elif isinstance(value, bytes):
+        return value.decode('utf-8', errors='replace')
+    return str(value)
+
+
+def _unify_batches(batches, names, declared):
+    # per column: the one type of its batches, int64 and float64 promote to float64, other mixes to text
+    fields = []
+    for i, name in enumerate(names):
+        types = {batch[i].type for batch in batches} - {pa.null()}
+        if not types:
+            arrow_type = declared[i] or pa.null()
+        elif len(types) == 1:
+            arrow_type = types.pop()
+        elif types <= {pa.int64(), pa.float64()}:
+            arrow_type = pa.float64()
+        else:
+            arrow_type = pa.string()
+        fields.append(pa.field(name, arrow_type))
+    schema = pa.schema(fields)
+    
+    def cast(array, arrow_type):
+        if array.type == arrow_type:
+            return array
+        if pa.types.is_string(arrow_type) and not pa.types.is_null(array.type):
+            return pa.array([_text(e) for e in array.to_pylist()], pa.string())
+        return array.cast(arrow_type)
+    
+    record_batches = [pa.RecordBatch.from_arrays([cast(e, field.type) for e, field in zip(batch, schema)], schema=schema)
+                      for batch in batches]
+    return pa.Table.from_batches(record_batches, schema=schema)
+
+
+def fetch_dataframe(sql, database=None, engine='sqlite3', **kwargs):
+    df = fetch_arrow(sql, database=database, engine=engine, **kwargs).to_pandas()
+    return df
+
+
+def arrow_to_sqlite(arrow, table_name, mode='append', database=None, batch_size=DEFAULT_BATCH_SIZE):
+    # Bulk insert arrow (a pa.Table or RecordBatchReader) with executemany in a single transaction.
+    # mode='overwrite' drops and recreates the table in the same transaction.
+    if mode not in ('append', 'overwrite'):
+        raise ValueError(f'mode must be "append" or "overwrite", got "{mode}"')
+    table_name = _quote_table_name(table_name)
+    columns = ', '.join(f'{_quote(e.name)} {_sqlite_type(e.type)}' for e in arrow.schema)
+    placeholders = ', '.join('?' for _ in arrow.schema)
+    batches = arrow.to_batches(max_chunksize=batch_size) if isinstance(arrow, pa.Table) else arrow
+
+    start = time.perf_counter()
+    rows = 0
+    with connection(database) as conn:
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            if mode == 'overwrite':
+                conn.execute(f'DROP TABLE IF EXISTS {table_name}')
+            conn.execute(f'CREATE TABLE IF NOT EXISTS {table_name} ({columns})')
+            insert = f'INSERT INTO {table_name} ({", ".join(_quote(e) for e in arrow.schema.names)}) VALUES ({placeholders})'
+            for batch in batches:
+                for offset in range(0, batch.num_rows, batch_size):
+                    chunk = batch.slice(offset, batch_size)
+                    conn.executemany(insert, zip(*(_to_python(e) for e in chunk.columns)))
+                    rows += chunk.num_rows
+            conn.execute('COMMIT')
+        except Exception as e:
+            conn.execute('ROLLBACK')
+            print(f'{e}')
+            raise e
+    seconds = time.perf_counter() - start
+    print(f'Success: {rows:,} rows transfered to SQLite in {seconds:.1f}s, {rows / max(seconds, 1e-9):,.0f} rows/s.')
+
+
+def execute_sql(sql, database=None, **kwargs):
+    # sql may hold several statements, they run in one transaction
+    with connection(database) as conn:
+        try:
+            print(f'Running SQL...')
+            print(sql)
+            conn.execute('BEGIN')
+            for statement in _split_statements(render_string(sql, **kwargs)):
+                conn.execute(statement)
+            conn.execute('COMMIT')
+            print('SUCCESS: SQL executed.')
+        except Exception as e:
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            raise e
+
+
+def execute_sql_file(sql_script_path, database=None, **kwargs):
+    sql = render_template(sql_script_path, **kwargs)
+    execute_sql(sql, database=database)
+
+
+def _split_statements(sql):
+    # split on the semicolons that end a statement, not those inside literals or triggers
+    statements = []
+    start = 0
+    for position, char in enumerate(sql):
+        if char == ';' and sqlite3.complete_statement(sql[start:position + 1]):
+            statements.append(sql[start:position + 1].strip())
+            start = position + 1
+    if sql[start:].strip():
+        statements.append(sql[start:].strip())
+    return statements
+
+
+def _quote(name):
+    return '"' + name.replace('"', '""') + '"'
+
+
+def _quote_table_name(table_name):
+    # schema.table addresses a table of an attached database
+    return '.'.join(_quote(e) for e in table_name.split('.'))
+
+
+def _sqlite_type(arrow_type):
+    if pa.types.is_integer(arrow_type) or pa.types.is_boolean(arrow_type):
+        return 'INTEGER'
+    elif pa.types.is_floating(arrow_type):
+        return 'REAL'
+    elif pa.types.is_decimal(arrow_type):
+        return 'NUMERIC'
+    elif pa.types.is_binary(arrow_type) or pa.types.is_large_binary(arrow_type) or pa.types.is_fixed_size_binary(arrow_type):
+        return 'BLOB'
+    return 'TEXT'
+
+
+def _to_python(array):
+    # sqlite3 binds int, float, str, bytes and None: temporal and decimal values are stored
+    # as their text form, nested values as JSON
+    arrow_type = array.type
+    if pa.types.is_dictionary(arrow_type):
+        array = array.cast(arrow_type.value_type)
+        arrow_type = array.type
+    if pa.types.is_temporal(arrow_type) or pa.types.is_decimal(arrow_type):
+        array = pc.cast(array, pa.string())
+    elif pa.types.is_nested(arrow_type):
+        return [None if e is None else json.dumps(e, default=str) for e in array.to_pylist()]
+    return array.to_pylist()
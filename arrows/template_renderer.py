@@ -1,5 +1,15 @@
-from jinja2 import Template, Environment, FileSystemLoader
+from jinja2 import Environment, FileSystemLoader, FileSystemBytecodeCache
+from functools import lru_cache
 from pathlib import Path
+import threading
+
+BYTECODE_CACHE_DIR = Path.home()/'.cache/arrows/jinja'
+
+# scripts folder -> Environment, shared so compiled templates survive across calls
+_environments = {}
+_environments_lock = threading.Lock()
+_bytecode_cache = None
+_string_environment = Environment()
 
 
 class TemplateRenderer():
@@ -8,12 +18,43 @@ class TemplateRenderer():
         self.scripts_folder = Path(self.scripts_folder_path)
 
     def render_template(self, filename, **kwargs):
-        env = Environment(loader=FileSystemLoader(self.scripts_folder))
-        template = env.get_template(filename)
+        template = get_environment(self.scripts_folder).get_template(filename)
         return template.render(**kwargs)
-    
-    
+
+
 def render_template(file_path, **kwargs):
-    with open(file_path) as file:
-        content = Template(file.read()).render(**kwargs)
-    return content
\ No newline at end of file
+    file_path = Path(file_path)
+    template = get_environment(file_path.parent).get_template(file_path.name)
+    return template.render(**kwargs)
+
+
+def render_string(source, **kwargs):
+    # Drop-in for Template(source).render(**kwargs) that compiles each distinct source once
+    return _compile_string(source).render(**kwargs)
+
+
+@lru_cache(maxsize=1024)
+def _compile_string(source):
+    return _string_environment.from_string(source)
+
+
+def get_environment(scripts_folder):
+    # Templates are cached in memory and reloaded when the file mtime changes,
+    # compiled bytecode is also kept on disk for the next process
+    scripts_folder = Path(scripts_folder).resolve()
+    with _environments_lock:
+        environment = _environments.get(scripts_folder)
+        if environment is None:
+            environment = Environment(loader=FileSystemLoader(scripts_folder),
+                                      bytecode_cache=_get_bytecode_cache(),
+                                      auto_reload=True)
+            _environments[scripts_folder] = environment
+    return environment
+
+
+def _get_bytecode_cache():
+    global _bytecode_cache
+    if _bytecode_cache is None:
+        BYTECODE_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        _bytecode_cache = FileSystemBytecodeCache(str(BYTECODE_CACHE_DIR))
+    return _bytecode_cache
@@ -1,42 +1,260 @@
+import datetime
+import decimal
+import functools
+import os
 import re
+import weakref
+import pyarrow as pa
+
+
+def _close_on_exhaust(reader, *callbacks):
+    # Wrap a RecordBatchReader so callbacks run once it is exhausted, closed or released.
+    return ClosingRecordBatchReader(reader, callbacks)
+
+
+class ClosingRecordBatchReader():
+    # A RecordBatchReader-compatible stream that releases what the query holds (cursor, pooled connection,
+    # temporary files) exactly once: when it is exhausted, closed, leaves a with block or is garbage collected.
+    # It is not a pa.RecordBatchReader subclass, since closing one of those does not release its source,
+    # Arrow consumers take it through __arrow_c_stream__ and pa.RecordBatchReader.from_stream(reader) gives
+    # a real reader.
+    def __init__(self, reader, callbacks=()):
+        self._reader = reader
+        self._finalizer = weakref.finalize(self, _run_callbacks, reader, tuple(callbacks), False)
+        
+    def __repr__(self):
+        return f'ClosingRecordBatchReader: {self.schema}'
+    
+    @property
+    def schema(self):
+        return self._reader.schema
+    
+    @property
+    def closed(self):
+        return not self._finalizer.alive
+    
+    def read_next_batch(self):
+        if self.closed:
+            raise ValueError('reader is closed')
+        try:
+            return self._reader.read_next_batch()
+        except StopIteration:
+            self.close()
+            raise
+        
+    def __iter__(self):
+        while True:
+            try:
+                yield self.read_next_batch()
+            except StopIteration:
+                return
+            
+    def read_all(self):
+        try:
+            return pa.Table.from_batches(list(self), schema=self.schema)
+        finally:
+            self.close()
+            
+    def read_pandas(self, **options):
+        return self.read_all().to_pandas(**options)
+    
+    def __arrow_c_stream__(self, requested_schema=None):
+        # hand the stream to another Arrow consumer (duckdb, polars, pyarrow.dataset), batches are
+        # still read through this reader so the callbacks run when the consumer finishes
+        return pa.RecordBatchReader.from_batches(self.schema, iter(self)).__arrow_c_stream__(requested_schema)
+    
+    def close(self):
+        detached = self._finalizer.detach()
+        if detached is not None:
+            _, _, (reader, callbacks, _), _ = detached
+            _run_callbacks(reader, callbacks, True)
+            
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def _run_callbacks(reader, callbacks, raise_errors):
+    # every callback runs even if an earlier one fails. Errors are printed; an explicit close
+    # raises the first one, garbage collection cannot so it only prints them.
+    errors = []
+    for callback in (reader.close, *callbacks):
+        try:
+            callback()
+        except Exception as e:
+            print(f'Error releasing reader resources: {e!r}')
+            errors.append(e)
+    if errors and raise_errors:
+        raise errors[0]
+
+
+def _evict_lru(cache_dir, max_bytes, keep=()):
+    # Delete the least recently used files under cache_dir until it fits in max_bytes.
+    # Recency is the file mtime, which cache hits refresh with os.utime.
+    keep = {str(e) for e in keep}
+    files = []
+    for root, _, names in os.walk(cache_dir):
+        for name in names:
+            if name.endswith('.tmp'):
+                continue
+            path = os.path.join(root, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+    total = sum(e[1] for e in files)
+    for _, size, path in sorted(files):
+        if total <= max_bytes:
+            break
+        if path in keep:
+            continue
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+
+
+def _sql_literal(value):
+    if value is None:
+        return 'NULL'
+    elif isinstance(value, bool):
+        return 'TRUE' if value else 'FALSE'
+    elif isinstance(value, (int, float)):
+        return repr(value)
+    elif isinstance(value, decimal.Decimal):
+        return str(value)
+    elif isinstance(value, datetime.datetime):
+        return f"{'TIMESTAMPTZ' if value.tzinfo else 'TIMESTAMP'} '{value.isoformat(sep=' ')}'"
+    elif isinstance(value, datetime.date):
+        return f"DATE '{value.isoformat()}'"
+    return "'" + str(value).replace("'", "''") + "'"
+
 
 def _parse_self_sql(sql, old_table, new_table):
-    # Step 1: Replace table definitions in FROM and JOIN clauses
-    pattern_def = re.compile(
-        r'\b(FROM|JOIN)(\s+)((?:\w+\.)?\w+(?:\s+(?:AS\s+)?\w+)?(?:\s*,\s*(?:\w+\.)?\w+(?:\s+(?:AS\s+)?\w+)?)*)',
-        re.IGNORECASE | re.MULTILINE
-    )
+    return _rename_tables(sql, ((old_table, new_table),))
+
+
+_WORD = re.compile(r'"(?:[^"]|"")*"|\w+')
+# unreserved keywords (data, source, target, year, ...) are valid table names, duckdb tokenizes them as keywords
+_NAME_TOKENS = ('identifier', 'keyword')
+# keywords followed by a table, and keywords ending a FROM list
+_TABLE_KEYWORDS = {'from', 'join', 'describe', 'summarize', 'pivot', 'unpivot'}
+_CLAUSE_KEYWORDS = {'select', 'where', 'group', 'having', 'qualify', 'window', 'order', 'limit', 'offset',
+                    'union', 'except', 'intersect', 'values', 'set', 'returning', 'sample'}
 
-    def replace_definition(match):
-        keyword = match.group(1)
-        whitespace = match.group(2)
-        tables_segment = match.group(3)
 
-        tables = [t.strip() for t in re.split(r'\s*,\s*', tables_segment, flags=re.MULTILINE)]
-        new_tables = []
+def _tokens(sql):
+    # (start, end, type, value) of each duckdb token, comments are skipped by the tokenizer.
+    # value is the lowercased name of identifiers and keywords, and the first character of operators.
+    import duckdb
+    tokens = []
+    for start, token_type in duckdb.tokenize(sql):
+        token_type = token_type.name
+        end = start + 1
+        value = sql[start]
+        if token_type in ('identifier', 'keyword'):
+            match = _WORD.match(sql, start)
+            if match:
+                end = match.end()
+                value = match.group()
+                # duckdb identifiers are case insensitive, quoted or not
+                value = value[1:-1].replace('""', '"') if value.startswith('"') else value
+                value = value.lower()
+        tokens.append((start, end, token_type, value))
+    return tokens
 
-        for t in tables:
-            parts = t.split()
-            table_name_part = parts[0]
-            alias_part = ' '.join(parts[1:]) if len(parts) > 1 else ''
 
-            if '.' in table_name_part:
-                schema, name = table_name_part.split('.', 1)
-            else:
-                schema, name = '', table_name_part
+def _cte_names(tokens):
+    # names defined by "name AS (" or "name(a, b) AS ("
+    values = [e[3] for e in tokens]
+    names = set()
+    for i, (_, _, token_type, value) in enumerate(tokens):
+        if token_type not in _NAME_TOKENS:
+            continue
+        j = i + 1
+        if values[j:j + 1] == ['(']:
+            depth = 0
+            for j in range(i + 1, len(tokens)):
+                depth += values[j] == '('
+                depth -= values[j] == ')'
+                if depth == 0:
+                    break
+            j += 1
+        if values[j:j + 1] == ['as'] and tokens[j][2] == 'keyword' and (values[j + 1:j + 2] == ['('] or values[j + 1:j + 3] == ['materialized', '(']):
+            names.add(value)
+    return names
 
-            if name.lower() == old_table.lower():
-                table_name_part = f"{schema + '.' if schema else ''}{new_table}"
 
-            new_tables.append(f"{table_name_part} {alias_part}".rstrip())
+def _table_positions(tokens):
+    # indices of the tokens in table position: right after FROM/JOIN, or after a comma of a FROM list.
+    # The clause is tracked per parenthesis depth, so subqueries and IN (a, b) lists are told apart.
+    positions = set()
+    clauses = [None]
+    for i, (_, _, token_type, value) in enumerate(tokens):
+        previous = tokens[i - 1] if i > 0 else None
+        if previous is not None and ((previous[2] == 'keyword' and previous[3] in _TABLE_KEYWORDS) or
+                                     (previous[3] == ',' and clauses[-1] == 'from')):
+            positions.add(i)
+        if token_type == 'operator' and value == '(':
+            clauses.append(None)
+        elif token_type == 'operator' and value == ')':
+            if len(clauses) > 1:
+                clauses.pop()
+        elif token_type == 'keyword' and value in _TABLE_KEYWORDS:
+            clauses[-1] = 'from'
+        elif token_type == 'keyword' and value in _CLAUSE_KEYWORDS:
+            clauses[-1] = None
+    return positions
 
-        return f"{keyword}{whitespace}" + (', '.join(new_tables))
 
-    sql = pattern_def.sub(replace_definition, sql)
+@functools.lru_cache(maxsize=1024)
+def _rename_tables(sql, renames):
+    # Rename table references in sql, renames is a tuple of (old_name, new_name) pairs.
+    # Works on duckdb tokens, so string literals, comments, quoted identifiers and subqueries are
+    # handled. Only names in table position (FROM self, JOIN self, FROM a, self) and column qualifiers
+    # (self.id) are renamed, a column with the same name (SELECT self FROM t) is left alone.
+    # A CTE defining one of the names shadows it.
+    tokens = _tokens(sql)
+    renames = {old.lower(): new for old, new in renames}
+    for name in _cte_names(tokens):
+        renames.pop(name, None)
+    positions = _table_positions(tokens)
+    
+    parts = []
+    position = 0
+    for i, (start, end, token_type, value) in enumerate(tokens):
+        if token_type not in _NAME_TOKENS or value not in renames:
+            continue
+        # skip columns of other tables (t.self) and function calls (self(...))
+        if (i > 0 and tokens[i - 1][3] == '.') or (i + 1 < len(tokens) and tokens[i + 1][3] == '('):
+            continue
+        qualifier = i + 1 < len(tokens) and tokens[i + 1][3] == '.'
+        # in table position a qualifier is a schema (self.events), elsewhere a table (self.id)
+        if (i in positions) == qualifier:
+            continue
+        parts += [sql[position:start], renames[value]]
+        position = end
+    parts.append(sql[position:])
+    return ''.join(parts)
 
-    # Step 2: Replace all table references (self.n, self.*, etc.)
-    # Only replace whole words followed by a dot
-    pattern_ref = re.compile(rf'\b{re.escape(old_table)}\b(?=\.)', re.IGNORECASE)
-    sql = pattern_ref.sub(new_table, sql)
 
-    return sql
\ No newline at end of file
+@functools.lru_cache(maxsize=1024)
+def _bind_tables(sql, tables):
+    # Bind named inputs to table expressions. tables is a tuple of (name, table_expression) pairs,
+    # e.g. (('self', "read_parquet('s3://...')"),). Each input becomes a CTE in front of sql,
+    # merged into the WITH clause of sql when it already has one.
+    aliases = tuple((name, f'_arrows_{name}') for name, _ in tables)
+    sql = _rename_tables(sql, aliases).strip()
+    bindings = ', '.join(f'{alias} AS (SELECT * FROM {expression})' for (_, alias), (_, expression) in zip(aliases, tables))
+    
+    tokens = _tokens(sql)
+    values = [e[3] for e in tokens]
+    if values[:1] == ['with']:
+        recursive = values[1:2] == ['recursive']
+        body = sql[tokens[2 if recursive else 1][0]:] if len(tokens) > 1 else ''
+        return f"WITH {'RECURSIVE ' if recursive else ''}{bindings},\n{body}"
+    return f'WITH {bindings}\n{sql}'
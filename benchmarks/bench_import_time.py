@@ -0,0 +1,77 @@
+"""Import time of the arrows package and each submodule, checked against budgets.
+
+    python benchmarks/bench_import_time.py
+    python benchmarks/bench_import_time.py --repeat 5 --scale 2
+
+Each module is imported in a fresh interpreter under `python -X importtime`. The best
+cumulative time of --repeat runs is compared to its budget (scaled by --scale for slow
+machines), along with the heavy dependencies the import pulled in. Exits 1 when a module is
+over budget, or when `import arrows` loads any heavy dependency.
+"""
+import argparse
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+
+# cumulative import time budgets in milliseconds, with headroom over a warm page cache
+BUDGETS_MS = {
+    'arrows': 20,
+    'arrows.auth': 50,
+    'arrows.pool': 20,
+    'arrows.duckdb_session': 20,
+    'arrows.utils': 150,
+    'arrows.template_renderer': 100,
+    'arrows.spark': 150,
+    'arrows.redis': 150,
+    'arrows.gmail': 150,
+    'arrows.google_sheets': 300,
+    'arrows.mysql': 300,
+    'arrows.sqlite': 300,
+    'arrows.redshift': 400,
+    'arrows.s3': 400,
+}
+HEAVY = ['boto3', 'awswrangler', 'pandas', 'polars', 'duckdb', 'googleapiclient', 'adbc_driver_postgresql',
+         'psycopg2', 'pyspark', 'redis', 'pymysql', 'jinja2', 'pyarrow']
+
+
+def import_time(module):
+    # cumulative microseconds of module and the heavy dependencies it loaded, in a fresh interpreter
+    code = f'import sys, {module}; print(",".join(k for k in {HEAVY!r} if k in sys.modules))'
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], cwd=ROOT, env={**os.environ, 'PYTHONPATH': str(ROOT)},
+                            capture_output=True, text=True, check=True)
+    for line in result.stderr.splitlines():
+        fields = [e.strip() for e in line.split('|')]
+        if len(fields) == 3 and fields[2] == module:
+            cumulative = int(fields[1])
+    loaded = [e for e in result.stdout.strip().split(',') if e]
+    return cumulative, loaded
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--scale', type=float, default=1.0, help='multiply every budget')
+    args = parser.parse_args()
+
+    failures = []
+    print(f'{"module":<26} {"ms":>7} {"budget":>7}  heavy dependencies loaded')
+    for module, budget in BUDGETS_MS.items():
+        runs = [import_time(module) for _ in range(args.repeat)]
+        milliseconds = min(e[0] for e in runs) / 1000
+        loaded = runs[0][1]
+        budget *= args.scale
+        over = milliseconds > budget or (module == 'arrows' and loaded)
+        if over:
+            failures.append(module)
+        print(f'{module:<26} {milliseconds:>7.1f} {budget:>7.0f}  {", ".join(loaded) or "-"}{"  OVER" if over else ""}')
+
+    if failures:
+        print(f'\nOver budget: {", ".join(failures)}')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+"""S3Dataset read/write throughput against a local S3 stand-in.
+
+Starts a moto server by default, or targets any S3 API such as MinIO:
+
+    python benchmarks/bench_s3_throughput.py --size-mb 512
+    python benchmarks/bench_s3_throughput.py --endpoint http://127.0.0.1:9000 --bucket bench
+
+Each write layout (target_file_size) is written once, then read back with each
+read configuration (IO threads x fragment_readahead). Throughput is reported in
+MB/s of Arrow data. A local stand-in measures the client side, how far the
+library keeps requests in flight, not the network.
+"""
+import argparse
+import os
+import sys
+import time
+from pathlib import Path
+
+import pyarrow as pa
+import pyarrow.compute as pc
+from pyarrow.fs import S3FileSystem
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from arrows import s3  # noqa: E402
+
+
+def make_table(size_mb):
+    rows = size_mb * 1024 * 1024 // 32
+    ids = pc.subtract(pc.cumulative_sum(pa.repeat(pa.scalar(1, pa.int64()), rows)), 1)
+    return pa.table({
+        'id': ids,
+        'user_id': pc.divide(ids, 7),
+        'amount': pc.multiply(pc.cast(ids, pa.float64()), 0.5),
+        'bucket': pc.cast(pc.bit_wise_and(ids, 1023), pa.int64()),
+    })
+
+
+def start_moto():
+    from moto.server import ThreadedMotoServer
+    server = ThreadedMotoServer(ip_address='127.0.0.1', port=0)
+    server.start()
+    host, port = server.get_host_and_port()
+    return server, f'http://{host}:{port}'
+
+
+def timed(function):
+    start = time.perf_counter()
+    result = function()
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--endpoint', help='S3 endpoint, a moto server is started when omitted')
+    parser.add_argument('--bucket', default='arrows-bench')
+    parser.add_argument('--size-mb', type=int, default=256)
+    parser.add_argument('--file-sizes-mb', default='1,16,128', help='target_file_size values to write')
+    parser.add_argument('--io-threads', default='8,64')
+    parser.add_argument('--readahead', default='1,8,16', help='fragment_readahead values to read with')
+    args = parser.parse_args()
+
+    server = None
+    if args.endpoint is None:
+        server, args.endpoint = start_moto()
+    os.environ.setdefault('AWS_ACCESS_KEY_ID', 'bench')
+    os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'bench')
+    os.environ.setdefault('AWS_REGION', 'us-east-1')
+    os.environ['AWS_ENDPOINT_URL'] = args.endpoint
+    os.environ['AWS_ALLOW_HTTP'] = 'true'
+
+    arrow = make_table(args.size_mb)
+    megabytes = arrow.nbytes / 1024 ** 2
+    dataset = s3.S3Dataset(s3_path=f's3://{args.bucket}/throughput/', cache=False)
+    S3FileSystem(endpoint_override=args.endpoint, allow_bucket_creation=True).create_dir(args.bucket)
+    print(f'{megabytes:,.0f} MB, {arrow.num_rows:,} rows against {args.endpoint}\n')
+    print(f'{"file MB":>8} {"files":>6} {"io threads":>10} {"readahead":>9} {"write MB/s":>10} {"read MB/s":>10}')
+
+    try:
+        for file_size in (int(e) for e in args.file_sizes_mb.split(',')):
+            dataset.target_file_size = file_size * 1024 * 1024
+            dataset.row_group_size = min(s3.DEFAULT_ROW_GROUP_SIZE, dataset._rows_per_file(arrow.nbytes, arrow.num_rows))
+            _, write_seconds = timed(lambda: dataset.from_arrow(arrow))
+            files = len(dataset._files())
+            for io_threads in (int(e) for e in args.io_threads.split(',')):
+                s3.set_io_threads(io_threads)
+                for readahead in (int(e) for e in args.readahead.split(',')):
+                    dataset.fragment_readahead = readahead
+                    result, read_seconds = timed(dataset.to_arrow)
+                    assert result.num_rows == arrow.num_rows
+                    print(f'{file_size:>8} {files:>6} {io_threads:>10} {readahead:>9} '
+                          f'{megabytes / write_seconds:>10,.0f} {megabytes / read_seconds:>10,.0f}')
+    finally:
+        dataset.delete()
+        if server is not None:
+            server.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+"""Cost of rewriting `self` and other named inputs in S3Dataset.query / Sheet.to_duckdb SQL.
+
+    python benchmarks/bench_sql_rewrite.py
+    python benchmarks/bench_sql_rewrite.py --number 2000
+
+Times utils._rename_tables and utils._bind_tables uncached (a new SQL text every call, the
+tokenizer runs) and cached (the same text again, an LRU hit) on a short query, a query with
+CTEs and subqueries, and a ~300 line generated query.
+"""
+import argparse
+import sys
+import timeit
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from arrows import utils  # noqa: E402
+
+QUERIES = {
+    'short': 'select user_id, sum(amount) from self group by 1',
+    'ctes': """
+        with recent as (select * from self where ts > now() - interval 7 day),
+        totals as (select user_id, sum(amount) as amount from recent group by 1)
+        select t.*, o.name, 'from self' as note
+        from totals t join other o using (user_id)
+        where t.user_id in (select user_id from self where amount > 0) -- from self
+    """,
+    'long': '\nunion all\n'.join(f"select {i} as n, self.id, 'self {i}' from self join other using (id) where id % 100 = {i}"
+                                 for i in range(100)),
+}
+RENAMES = (('self', 'df'), ('other', 'df_other'))
+TABLES = (('self', "read_parquet('s3://bucket/a/**/*.parquet')"), ('other', "read_parquet('s3://bucket/b/**/*.parquet')"))
+
+
+def per_call(function, number):
+    return min(timeit.repeat(function, number=number, repeat=5)) / number * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--number', type=int, default=500)
+    args = parser.parse_args()
+
+    print(f'{"query":<8} {"chars":>6} {"rename us":>10} {"cached us":>10} {"bind us":>10} {"cached us":>10}')
+    for name, sql in QUERIES.items():
+        rename = utils._rename_tables.__wrapped__
+        # uncached: the unwrapped functions, _bind_tables still goes through the cached _rename_tables,
+        # so that cache is cleared on every call
+        def bind_uncached():
+            utils._rename_tables.cache_clear()
+            utils._bind_tables.__wrapped__(sql, TABLES)
+        utils._rename_tables(sql, RENAMES)
+        utils._bind_tables(sql, TABLES)
+        print(f'{name:<8} {len(sql):>6} '
+              f'{per_call(lambda: rename(sql, RENAMES), args.number):>10.1f} '
+              f'{per_call(lambda: utils._rename_tables(sql, RENAMES), args.number):>10.2f} '
+              f'{per_call(bind_uncached, args.number):>10.1f} '
+              f'{per_call(lambda: utils._bind_tables(sql, TABLES), args.number):>10.2f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+"""SQLite bulk load throughput, arrow_to_sqlite against row-by-row inserts.
+
+    python benchmarks/bench_sqlite_load.py
+    python benchmarks/bench_sqlite_load.py --rows 5000000 --baseline-rows 20000
+
+Loads a generated table into a fresh database file for each case:
+- row-by-row: one INSERT and commit per row on a default sqlite3 connection
+- row-by-row, one transaction: one INSERT per row inside a single transaction
+- arrow_to_sqlite: batched executemany in one transaction, WAL and pragma tuning
+The row-by-row cases are timed on --baseline-rows rows, rates are in rows/s. The loaded
+table is then read back with fetch_arrow and fetch_batches.
+"""
+import argparse
+import contextlib
+import io
+import sqlite3
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import pyarrow as pa
+import pyarrow.compute as pc
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from arrows import sqlite  # noqa: E402
+
+
+def make_table(rows):
+    ids = pc.subtract(pc.cumulative_sum(pa.repeat(pa.scalar(1, pa.int64()), rows)), 1)
+    return pa.table({
+        'id': ids,
+        'user_id': pc.divide(ids, 7),
+        'amount': pc.multiply(pc.cast(ids, pa.float64()), 0.5),
+        'name': pc.binary_join_element_wise('user-', pc.cast(pc.bit_wise_and(ids, 1023), pa.string()), ''),
+    })
+
+
+def row_by_row(arrow, database, one_transaction):
+    conn = sqlite3.connect(database, isolation_level=None)
+    conn.execute('CREATE TABLE events (id INTEGER, user_id INTEGER, amount REAL, name TEXT)')
+    if one_transaction:
+        conn.execute('BEGIN')
+    for row in arrow.to_pylist():
+        conn.execute('INSERT INTO events VALUES (?, ?, ?, ?)', (row['id'], row['user_id'], row['amount'], row['name']))
+    if one_transaction:
+        conn.execute('COMMIT')
+    conn.close()
+
+
+def timed(function):
+    start = time.perf_counter()
+    # the library functions print a summary line per call
+    with contextlib.redirect_stdout(io.StringIO()):
+        result = function()
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--baseline-rows', type=int, default=5_000)
+    args = parser.parse_args()
+
+    arrow = make_table(args.rows)
+    baseline = arrow.slice(0, args.baseline_rows)
+    with tempfile.TemporaryDirectory() as folder:
+        folder = Path(folder)
+        cases = [
+            ('row-by-row', baseline, lambda: row_by_row(baseline, str(folder/'a.db'), False)),
+            ('row-by-row, one transaction', baseline, lambda: row_by_row(baseline, str(folder/'b.db'), True)),
+            ('arrow_to_sqlite', arrow, lambda: sqlite.arrow_to_sqlite(arrow, 'events', database=str(folder/'c.db'))),
+        ]
+        print(f'{"case":<30} {"rows":>10} {"seconds":>8} {"rows/s":>12}')
+        rates = {}
+        for name, table, function in cases:
+            _, seconds = timed(function)
+            rates[name] = table.num_rows / seconds
+            print(f'{name:<30} {table.num_rows:>10,} {seconds:>8.2f} {rates[name]:>12,.0f}')
+        print(f'\narrow_to_sqlite is {rates["arrow_to_sqlite"] / rates["row-by-row"]:,.0f}x row-by-row, '
+              f'{rates["arrow_to_sqlite"] / rates["row-by-row, one transaction"]:,.1f}x row-by-row in one transaction\n')
+
+        database = str(folder/'c.db')
+        result, seconds = timed(lambda: sqlite.fetch_arrow('select * from events', database=database))
+        assert result.num_rows == arrow.num_rows
+        print(f'{"fetch_arrow":<30} {result.num_rows:>10,} {seconds:>8.2f} {result.num_rows / seconds:>12,.0f}')
+
+        def stream():
+            with sqlite.fetch_batches('select * from events', database=database) as reader:
+                return sum(batch.num_rows for batch in reader)
+        rows, seconds = timed(stream)
+        print(f'{"fetch_batches":<30} {rows:>10,} {seconds:>8.2f} {rows / seconds:>12,.0f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+"""Jinja render cost per call, before and after the shared template environments.
+
+    python benchmarks/bench_template_render.py
+    python benchmarks/bench_template_render.py --number 500
+
+before: a new Environment / Template(source) per call, as TemplateRenderer.render_template and
+the SQL helpers used to do. after: template_renderer.render_template (shared FileSystemLoader
+environment, mtime auto-reload, bytecode cache) and render_string (LRU of compiled sources).
+The SQL file is a generated ~50 line query with loops and conditionals.
+"""
+import argparse
+import sys
+import tempfile
+import timeit
+from pathlib import Path
+
+from jinja2 import Environment, FileSystemLoader, Template
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from arrows import template_renderer  # noqa: E402
+
+SQL = '\n'.join([
+    'select',
+    '{% for column in columns %}    {{ column }}{{ "," if not loop.last }}\n{% endfor %}',
+    'from {{ table }}',
+    "where ts >= '{{ start }}'",
+    '{% if user_ids %}and user_id in ({{ user_ids | join(", ") }}){% endif %}',
+] + [f"union all select {i} as n{{% if debug %}}, 'part {i}'{{% endif %}} from {{{{ table }}}} where id % 100 = {i}" for i in range(50)])
+PARAMS = {'columns': [f'c{i}' for i in range(20)], 'table': 'events', 'start': '2024-01-01', 'user_ids': [1, 2, 3], 'debug': True}
+
+
+def per_call(function, number):
+    return min(timeit.repeat(function, number=number, repeat=3)) / number * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--number', type=int, default=50)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as folder:
+        path = Path(folder)/'query.sql'
+        path.write_text(SQL)
+        cases = {
+            'file before': lambda: Environment(loader=FileSystemLoader(folder)).get_template('query.sql').render(**PARAMS),
+            'file after': lambda: template_renderer.render_template(path, **PARAMS),
+            'string before': lambda: Template(SQL).render(**PARAMS),
+            'string after': lambda: template_renderer.render_string(SQL, **PARAMS),
+        }
+        assert len({e() for e in cases.values()}) == 1
+        print(f'{len(SQL):,} character template\n')
+        print(f'{"case":<14} {"us/render":>10}')
+        for name, function in cases.items():
+            print(f'{name:<14} {per_call(function, args.number):>10.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,170 @@
+import pyarrow as pa
+import pytest
+from arrows import google_sheets
+
+
+class _Request():
+    def __init__(self, result=None, error=None):
+        self.result = result
+        self.error = error
+
+    def execute(self, num_retries=0):
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+class _FakeValues():
+    # records values().update/clear calls, raising on the fail_on-th update
+    def __init__(self, fail_on=None):
+        self.updates = []
+        self.fail_on = fail_on
+
+    def update(self, spreadsheetId, range, valueInputOption, body):
+        self.updates.append((range, valueInputOption, body['values']))
+        if self.fail_on is not None and len(self.updates) == self.fail_on:
+            return _Request(error=RuntimeError('quota exceeded'))
+        return _Request({})
+
+    def clear(self, spreadsheetId, range):
+        return _Request({})
+
+    def batchUpdate(self, spreadsheetId, body):
+        self.updates.append((None, body['valueInputOption'], [row for e in body['data'] for row in e['values']]))
+        return _Request({})
+
+    def batchClear(self, spreadsheetId, body):
+        return _Request({})
+
+
+class _FakeService():
+    def __init__(self, values):
+        self._values = values
+
+    def spreadsheets(self):
+        return self
+
+    def values(self):
+        return self._values
+
+    def batchUpdate(self, spreadsheetId, body):
+        return _Request({})
+
+
+@pytest.fixture
+def sheet(tmp_path, monkeypatch):
+    monkeypatch.setattr(google_sheets, 'UPLOAD_PROGRESS_DIR', tmp_path)
+    monkeypatch.setattr(google_sheets._write_bucket, 'acquire', lambda: None)
+    monkeypatch.setattr(google_sheets.Sheet, 'exists', lambda self: True)
+    monkeypatch.setattr(google_sheets.Sheet, '_ensure_grid', lambda self, *args, **kwargs: None)
+    return google_sheets.Sheet('spreadsheet_id', 'Sheet1')
+
+
+def _upload(sheet, monkeypatch, data, fail_on=None, **kwargs):
+    values = _FakeValues(fail_on=fail_on)
+    monkeypatch.setattr(google_sheets, 'get_google_service', lambda *args: _FakeService(values))
+    try:
+        sheet.from_batches(data, chunk_rows=2, **kwargs)
+    except RuntimeError:
+        pass
+    return values.updates
+
+
+def _rows(updates):
+    return [row for _, _, values in updates[1:] for row in values]
+
+
+def test_new_upload_of_same_shape_is_not_skipped(sheet, monkeypatch):
+    first = pa.table({'a': [1, 2, 3, 4, 5, 6]})
+    # header, rows 1-2, rows 3-4 fail
+    _upload(sheet, monkeypatch, first, fail_on=3)
+    second = pa.table({'a': [7, 8, 9, 10, 11, 12]})
+    updates = _upload(sheet, monkeypatch, second)
+    assert _rows(updates) == [[7], [8], [9], [10], [11], [12]]
+    updates = _upload(sheet, monkeypatch, second, resume=True)
+    assert _rows(updates) == [[7], [8], [9], [10], [11], [12]]
+
+
+def test_resume_same_table(sheet, monkeypatch):
+    data = pa.table({'a': [1, 2, 3, 4, 5, 6]})
+    _upload(sheet, monkeypatch, data, fail_on=3)
+    updates = _upload(sheet, monkeypatch, data, resume=True)
+    # rows 1-2 were committed, no header is written again
+    assert [values for _, _, values in updates] == [[[3], [4]], [[5], [6]]]
+
+
+def test_resume_reader_by_upload_id(sheet, monkeypatch):
+    data = pa.table({'a': [1, 2, 3, 4, 5, 6]})
+    reader = lambda: pa.RecordBatchReader.from_batches(data.schema, data.to_batches(max_chunksize=2))
+    with pytest.raises(ValueError):
+        sheet.from_batches(reader(), resume=True)
+    _upload(sheet, monkeypatch, reader(), fail_on=3, upload_id='daily-2024-01-01')
+    updates = _upload(sheet, monkeypatch, reader(), resume=True, upload_id='daily-2024-01-01')
+    assert [values for _, _, values in updates] == [[[3], [4]], [[5], [6]]]
+
+
+def test_batch_writes_values_raw(sheet, monkeypatch):
+    values = _FakeValues()
+    monkeypatch.setattr(google_sheets, 'get_google_service', lambda *args: _FakeService(values))
+    monkeypatch.setattr(google_sheets.SpreadSheet, '_sheet_properties',
+                        lambda self: [{'sheetId': 1, 'title': 'Sheet1', 'gridProperties': {'rowCount': 100, 'columnCount': 20}}])
+    arrow = pa.table({'code': ['00123', '=SUM(A1:A2)', '2024-01-01']})
+    with sheet.spreadsheet.batch() as batch:
+        batch.write('Sheet1', arrow)
+    assert [(option, rows) for _, option, rows in values.updates] == [('RAW', [['code'], ['00123'], ['=SUM(A1:A2)'], ['2024-01-01']])]
+    with sheet.spreadsheet.batch(value_input_option='USER_ENTERED') as batch:
+        batch.write('Sheet1', arrow)
+    assert values.updates[-1][1] == 'USER_ENTERED'
+
+
+def test_upload_writes_values_raw(sheet, monkeypatch):
+    data = pa.table({'code': ['00123', '=HYPERLINK("x")']})
+    updates = _upload(sheet, monkeypatch, data)
+    assert {option for _, option, _ in updates} == {'RAW'}
+    assert _rows(updates) == [['00123'], ['=HYPERLINK("x")']]
+    updates = _upload(sheet, monkeypatch, data, value_input_option='USER_ENTERED')
+    assert {option for _, option, _ in updates} == {'USER_ENTERED'}
+
+
+class _RecordingService(_FakeService):
+    def __init__(self, values):
+        super().__init__(values)
+        self.requests = []
+
+    def batchUpdate(self, spreadsheetId, body):
+        self.requests += body['requests']
+        return _Request({})
+
+
+def _grid(rows, columns=20):
+    return [{'sheetId': 1, 'title': 'Sheet1', 'gridProperties': {'rowCount': rows, 'columnCount': columns}}]
+
+
+def test_batch_never_shrinks_a_sheet_grown_behind_the_snapshot(sheet, monkeypatch):
+    service = _RecordingService(_FakeValues())
+    monkeypatch.setattr(google_sheets, 'get_google_service', lambda *args: service)
+    # the snapshot predates a 5,000 row write
+    monkeypatch.setattr(google_sheets.SpreadSheet, '_sheet_properties', lambda self: _grid(100))
+    monkeypatch.setattr(google_sheets.SpreadSheet, 'refresh', lambda self: _grid(5000))
+    with sheet.spreadsheet.batch() as batch:
+        batch.write('Sheet1', pa.table({'a': list(range(199))}), sheet_range='H1', overwrite_sheet=False)
+    assert service.requests == []
+
+    monkeypatch.setattr(google_sheets.SpreadSheet, 'refresh', lambda self: _grid(150))
+    with sheet.spreadsheet.batch() as batch:
+        batch.write('Sheet1', pa.table({'a': list(range(199))}), sheet_range='H1', overwrite_sheet=False)
+    assert service.requests == [{'appendDimension': {'sheetId': 1, 'dimension': 'ROWS', 'length': 50}}]
+
+
+def test_ensure_grid_grows_from_the_current_size(monkeypatch):
+    service = _RecordingService(_FakeValues())
+    monkeypatch.setattr(google_sheets, 'get_google_service', lambda *args: service)
+    monkeypatch.setattr(google_sheets._write_bucket, 'acquire', lambda: None)
+    monkeypatch.setattr(google_sheets.SpreadSheet, '_sheet_properties', lambda self: _grid(100))
+    monkeypatch.setattr(google_sheets.SpreadSheet, 'refresh', lambda self: _grid(5000))
+    sheet = google_sheets.Sheet('spreadsheet_id', 'Sheet1', sheet_id=1)
+    sheet._ensure_grid(200, 5)
+    assert service.requests == []
+    sheet._ensure_grid(6000, 22)
+    assert service.requests == [{'appendDimension': {'sheetId': 1, 'dimension': 'ROWS', 'length': 1000}},
+                                {'appendDimension': {'sheetId': 1, 'dimension': 'COLUMNS', 'length': 2}}]
@@ -0,0 +1,27 @@
+import subprocess
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+HEAVY = ['boto3', 'awswrangler', 'pandas', 'polars', 'duckdb', 'googleapiclient', 'adbc_driver_postgresql',
+         'psycopg2', 'pyspark', 'redis', 'pymysql', 'jinja2', 'pyarrow']
+
+
+def _run(code):
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], cwd=ROOT, capture_output=True, text=True, check=True)
+    return result.stdout.strip(), result.stderr
+
+
+def test_import_loads_no_heavy_dependencies():
+    loaded, importtime = _run(f'import sys, arrows; print(",".join(k for k in {HEAVY!r} if k in sys.modules))')
+    assert loaded == ''
+    cumulative = next(int(line.split('|')[1]) for line in importtime.splitlines() if line.split('|')[-1].strip() == 'arrows')
+    # microseconds, the package itself only defines the lazy loader
+    assert cumulative < 50_000
+
+
+def test_submodules_load_on_first_access():
+    loaded, _ = _run('import sys, arrows; arrows.S3Dataset; print(",".join(k for k in ("boto3", "polars", "pandas", "googleapiclient") if k in sys.modules))')
+    assert loaded == ''
+    loaded, _ = _run('import sys, arrows; print(arrows.pool.__name__, "arrows.s3" in sys.modules)')
+    assert loaded == 'arrows.pool False'
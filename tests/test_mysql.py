@@ -0,0 +1,58 @@
+import datetime
+import pyarrow as pa
+import pytest
+from arrows import mysql
+
+
+def _tsv(arrow):
+    return b''.join(mysql._to_tsv(e) for e in arrow.to_batches()).decode()
+
+
+def test_tsv_escaping_and_nulls():
+    arrow = pa.table({'s': ['a\tb', 'c\\d\ne', None], 'i': [1, None, 3]})
+    assert _tsv(arrow) == 'a\\tb\t1\nc\\\\d\\ne\t\\N\n\\N\t3\n'
+
+
+def test_tsv_non_finite_floats_are_null():
+    arrow = pa.table({'f': [1.5, float('nan'), float('inf'), float('-inf'), None]})
+    assert _tsv(arrow) == '1.5\n\\N\n\\N\n\\N\n\\N\n'
+
+
+def test_tsv_durations_are_time_values():
+    arrow = pa.table({'d': pa.array([datetime.timedelta(hours=25, minutes=1, seconds=2, microseconds=3),
+                                     datetime.timedelta(microseconds=-1), None], pa.duration('us')),
+                      'ns': pa.array([1_500_000_001_000, 0, None], pa.duration('ns'))})
+    assert _tsv(arrow) == '25:01:02.000003\t00:25:00.000001\n-00:00:00.000001\t00:00:00.000000\n\\N\t\\N\n'
+    assert mysql._mysql_type(pa.duration('s')) == 'TIME(6)'
+
+
+def test_tsv_duration_outside_time_range():
+    arrow = pa.table({'d': pa.array([datetime.timedelta(hours=839)], pa.duration('us'))})
+    with pytest.raises(ValueError, match='TIME range'):
+        _tsv(arrow)
+
+
+class _Result():
+    unbuffered_active = True
+
+
+class _Cursor():
+    def __init__(self):
+        self._result = _Result()
+        self.closed = False
+
+    def close(self):
+        # pymysql's SSCursor.close reads the rest of an unfinished result
+        self.closed = True
+
+
+@pytest.mark.parametrize('exhausted', [False, True])
+def test_release_discards_half_read_connections_without_draining(monkeypatch, exhausted):
+    released = []
+    monkeypatch.setattr(mysql._pool, 'release', lambda conn, discard=False: released.append(discard))
+    cursor = _Cursor()
+    mysql._release(object(), cursor, exhausted)
+    assert cursor.closed == exhausted
+    assert released == [not exhausted]
+    if not exhausted:
+        assert not cursor._result.unbuffered_active
@@ -0,0 +1,98 @@
+import threading
+import time
+import pyarrow as pa
+import pytest
+
+fakeredis = pytest.importorskip('fakeredis')
+import redis as redis_client
+from arrows import redis
+
+
+@pytest.fixture
+def client(monkeypatch):
+    client = fakeredis.FakeRedis()
+    monkeypatch.setattr(redis, 'get_client', lambda: client)
+    return client
+
+
+def _table(rows=50_000):
+    return pa.table({'a': list(range(rows)), 'b': [str(i) for i in range(rows)]})
+
+
+def test_round_trip_in_chunks(client, monkeypatch):
+    monkeypatch.setattr(redis, 'CHUNK_SIZE', 10_000)
+    arrow = _table()
+    assert redis.put('key', arrow, ttl=60)
+    assert len(client.keys('arrows:result:key:*')) > redis.CHUNKS_PER_WRITE
+    assert redis.get('key').equals(arrow)
+    assert 0 < client.ttl('arrows:result:key') <= 60
+
+
+def test_missing_chunk_is_a_miss(client, monkeypatch):
+    monkeypatch.setattr(redis, 'CHUNK_SIZE', 10_000)
+    redis.put('key', _table(), ttl=60)
+    client.delete(client.keys('arrows:result:key:*')[0])
+    assert redis.get('key') is None
+
+
+def test_entry_cap(client, monkeypatch):
+    monkeypatch.setattr(redis, 'MAX_ENTRY_BYTES', 1000)
+    assert not redis.put('key', _table(), ttl=60)
+    assert client.keys('*') == []
+
+
+def test_single_flight(client):
+    # redis-py locks release with a Lua script
+    pytest.importorskip('lupa')
+    calls = []
+    def compute():
+        calls.append(1)
+        time.sleep(0.2)
+        return _table(1000)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(redis.cached(('query', 1), compute, ttl=60))) for _ in range(4)]
+    [e.start() for e in threads]
+    [e.join() for e in threads]
+    assert len(calls) == 1
+    assert all(e.equals(results[0]) for e in results)
+
+
+def test_write_failure_returns_result(client, monkeypatch):
+    pytest.importorskip('lupa')
+    def out_of_memory(*args, **kwargs):
+        raise redis_client.exceptions.ResponseError("OOM command not allowed when used memory > 'maxmemory'")
+    monkeypatch.setattr(redis, 'put', out_of_memory)
+    assert redis.cached(('query', 2), lambda: _table(10), ttl=60).num_rows == 10
+    assert client.keys('arrows:result:*:lock') == []
+
+
+def test_unavailable_redis_runs_query(monkeypatch):
+    def unavailable():
+        raise redis_client.exceptions.TimeoutError('timed out')
+    monkeypatch.setattr(redis, 'get_client', unavailable)
+    assert redis.cached(('query', 3), lambda: _table(10), ttl=60).num_rows == 10
+
+
+@pytest.mark.parametrize('fail', [False, True])
+def test_uncacheable_results_are_computed_concurrently(client, monkeypatch, fail):
+    pytest.importorskip('lupa')
+    monkeypatch.setattr(redis, 'MAX_ENTRY_BYTES', 1000)
+    calls = []
+    def compute():
+        calls.append(1)
+        time.sleep(0.3)
+        if fail:
+            raise RuntimeError('query failed')
+        return _table(1000)
+    def run():
+        try:
+            redis.cached(('query', 4, fail), compute, ttl=60)
+        except RuntimeError:
+            pass
+    threads = [threading.Thread(target=run) for _ in range(4)]
+    start = time.perf_counter()
+    [e.start() for e in threads]
+    [e.join() for e in threads]
+    assert len(calls) == 4
+    # the waiters run together once the first compute is marked uncacheable, not one after another
+    assert time.perf_counter() - start < 0.3 * 3
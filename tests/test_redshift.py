@@ -0,0 +1,119 @@
+import duckdb
+import pytest
+from arrows import redshift
+
+
+def _slice_of(keys, predicates):
+    # slice index matched by each key, evaluated with duckdb whose MOD also keeps the dividend's sign
+    values = ', '.join(f'({e})' for e in keys)
+    cases = ' '.join(f'WHEN {predicate} THEN {i}' for i, predicate in enumerate(predicates))
+    rows = duckdb.sql(f'SELECT k, list(CASE {cases} END) FROM (VALUES {values}) t(k) GROUP BY k').fetchall()
+    return {k: matched for k, matched in rows}
+
+
+def test_modulo_predicates_cover_negative_keys():
+    keys = list(range(-20, 21))
+    slices = _slice_of(keys, redshift._modulo_predicates('k', 4))
+    assert all(matched[0] is not None for matched in slices.values())
+    assert sorted(slices) == keys
+
+
+def test_range_bounds_bigint_exact():
+    low, high = 2**62, 2**62 + 10
+    bounds = redshift._range_bounds(low, high, 4)
+    assert all(isinstance(e, int) for e in bounds)
+    assert bounds == [low, low + 2, low + 5, low + 7]
+
+
+def test_range_bounds_cover_every_key_once():
+    low, high, slices = -7, 2**53 + 3, 5
+    bounds = redshift._range_bounds(low, high, slices) + [high + 1]
+    keys = [low, low + 1, 0, 2**53 - 1, 2**53, 2**53 + 1, high - 1, high] + bounds[1:-1]
+    for key in keys:
+        assert sum(bounds[i] <= key < bounds[i + 1] for i in range(slices)) == 1
+
+
+def test_stream_with_slices_raises():
+    with pytest.raises(ValueError):
+        redshift.fetch_arrow('SELECT 1', engine='adbc', stream=True, slices=4, slice_column='id')
+
+
+def test_dedupe_keeps_last_row_with_nested_columns():
+    import pyarrow as pa
+    arrow = pa.table({'id': [1, 2, 1, 3, 2],
+                      'tags': [['a'], ['b'], None, ['c'], ['d', 'e']],
+                      'info': [{'x': 1}, {'x': 2}, {'x': 3}, None, {'x': 5}],
+                      'value': [10, 20, None, 40, 50]})
+    deduped = redshift._dedupe(arrow, ['id'])
+    assert deduped.to_pylist() == [
+        {'id': 1, 'tags': None, 'info': {'x': 3}, 'value': None},
+        {'id': 3, 'tags': ['c'], 'info': None, 'value': 40},
+        {'id': 2, 'tags': ['d', 'e'], 'info': {'x': 5}, 'value': 50},
+    ]
+
+
+def test_dedupe_precombine_key():
+    import pyarrow as pa
+    arrow = pa.table({'id': [1, 1, 1, 2, 2], 'version': [3, None, 1, 1, 1], 'tags': [['new'], ['null'], ['old'], ['a'], ['b']]})
+    deduped = redshift._dedupe(arrow, ['id'], precombine_key='version')
+    assert sorted(deduped.to_pylist(), key=lambda e: e['id']) == [
+        {'id': 1, 'version': 3, 'tags': ['new']},
+        {'id': 2, 'version': 1, 'tags': ['b']},
+    ]
+
+
+def test_dedupe_empty_and_composite_keys():
+    import pyarrow as pa
+    arrow = pa.table({'a': [1, 1, 1], 'b': ['x', 'y', 'x'], 'v': [[1], [2], [3]]})
+    assert redshift._dedupe(arrow, ['a', 'b']).to_pylist() == [{'a': 1, 'b': 'y', 'v': [2]}, {'a': 1, 'b': 'x', 'v': [3]}]
+    assert redshift._dedupe(arrow.slice(0, 0), ['a']).num_rows == 0
+
+
+def test_slice_count_fallback_is_retried(monkeypatch):
+    import contextlib
+    results = [RuntimeError('connection reset'), 16]
+    
+    class Cursor():
+        def execute(self, sql):
+            result = results.pop(0)
+            if isinstance(result, Exception):
+                raise result
+            self.result = result
+        def fetchone(self):
+            return (self.result,)
+        def close(self):
+            pass
+    
+    class Connection():
+        def cursor(self):
+            return Cursor()
+    
+    now = [1000.0]
+    monkeypatch.setattr(redshift, 'connection', lambda *args: contextlib.nullcontext(Connection()))
+    monkeypatch.setattr(redshift.time, 'monotonic', lambda: now[0])
+    monkeypatch.setattr(redshift, '_slice_count', (None, None))
+    assert redshift.get_slice_count() == redshift.DEFAULT_SLICE_COUNT
+    assert redshift.get_slice_count() == redshift.DEFAULT_SLICE_COUNT
+    now[0] += redshift.SLICE_COUNT_RETRY_SECONDS + 1
+    assert redshift.get_slice_count() == 16
+    now[0] += 10 ** 6
+    assert redshift.get_slice_count() == 16
+    assert results == []
+
+
+def test_temporary_unloads_skip_the_local_cache(monkeypatch):
+    import pyarrow as pa
+    from arrows import s3
+    unloaded = []
+    def unload(sql, s3_path=None, **kwargs):
+        unloaded.append(s3_path)
+        return s3_path
+    monkeypatch.setattr(redshift, 'unload', unload)
+    monkeypatch.setattr(s3.S3Dataset, 'to_batches', lambda self, batch_size=None: pa.RecordBatchReader.from_batches(pa.schema([]), []))
+    monkeypatch.setattr(s3.S3Dataset, 'delete', lambda self: None)
+    s3.enable_local_cache()
+    try:
+        redshift.fetch_batches('SELECT 1', bucket='bucket').close()
+    finally:
+        s3.disable_local_cache()
+    assert unloaded[0].cache is None
@@ -0,0 +1,191 @@
+import datetime
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+import pytest
+from pyarrow.fs import LocalFileSystem
+from arrows import s3
+
+
+def _local(tmp_path, monkeypatch, cache=False):
+    # an S3Dataset whose files live in tmp_path/data
+    dataset = s3.S3Dataset(s3_path=f's3://{tmp_path}/data/', cache=cache)
+    dataset.s3 = LocalFileSystem()
+    monkeypatch.setattr(dataset, '_parquet_glob', lambda: f'{tmp_path}/data/**/*.parquet')
+    monkeypatch.setattr(dataset, '_copy_destination', lambda: f'{tmp_path}/data')
+    return dataset
+
+
+@pytest.fixture
+def local_dataset(tmp_path, monkeypatch):
+    dataset = _local(tmp_path, monkeypatch)
+    dataset.from_arrow(pa.table({'a': [1, 2, 3], 'b': ['x', 'y', 'z']}))
+    return dataset
+
+
+def test_to_polars_expression_filter(local_dataset):
+    pytest.importorskip('polars')
+    df = local_dataset.to_polars(filter=ds.field('a') > 1)
+    assert df['a'].to_list() == [2, 3]
+
+
+def test_to_polars_expression_filter_and_columns(local_dataset):
+    pytest.importorskip('polars')
+    df = local_dataset.to_polars(filter=ds.field('b') == 'x', columns=['a'])
+    assert df.to_dict(as_series=False) == {'a': [1]}
+
+
+def test_query_batches_close_early_closes_connection(tmp_path, monkeypatch):
+    import duckdb
+    from arrows import duckdb_session
+    pq.write_table(pa.table({'a': list(range(100_000))}), tmp_path/'part-0.parquet')
+    dataset = s3.S3Dataset(s3_path='s3://bucket/local/', cache=False)
+    monkeypatch.setattr(dataset, '_parquet_source', lambda: f"read_parquet('{tmp_path}/*.parquet')")
+    connections = []
+    connect = duckdb_session.connect
+    monkeypatch.setattr(duckdb_session, 'connect', lambda **settings: connections.append(connect(**settings)) or connections[-1])
+    
+    reader = dataset.query_batches('SELECT * FROM self ORDER BY a', batch_size=1000,
+                                   memory_limit='100MB', temp_directory=str(tmp_path/'spill'))
+    assert reader.read_next_batch().num_rows == 1000
+    reader.close()
+    with pytest.raises(duckdb.ConnectionException):
+        connections[0].execute('SELECT 1')
+
+
+def test_io_threads_are_set_explicitly():
+    count = pa.io_thread_count()
+    try:
+        s3.S3Dataset(s3_path='s3://bucket/path/', fragment_readahead=4)
+        assert pa.io_thread_count() == count
+        s3.set_io_threads(count + 3)
+        assert pa.io_thread_count() == count + 3
+    finally:
+        pa.set_io_thread_count(count)
+
+
+def test_partition_paths_match_the_writers(tmp_path):
+    import duckdb
+    arrow = pa.table({'p': ['a b', 'x/y', None, 'k=v'], 'd': pa.array([1, 2, 3, None], pa.int32()), 'v': [1, 2, 3, 4]})
+    paths = s3._partition_paths(arrow, ['p', 'd'])
+    assert 'p=__HIVE_DEFAULT_PARTITION__/d=3' in paths
+    assert 'p=x%2Fy/d=2' in paths
+    ds.write_dataset(arrow, str(tmp_path/'pyarrow'), format='parquet', partitioning=['p', 'd'], partitioning_flavor='hive')
+    duckdb.sql(f"COPY (SELECT * FROM arrow) TO '{tmp_path/'duckdb'}' (FORMAT parquet, PARTITION_BY (p, d))")
+    for writer in ('pyarrow', 'duckdb'):
+        written = sorted(str(e.parent.relative_to(tmp_path/writer)) for e in (tmp_path/writer).rglob('*.parquet'))
+        assert written == sorted(paths)
+
+
+def _events():
+    return pa.table({
+        'd': pa.array([datetime.date(2024, 1, 1), datetime.date(2024, 1, 2)] * 3, pa.date32()),
+        'n': [1, 2, 1, 2, 1, 2],
+        'v': [6, 5, 4, 3, 2, 1],
+    })
+
+
+@pytest.mark.parametrize('cache', [False, True])
+def test_engines_read_partitions_alike(tmp_path, monkeypatch, cache):
+    pytest.importorskip('polars')
+    cache = s3.LocalCache(cache_dir=tmp_path/'cache') if cache else False
+    dataset = _local(tmp_path, monkeypatch, cache=cache)
+    dataset.from_arrow(_events(), partition_by=['d', 'n'], sort_by=['v'])
+    day = [('d', '=', '2024-01-01')]
+    results = {
+        'pyarrow': dataset.to_arrow(filter=day),
+        'duckdb': dataset.to_arrow(engine='duckdb', filter=day),
+        'duckdb expression': dataset.to_duckdb(filter=ds.field('d') == '2024-01-01').to_arrow_table(),
+        'polars': dataset.to_polars(filter=day).to_arrow(),
+    }
+    for engine, arrow in results.items():
+        arrow = arrow.select(['d', 'n', 'v']).sort_by('v')
+        assert arrow.column('d').to_pylist() == ['2024-01-01'] * 3, engine
+        assert pa.types.is_string(arrow.schema.field('d').type) or pa.types.is_large_string(arrow.schema.field('d').type), engine
+        assert pa.types.is_int32(arrow.schema.field('n').type), engine
+        assert arrow.column('v').to_pylist() == [2, 4, 6], engine
+
+
+def test_cache_prunes_partitions_before_downloading(tmp_path, monkeypatch):
+    cache = s3.LocalCache(cache_dir=tmp_path/'cache')
+    dataset = _local(tmp_path, monkeypatch, cache=cache)
+    dataset.from_arrow(_events(), partition_by='d')
+    assert dataset.to_arrow(filter=[('d', '=', '2024-01-02')]).num_rows == 3
+    cached = [e.parent.name for e in (tmp_path/'cache').rglob('*.parquet')]
+    assert cached == ['d=2024-01-02']
+
+
+def test_to_polars_and_sql_skip_the_manifest(tmp_path, monkeypatch):
+    pytest.importorskip('polars')
+    dataset = _local(tmp_path, monkeypatch)
+    dataset.from_arrow(_events(), partition_by='d')
+    dataset.write_manifest({'watermark': 6})
+    assert dataset.to_polars().height == 6
+    assert dataset.sql('SELECT count(*) FROM self').fetchone() == (6,)
+
+
+def test_reads_over_the_cache_budget_are_not_cached(tmp_path, monkeypatch):
+    cache = s3.LocalCache(cache_dir=tmp_path/'cache', max_bytes=100)
+    dataset = _local(tmp_path, monkeypatch, cache=cache)
+    dataset.from_arrow(_events(), partition_by='d')
+    assert dataset.to_arrow().num_rows == 6
+    assert list((tmp_path/'cache').rglob('*.parquet')) == []
+
+
+
+def test_engines_read_unpartitioned_datasets(tmp_path, monkeypatch):
+    pytest.importorskip('polars')
+    dataset = _local(tmp_path, monkeypatch)
+    dataset.from_arrow(_events())
+    assert dataset.to_arrow(engine='duckdb').num_rows == 6
+    assert dataset.to_polars().columns == ['d', 'n', 'v']
+
+def test_query_to_s3_rewrites_in_place(tmp_path, monkeypatch):
+    dataset = _local(tmp_path, monkeypatch)
+    dataset.from_arrow(_events())
+    dataset.write_manifest({'watermark': 6})
+    dataset.query_to_s3('SELECT * FROM self WHERE v > 3', target=dataset, temp_directory=str(tmp_path/'spill'))
+    assert sorted(dataset.to_arrow().column('v').to_pylist()) == [4, 5, 6]
+    assert dataset.read_manifest() == {'watermark': 6}
+
+
+def test_query_to_s3_failure_keeps_the_target(tmp_path, monkeypatch):
+    import duckdb
+    dataset = _local(tmp_path, monkeypatch)
+    dataset.from_arrow(_events())
+    with pytest.raises(duckdb.Error):
+        dataset.query_to_s3("SELECT CASE WHEN v = 1 THEN error('boom') END AS v FROM self", target=dataset,
+                            temp_directory=str(tmp_path/'spill'))
+    assert dataset.to_arrow().num_rows == 6
+
+
+def test_query_keeps_columns_named_like_inputs(tmp_path, monkeypatch):
+    dataset = _local(tmp_path, monkeypatch)
+    dataset.from_arrow(pa.table({'id': [1, 2], 'users': ['a', 'b']}))
+    users = _local(tmp_path/'users', monkeypatch)
+    users.from_arrow(pa.table({'id': [1], 'name': ['x']}))
+    result = dataset.query('SELECT users, users.name FROM self JOIN users USING (id)', users=users).fetchall()
+    assert result == [('a', 'x')]
+
+
+@pytest.mark.parametrize('engine', ['pyarrow', 'duckdb'])
+def test_from_arrow_accepts_a_single_sort_column(tmp_path, monkeypatch, engine):
+    dataset = _local(tmp_path, monkeypatch)
+    dataset.from_arrow(_events(), engine=engine, partition_by='d', sort_by='v')
+    arrow = dataset.to_arrow(filter=[('d', '=', '2024-01-01')])
+    assert arrow.column('v').to_pylist() == [2, 4, 6]
+
+
+@pytest.mark.parametrize('lazy', [False, True])
+def test_from_polars_honors_target_file_size(tmp_path, monkeypatch, lazy):
+    pl = pytest.importorskip('polars')
+    dataset = _local(tmp_path, monkeypatch)
+    dataset.target_file_size = 2 * 1024 * 1024
+    df = pl.DataFrame({'a': range(1_000_000), 'b': [1.5] * 1_000_000})
+    dataset.from_polars(df.lazy() if lazy else df)
+    assert 4 <= len(dataset._files()) <= 16
+    assert dataset.to_arrow().num_rows == 1_000_000
+
+
+def test_row_bytes():
+    assert s3._row_bytes(pa.schema([('a', pa.int64()), ('b', pa.bool_()), ('c', pa.string())])) == 8 + 1 + 32
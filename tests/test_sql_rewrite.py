@@ -0,0 +1,78 @@
+import duckdb
+import pytest
+from arrows.utils import _rename_tables, _bind_tables, _parse_self_sql
+
+# (sql, expected) with self renamed to df
+CORPUS = [
+    ('select * from self', 'select * from df'),
+    ('SELECT * FROM SELF', 'SELECT * FROM df'),
+    ('select * from "self"', 'select * from df'),
+    ('select "Self"."id" from "SELF"', 'select df."id" from df'),
+    ('select self.id from self', 'select df.id from df'),
+    ('select * from self as s, self', 'select * from df as s, df'),
+    ('select * from (select * from self) s', 'select * from (select * from df) s'),
+    ('select * from self where id in (select id from self_backup)', 'select * from df where id in (select id from self_backup)'),
+    # string literals, dollar quoting and comments are left alone
+    ("select 'from self' as s from self", "select 'from self' as s from df"),
+    ("select * from self where name = 'it''s self'", "select * from df where name = 'it''s self'"),
+    ("select E'from \\' self' from self", "select E'from \\' self' from df"),
+    ('select $$from self$$ from self', 'select $$from self$$ from df'),
+    ('select * from self -- from self\n', 'select * from df -- from self\n'),
+    ('/* from self */ select * from self', '/* from self */ select * from df'),
+    # columns of other tables, schema qualified tables and function calls are not table references
+    ('select t.self from t', 'select t.self from t'),
+    ('select * from main.self', 'select * from main.self'),
+    ('select self(x) from t', 'select self(x) from t'),
+    # only table positions and column qualifiers are renamed, columns named like an input are not
+    ('select self from t', 'select self from t'),
+    ('select self, t.x from t join self using (id) where self in (1, 2)', 'select self, t.x from t join df using (id) where self in (1, 2)'),
+    ('select * from t, self order by self', 'select * from t, df order by self'),
+    ('from self select self.self', 'from df select df.self'),
+    ('select * from self.events', 'select * from self.events'),
+    # a CTE named self shadows the input
+    ('with self as (select 1) select * from self', 'with self as (select 1) select * from self'),
+    ('with self(a) as materialized (select 1) select * from self', 'with self(a) as materialized (select 1) select * from self'),
+]
+
+
+@pytest.mark.parametrize('sql, expected', CORPUS)
+def test_rename_corpus(sql, expected):
+    assert _parse_self_sql(sql, 'self', 'df') == expected
+
+
+# unreserved keywords that duckdb tokenizes as keywords, all valid table names
+KEYWORD_NAMES = ['data', 'source', 'target', 'input', 'new', 'old', 'names', 'groups', 'year', 'day', 'version']
+
+
+@pytest.mark.parametrize('name', KEYWORD_NAMES)
+def test_rename_keyword_names(name):
+    assert _rename_tables(f'select * from {name} join other using (id)', ((name, 'df'),)) == 'select * from df join other using (id)'
+    assert _rename_tables(f'with {name} as (select 1) select * from {name}', ((name, 'df'),)) == f'with {name} as (select 1) select * from {name}'
+    bound = _bind_tables(f'SELECT count(*) FROM {name}', ((name, 'range(3)'),))
+    assert duckdb.sql(bound).fetchall() == [(3,)]
+
+
+def test_rename_multiple_inputs():
+    sql = 'select * from self join other using (id) where other.x > self.x'
+    assert _rename_tables(sql, (('self', 'a'), ('other', 'b'))) == 'select * from a join b using (id) where b.x > a.x'
+
+
+@pytest.mark.parametrize('sql, expected', [
+    ('select count(*) from self', 10),
+    ('select count(*) from self join other using (range)', 5),
+    ("select count(*) from self where 'from self' <> 'from other'", 10),
+    ('with x as (select * from self) select count(*) from x', 10),
+    ('WITH RECURSIVE t(n) AS (SELECT 1 UNION ALL SELECT n + 1 FROM t WHERE n < 3) SELECT count(*) FROM t, self', 30),
+    ('with other as (select 1) select count(*) from self, other', 10),
+])
+def test_bind_tables_runs(sql, expected):
+    bound = _bind_tables(sql, (('self', 'range(10)'), ('other', 'range(5)')))
+    assert duckdb.sql(bound).fetchall() == [(expected,)]
+
+
+def test_rewrites_are_memoized():
+    _rename_tables.cache_clear()
+    for _ in range(3):
+        _parse_self_sql('select * from self limit 7', 'self', 'df')
+    info = _rename_tables.cache_info()
+    assert (info.hits, info.misses) == (2, 1)
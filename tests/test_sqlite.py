@@ -0,0 +1,63 @@
+import sqlite3
+import pyarrow as pa
+import pytest
+from arrows import sqlite
+
+
+@pytest.fixture
+def database(tmp_path):
+    path = str(tmp_path/'test.db')
+    conn = sqlite3.connect(path)
+    conn.execute('CREATE TABLE typed (id INTEGER, late_value INTEGER, name TEXT, amount REAL)')
+    # late_value is NULL for the whole first batch
+    conn.executemany('INSERT INTO typed VALUES (?, ?, ?, ?)',
+                     [(i, None if i < 10 else i, f'n{i}', i / 2) for i in range(25)])
+    conn.execute('CREATE TABLE untyped (value)')
+    conn.executemany('INSERT INTO untyped VALUES (?)', [(None,)] * 10 + [(1,), (2.5,), ('text',), (b'\x00',)])
+    conn.execute('CREATE TABLE mixed (value INTEGER)')
+    conn.executemany('INSERT INTO mixed VALUES (?)', [(1,), ('not a number',), (None,)])
+    conn.commit()
+    conn.close()
+    return path
+
+
+def test_declared_types_survive_null_first_batch(database):
+    reader = sqlite.fetch_batches('SELECT * FROM typed ORDER BY id', database=database, batch_size=5)
+    assert reader.schema == pa.schema([('id', pa.int64()), ('late_value', pa.int64()),
+                                       ('name', pa.string()), ('amount', pa.float64())])
+    arrow = reader.read_all()
+    assert arrow.column('late_value').to_pylist() == [None] * 10 + list(range(10, 25))
+
+
+def test_fetch_arrow_unifies_types_across_batches(database):
+    arrow = sqlite.fetch_arrow('SELECT value FROM untyped ORDER BY rowid', database=database, batch_size=5)
+    assert arrow.schema.field('value').type == pa.string()
+    assert arrow.column('value').to_pylist() == [None] * 10 + ['1', '2.5', 'text', '\x00']
+    arrow = sqlite.fetch_arrow('SELECT value FROM untyped WHERE typeof(value) IN (\'integer\', \'real\', \'null\') ORDER BY rowid',
+                               database=database, batch_size=11)
+    assert arrow.column('value').type == pa.float64()
+    assert arrow.column('value').to_pylist() == [None] * 10 + [1.0, 2.5]
+
+
+def test_mixed_integer_and_text(database):
+    arrow = sqlite.fetch_arrow('SELECT value FROM mixed ORDER BY rowid', database=database)
+    assert arrow.column('value').to_pylist() == ['1', 'not a number', None]
+    with pytest.raises(ValueError, match='value'):
+        sqlite.fetch_arrow('SELECT value FROM mixed ORDER BY rowid', database=database, stream=True).read_all()
+    schema = pa.schema([('value', pa.string())])
+    arrow = sqlite.fetch_arrow('SELECT value FROM mixed ORDER BY rowid', database=database, stream=True, schema=schema).read_all()
+    assert arrow.column('value').to_pylist() == ['1', 'not a number', None]
+
+
+def test_expressions_and_empty_results(database):
+    arrow = sqlite.fetch_arrow('SELECT id + 1 AS next_id, upper(name) AS name FROM typed WHERE id < 2 ORDER BY id', database=database)
+    assert arrow.to_pydict() == {'next_id': [1, 2], 'name': ['N0', 'N1']}
+    arrow = sqlite.fetch_arrow('SELECT id, name FROM typed WHERE id < 0', database=database)
+    assert arrow.num_rows == 0
+    assert arrow.schema == pa.schema([('id', pa.int64()), ('name', pa.string())])
+
+
+def test_round_trip(database):
+    arrow = pa.table({'a': [1, None, 3], 'b': ['x', None, 'z'], 'c': [0.5, 1.5, None]})
+    sqlite.arrow_to_sqlite(arrow, 'round_trip', mode='overwrite', database=database)
+    assert sqlite.fetch_arrow('SELECT * FROM round_trip', database=database).equals(arrow)
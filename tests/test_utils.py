@@ -0,0 +1,63 @@
+import gc
+import pyarrow as pa
+import pytest
+from arrows.utils import _close_on_exhaust
+
+
+def _reader(released, rows=10, error=None):
+    arrow = pa.table({'a': list(range(rows))})
+    def release():
+        released.append(True)
+        if error is not None:
+            raise error
+    return _close_on_exhaust(pa.RecordBatchReader.from_batches(arrow.schema, arrow.to_batches(max_chunksize=3)), release)
+
+
+def test_close_runs_callbacks_once():
+    released = []
+    reader = _reader(released)
+    reader.read_next_batch()
+    reader.close()
+    reader.close()
+    assert released == [True]
+    assert reader.closed
+    with pytest.raises(ValueError):
+        reader.read_next_batch()
+
+
+def test_exhaustion_runs_callbacks():
+    released = []
+    assert sum(batch.num_rows for batch in _reader(released)) == 10
+    assert released == [True]
+    released = []
+    assert _reader(released).read_all().num_rows == 10
+    assert released == [True]
+
+
+def test_context_manager_runs_callbacks():
+    released = []
+    with _reader(released) as reader:
+        reader.read_next_batch()
+    assert released == [True]
+
+
+def test_arrow_consumers_run_callbacks():
+    released = []
+    reader = _reader(released)
+    assert not isinstance(reader, pa.RecordBatchReader)
+    stream = pa.RecordBatchReader.from_stream(reader)
+    assert isinstance(stream, pa.RecordBatchReader)
+    assert stream.read_all().num_rows == 10
+    assert released == [True]
+
+
+def test_callback_errors(capsys):
+    released = []
+    with pytest.raises(RuntimeError):
+        _reader(released, error=RuntimeError('release failed')).close()
+    # garbage collection cannot raise, the error is printed
+    reader = _reader(released, error=RuntimeError('release failed on gc'))
+    del reader
+    gc.collect()
+    assert released == [True, True]
+    assert 'release failed on gc' in capsys.readouterr().out